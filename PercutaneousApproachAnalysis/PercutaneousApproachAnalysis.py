@@ -2,7 +2,9 @@ import os
 import unittest
 from __main__ import vtk, qt, ctk, slicer
 import time
+import logging
 import math
+import multiprocessing
 
 
 class PercutaneousApproachAnalysis:
@@ -108,6 +110,15 @@ class PercutaneousApproachAnalysisWidget:
     self.targetSelector.setToolTip( "Pick up the target point" )
     parametersFormLayout.addRow("Target Point: ", self.targetSelector)
 
+    #
+    # Check box for analyzing all the control points of the target node
+    #
+    self.multiTargetCheckBox = ctk.ctkCheckBox()
+    self.multiTargetCheckBox.text = "All Target Points"
+    self.multiTargetCheckBox.toolTip = "Score every control point of the target node in one run; the paths are made for the first one."
+    self.multiTargetCheckBox.checked = False
+    parametersFormLayout.addRow(self.multiTargetCheckBox)
+
     #
     # Entry point list (vtkMRMLMarkupsFiducialNode)
     #
@@ -133,6 +144,27 @@ class PercutaneousApproachAnalysisWidget:
     self.targetModelSelector.showChildNodeTypes = False
     self.targetModelSelector.setMRMLScene( slicer.mrmlScene )
     self.targetModelSelector.setToolTip( "Pick the target model to the algorithm." )
+    parametersFormLayout.addRow("Target Model: ", self.targetModelSelector)
+
+    #
+    # Subsampling of the target model vertices
+    #
+    self.targetSamplingSpinBox = qt.QDoubleSpinBox()
+    self.targetSamplingSpinBox.minimum = 0.0
+    self.targetSamplingSpinBox.maximum = 50.0
+    self.targetSamplingSpinBox.value = 0.0
+    self.targetSamplingSpinBox.suffix = " mm"
+    self.targetSamplingSpinBox.setToolTip( "Use one target model vertex per cube of this size (0 uses all the vertices)." )
+    parametersFormLayout.addRow("      Sampling:", self.targetSamplingSpinBox)
+
+    #
+    # Check box for the accessibility score map on the target model
+    #
+    self.targetMapCheckBox = ctk.ctkCheckBox()
+    self.targetMapCheckBox.text = "Target Accessibility Map"
+    self.targetMapCheckBox.toolTip = "Color the target model by the accessible skin area score of each of its vertices."
+    self.targetMapCheckBox.checked = False
+    parametersFormLayout.addRow(self.targetMapCheckBox)
 
     #
     # Skin model (vtkMRMLModelNode)
@@ -183,6 +215,79 @@ class PercutaneousApproachAnalysisWidget:
     self.obstacleModelOpacitySlider.value = 1000
     self.obstacleModelOpacitySlider.enabled = True
     parametersFormLayout.addRow("      Opacity:", self.obstacleModelOpacitySlider)
+
+    #
+    # Needle length slider; the score and the color map follow it without
+    # casting the rays again
+    #
+    self.needleLengthSlider = ctk.ctkSliderWidget()
+    self.needleLengthSlider.decimals = 0
+    self.needleLengthSlider.minimum = 10
+    self.needleLengthSlider.maximum = 300
+    self.needleLengthSlider.value = 130
+    self.needleLengthSlider.suffix = " mm"
+    self.needleLengthSlider.toolTip = "Reach of the needle: farther skin triangles do not count in the accessibility score and the color map."
+    parametersFormLayout.addRow("Needle Length: ", self.needleLengthSlider)
+
+    #
+    # Culling of the path entry points before ray casting
+    #
+    self.cullReachCheckBox = ctk.ctkCheckBox()
+    self.cullReachCheckBox.text = "Skip Entry Points Beyond Needle Length"
+    self.cullReachCheckBox.toolTip = "Do not cast the rays of skin points farther from the target than the needle length."
+    self.cullReachCheckBox.checked = False
+    parametersFormLayout.addRow(self.cullReachCheckBox)
+
+    self.cullBackFacingCheckBox = ctk.ctkCheckBox()
+    self.cullBackFacingCheckBox.text = "Skip Back-Facing Entry Points"
+    self.cullBackFacingCheckBox.toolTip = "Do not cast the rays of skin points whose normal faces away from the target."
+    self.cullBackFacingCheckBox.checked = False
+    parametersFormLayout.addRow(self.cullBackFacingCheckBox)
+
+    self.maximumInsertionAngleSpinBox = qt.QDoubleSpinBox()
+    self.maximumInsertionAngleSpinBox.minimum = 0.0
+    self.maximumInsertionAngleSpinBox.maximum = 90.0
+    self.maximumInsertionAngleSpinBox.value = 0.0
+    self.maximumInsertionAngleSpinBox.suffix = " deg"
+    self.maximumInsertionAngleSpinBox.setToolTip( "Do not cast the rays of paths making a larger angle with the skin normal (0 accepts any angle)." )
+    parametersFormLayout.addRow("Max. Insertion Angle: ", self.maximumInsertionAngleSpinBox)
+
+    #
+    # Number of worker threads for ray casting
+    #
+    self.numberOfWorkersSpinBox = qt.QSpinBox()
+    self.numberOfWorkersSpinBox.minimum = 1
+    self.numberOfWorkersSpinBox.maximum = multiprocessing.cpu_count()
+    self.numberOfWorkersSpinBox.value = 1
+    self.numberOfWorkersSpinBox.setToolTip( "Number of threads used to cast the rays." )
+    parametersFormLayout.addRow("Worker Threads: ", self.numberOfWorkersSpinBox)
+
+    #
+    # Check box for the on-disk result cache
+    #
+    self.diskCacheCheckBox = ctk.ctkCheckBox()
+    self.diskCacheCheckBox.text = "Cache Results on Disk"
+    self.diskCacheCheckBox.toolTip = "Keep the preprocessed skin and obstacle and the visibility of every analyzed target in the Slicer temporary directory, so that the same analysis is restored without preprocessing or ray casting."
+    self.diskCacheCheckBox.checked = True
+    parametersFormLayout.addRow(self.diskCacheCheckBox)
+
+    #
+    # Check box for live update when the target point is moved
+    #
+    self.liveUpdateCheckBox = ctk.ctkCheckBox()
+    self.liveUpdateCheckBox.text = "Live Update"
+    self.liveUpdateCheckBox.toolTip = "Update the color map and the paths while the target point or the obstacle model is modified."
+    self.liveUpdateCheckBox.checked = False
+    parametersFormLayout.addRow(self.liveUpdateCheckBox)
+
+    #
+    # Check box for the coarse-to-fine color map
+    #
+    self.progressiveCheckBox = ctk.ctkCheckBox()
+    self.progressiveCheckBox.text = "Progressive Color Map"
+    self.progressiveCheckBox.toolTip = "Display a coarse color map first and refine it up to the full resolution."
+    self.progressiveCheckBox.checked = True
+    parametersFormLayout.addRow(self.progressiveCheckBox)
    
     #
     # Apply Button
@@ -192,8 +297,24 @@ class PercutaneousApproachAnalysisWidget:
     self.applyButton.enabled = False    
     parametersFormLayout.addRow(self.applyButton)
 
+    #
+    # Progress of the analysis running in the background
+    #
+    self.progressBar = qt.QProgressBar()
+    self.progressBar.minimum = 0
+    self.progressBar.maximum = 100
+    self.progressBar.value = 0
+    self.progressBar.visible = False
+    parametersFormLayout.addRow(self.progressBar)
+
+    self.cancelButton = qt.QPushButton("Cancel")
+    self.cancelButton.toolTip = "Stop the running analysis."
+    self.cancelButton.enabled = False
+    parametersFormLayout.addRow(self.cancelButton)
+
     # connections
     self.applyButton.connect('clicked(bool)', self.onApplyButton)
+    self.cancelButton.connect('clicked(bool)', self.onCancelButton)
     self.targetSelector.connect("currentNodeChanged(vtkMRMLNode*)", self.onSelect)
     self.targetModelSelector.connect("currentNodeChanged(vtkMRMLNode*)", self.onSelect)
     self.obstacleModelSelector.connect("currentNodeChanged(vtkMRMLNode*)", self.onSelect)
@@ -202,6 +323,43 @@ class PercutaneousApproachAnalysisWidget:
 
     self.skinModelOpacitySlider.connect('valueChanged(double)', self.skinModelOpacitySliderValueChanged)
     self.obstacleModelOpacitySlider.connect('valueChanged(double)', self.obstacleModelOpacitySliderValueChanged)
+    self.needleLengthSlider.connect('valueChanged(double)', self.needleLengthSliderValueChanged)
+    self.liveUpdateCheckBox.connect("clicked(bool)", self.onCheckLiveUpdate)
+
+    # Live update: a coarse preview shortly after the target moves, and the
+    # full analysis once it has stopped moving
+    self.previewTimer = qt.QTimer()
+    self.previewTimer.singleShot = True
+    self.previewTimer.interval = 50
+    self.previewTimer.connect('timeout()', self.onPreviewTimer)
+    self.refineTimer = qt.QTimer()
+    self.refineTimer.singleShot = True
+    self.refineTimer.interval = 500
+    self.refineTimer.connect('timeout()', self.onRefineTimer)
+    self.liveObservers = []
+
+    # The ray casting runs in a worker thread; this timer polls it from the
+    # main thread, which is the only one modifying the scene
+    self.analysisTask = None
+    self.analysisSnapshot = None
+    self.analysisNeedleLength = None
+    self.analysisTimer = qt.QTimer()
+    self.analysisTimer.interval = 100
+    self.analysisTimer.connect('timeout()', self.onAnalysisTimer)
+
+    # Coalesces the path and point slider events to one update per frame
+    self.sliderTimer = qt.QTimer()
+    self.sliderTimer.singleShot = True
+    self.sliderTimer.interval = 16
+    self.sliderTimer.connect('timeout()', self.onSliderTimer)
+    self.pathSliderPending = False
+
+    # Shows all the paths again once the camera has not moved for a while
+    self.cameraTimer = qt.QTimer()
+    self.cameraTimer.singleShot = True
+    self.cameraTimer.interval = 250
+    self.cameraTimer.connect('timeout()', self.onCameraStill)
+    self.cameraObservers = []
 
     #
     # Outcomes Area
@@ -225,6 +383,16 @@ class PercutaneousApproachAnalysisWidget:
     self.colorMapCheckBox.checked = True
     outcomesFormLayout.addRow(self.colorMapCheckBox)
 
+    #
+    # Check box for the insertion angle map
+    #
+    self.angleMapCheckBox = ctk.ctkCheckBox()
+    self.angleMapCheckBox.text = "Color by Insertion Angle"
+    self.angleMapCheckBox.toolTip = "Color the skin by the smallest angle between the skin normal and the paths entering there."
+    self.angleMapCheckBox.enabled = False
+    self.angleMapCheckBox.checked = False
+    outcomesFormLayout.addRow(self.angleMapCheckBox)
+
     # Accessibility score results
     self.accessibilityScore = qt.QLineEdit()
     self.accessibilityScore.toolTip = "Accessibility Score"
@@ -233,6 +401,19 @@ class PercutaneousApproachAnalysisWidget:
     self.accessibilityScore.setReadOnly(True)
     self.accessibilityScore.maxLength = 8
     outcomesFormLayout.addRow("      Accessibility Score:",self.accessibilityScore)
+
+    #
+    # Scores of all the target points; a click shows the color map of a target
+    #
+    self.targetTable = qt.QTableWidget()
+    self.targetTable.setColumnCount(3)
+    self.targetTable.setHorizontalHeaderLabels(["Target", "Score", "Min. Distance"])
+    self.targetTable.setEditTriggers(qt.QAbstractItemView.NoEditTriggers)
+    self.targetTable.setSelectionBehavior(qt.QAbstractItemView.SelectRows)
+    self.targetTable.visible = False
+    outcomesFormLayout.addRow(self.targetTable)
+    self.targetTable.connect('cellClicked(int,int)', self.onTargetTableClicked)
+    self.targetColorMapNames = []
     
     #
     # Opacity slider
@@ -279,6 +460,11 @@ class PercutaneousApproachAnalysisWidget:
     self.accessibilityScore.maxLength = 10
     outcomesFormLayout.addRow("      Number of All Paths: ", self.numbersOfAllpathsSpinBox)
 
+    # Rays saved by the culling tests
+    self.culledRaysLabel = qt.QLabel()
+    self.culledRaysLabel.toolTip = "Number of path rays rejected by each culling test before ray casting"
+    outcomesFormLayout.addRow("      Culled Rays: ", self.culledRaysLabel)
+
     #
     # Opacity slider
     #
@@ -290,6 +476,13 @@ class PercutaneousApproachAnalysisWidget:
     self.allPathsOpacitySlider.enabled = False
     outcomesFormLayout.addRow("      Opacity:", self.allPathsOpacitySlider)
 
+    # Draw a sample of the paths while the camera moves
+    self.levelOfDetailCheckBox = ctk.ctkCheckBox()
+    self.levelOfDetailCheckBox.text = "Simplify While Moving the Camera"
+    self.levelOfDetailCheckBox.toolTip = "Draw a sample of the paths spread over the skin while the 3D view is rotated, and all of them once it stops"
+    self.levelOfDetailCheckBox.checked = True
+    outcomesFormLayout.addRow("      ", self.levelOfDetailCheckBox)
+
     #
     # Check box for displaying each path
     #
@@ -355,6 +548,13 @@ class PercutaneousApproachAnalysisWidget:
     self.pathCandidateCheckBox.checked = False    
     outcomesFormLayout.addRow(self.pathCandidateCheckBox)
 
+    # Order of the path slider
+    self.sortByAngleCheckBox = ctk.ctkCheckBox()
+    self.sortByAngleCheckBox.text = "Sort by Insertion Angle"
+    self.sortByAngleCheckBox.toolTip = "Go through the path candidates from the most perpendicular to the skin to the most oblique."
+    self.sortByAngleCheckBox.checked = False
+    outcomesFormLayout.addRow("     ", self.sortByAngleCheckBox)
+
     # Path slider
     self.pathSlider = ctk.ctkSliderWidget()
     self.pathSlider.decimals = 0
@@ -379,6 +579,16 @@ class PercutaneousApproachAnalysisWidget:
     self.lengthOfPathSpinBox.maxLength = 8
     outcomesFormLayout.addRow("      Length (mm): ", self.lengthOfPathSpinBox)
 
+    #
+    # Insertion angle of the path
+    #
+    self.insertionAngleSpinBox = qt.QLineEdit()
+    self.insertionAngleSpinBox.enabled = True
+    self.insertionAngleSpinBox.maximumWidth = 70
+    self.insertionAngleSpinBox.setReadOnly(True)
+    self.insertionAngleSpinBox.maxLength = 8
+    outcomesFormLayout.addRow("      Insertion Angle (deg): ", self.insertionAngleSpinBox)
+
     # create point on the path
     self.createPointOnThePathButton = qt.QPushButton("Create Point on the Path")
     self.createPointOnThePathButton.enabled = False
@@ -388,10 +598,13 @@ class PercutaneousApproachAnalysisWidget:
     self.pathCandidateCheckBox.connect("clicked(bool)", self.onCheckPathCandidate)
     self.allPathsCheckBox.connect("clicked(bool)", self.onCheckAllPaths)
     self.colorMapCheckBox.connect("clicked(bool)", self.onCheckColorMappedSkin)
+    self.angleMapCheckBox.connect("clicked(bool)", self.onCheckInsertionAngleMap)
+    self.sortByAngleCheckBox.connect("clicked(bool)", self.onCheckSortByAngle)
     self.createPointOnThePathButton.connect('clicked(bool)', self.onCreatePointOnThePathButton)
     self.pathSlider.connect('valueChanged(double)', self.pathSliderValueChanged)
     self.pointSlider.connect('valueChanged(double)', self.pointSliderValueChanged)
     self.allPathsOpacitySlider.connect('valueChanged(double)', self.allPathsOpacitySliderValueChanged)
+    self.levelOfDetailCheckBox.connect("clicked(bool)", self.onCameraStill)
 
     self.maximumLengthPathCheckBox.connect("clicked(bool)", self.onCheckTheLongestPath)
     self.minimumLengthPathCheckBox.connect("clicked(bool)", self.onCheckTheShortestPath)
@@ -434,9 +647,19 @@ class PercutaneousApproachAnalysisWidget:
     # Switch to distinguish between a point target and a target model
     self.targetSwitch = 0
 
-    # Create an array for all approachable points
-    # tempolary solution 
-    self.apReceived = numpy.zeros([10000,3])
+    # Point scalars shown by the "Color Mapped Skin" check box, unless the
+    # insertion angle map is checked, and their display ranges
+    self.colorMapName = "Colors"
+    self.colorMapRanges = {"Reachability": (0.0, 1.0), "InsertionAngle": (0.0, 90.0)}
+
+    # Path numbers by increasing insertion angle
+    self.pathOrder = None
+
+    # Keep one logic so that obstacle locators are reused between runs
+    self.logic = PercutaneousApproachAnalysisLogic()
+
+    # Approachable paths (PathTable) of the last analysis
+    self.apReceived = None
   
     self.nPointsReceived = 0
     self.nPathReceived = 0
@@ -448,6 +671,14 @@ class PercutaneousApproachAnalysisWidget:
     # avoid initializing error for frameSliderValueChanged(self, newValue) function
     self.tmpSwitch = 0
 
+    # Displays of the path models made by showPathModels()
+    self.singlePath = None
+    self.virtualPath2 = None
+    self.theLongestPath = None
+    self.theLongestPathPointMarker = None
+    self.theShortestPath = None
+    self.theShortestPathPointMarker = None
+
     self.pointMarker = slicer.vtkMRMLModelDisplayNode()
     self.pointMarkerTransform = slicer.vtkMRMLLinearTransformNode()
     self.virtualMarker = slicer.vtkMRMLModelDisplayNode()
@@ -455,8 +686,10 @@ class PercutaneousApproachAnalysisWidget:
 
     self.allPaths = slicer.vtkMRMLModelDisplayNode()
     self.candidatePath = slicer.vtkMRMLModelDisplayNode()
-
-    self.pathReceived = numpy.zeros([10000,3])
+    # Sample of the candidate paths drawn while the camera moves
+    self.samplePathsModel = None
+    self.samplePaths = None
+    self.sampleRatio = 1.0
 
     self.markerPosition = numpy.zeros([3])
     self.virtualMarkerPosition = numpy.zeros([3])
@@ -476,6 +709,8 @@ class PercutaneousApproachAnalysisWidget:
     self.modelReceived = slicer.vtkMRMLModelNode()
     self.singlePathModel = slicer.vtkMRMLModelNode()
     self.virtualPathModel = slicer.vtkMRMLModelNode()   
+    self.theLongestPathModel = slicer.vtkMRMLModelNode()
+    self.theShortestPathModel = slicer.vtkMRMLModelNode()
     self.selectedPathTipModel = slicer.vtkMRMLModelNode()
     self.extendedPathTipModel = slicer.vtkMRMLModelNode()
     self.longestPathTipModel = slicer.vtkMRMLModelNode()
@@ -498,39 +733,86 @@ class PercutaneousApproachAnalysisWidget:
     self.allPathsPoints = vtk.vtkPoints()
     self.virtualPathPoints = vtk.vtkPoints()
     self.allLines = vtk.vtkPolyData()
+    self.sampleLines = vtk.vtkPolyData()
     self.singleLine = vtk.vtkPolyData()
     self.extendedLine = vtk.vtkPolyData()
     self.longestLine = vtk.vtkPolyData()
     self.shortestLine = vtk.vtkPolyData()
 
   def cleanup(self):
-    pass
+    self.removeLiveObservers()
+    self.removeCameraObservers()
+    if self.analysisTask != None:
+      self.analysisTask.cancel()
+    self.logic.cleanup()
+
+  def pathIndex(self, sliderValue):
+    """Path number of a path slider value: the same number, or with "Sort
+    by Insertion Angle" the path of that rank"""
+    index = int(sliderValue)
+    if self.sortByAngleCheckBox.checked and self.pathOrder is not None and 0 <= index < len(self.pathOrder):
+      return int(self.pathOrder[index])
+    return index
 
   def pathSliderValueChanged(self,newValue):
-    logic = PercutaneousApproachAnalysisLogic()
     self.pathSliderValue = newValue
-
-    self.onePath, self.onePathDistance = logic.makeSinglePath(self.apReceived, self.pathSliderValue)
-    NeedlePathModel().modify(self.onePath, 1, self.VISIBLE, self.red, "pathCandidate", self.singleLine, self.singlePathModel, self.singlePath, self.singlePathPoints)
-
-    self.markerPosition = SphereModel().move(self.apReceived, self.pathSliderValue, 0, self.pointMarkerTransform)
-    self.virtualMarkerPosition = SphereModel().move(self.apReceived, self.pathSliderValue, self.pointSliderValue, self.virtualMarkerTransform)
- 
-    self.virtualPath, self.virtualPathDistance = logic.makeVirtualPath(self.apReceived, self.pathSliderValue, self.virtualMarkerPosition)
-    NeedlePathModel().modify(self.virtualPath, 1, self.VISIBLE, self.red, "extendedPath", self.extendedLine, self.virtualPathModel, self.virtualPath, self.virtualPathPoints)
-   
-    self.lengthOfPathSpinBox.text = round(self.virtualPathDistance + self.onePathDistance,1)
+    self.pathSliderPending = True
+    self.scheduleSliderUpdate()
 
   def pointSliderValueChanged(self,newValue):
-    logic = PercutaneousApproachAnalysisLogic()
     self.pointSliderValue = newValue
+    self.scheduleSliderUpdate()
+
+  def scheduleSliderUpdate(self):
+    # A fast drag sends many events per frame; only the last values are drawn
+    if not self.sliderTimer.isActive():
+      self.sliderTimer.start()
+
+  def onSliderTimer(self):
+    if self.pathSliderPending:
+      self.updateSelectedPath()
+    else:
+      self.updateExtendedPath()
+
+  def updateSelectedPath(self):
+    """Move the selected path, its tip marker and the extended path to the
+    path of the path slider, from the lookup table of the logic"""
+    self.pathSliderPending = False
+    lookup = self.logic.pathLookup
+    index = self.pathIndex(self.pathSliderValue)
+    if lookup is None or not 0 <= index < len(lookup):
+      return
+
+    self.onePath, self.onePathDistance = lookup.path(index)
+    NeedlePathModel().modify(self.onePath, 1, self.VISIBLE, self.red, "pathCandidate", self.singleLine, self.singlePathModel, self.singlePath, self.singlePathPoints)
+
+    self.markerPosition = [float(c) for c in lookup.pointOnPath(index, 0)]
+    SphereModel().drop(self.markerPosition[0], self.markerPosition[1], self.markerPosition[2], self.pointMarkerTransform)
+    self.updateExtendedPath()
 
-    self.virtualMarkerPosition = SphereModel().move(self.apReceived, self.pathSliderValue, self.pointSliderValue, self.virtualMarkerTransform)
-    self.virtualPath, self.virtualPathDistance = logic.makeVirtualPath(self.apReceived, self.pathSliderValue, self.virtualMarkerPosition)
+    self.lengthOfPathSpinBox.text = round(self.virtualPathDistance + self.onePathDistance,1)
+    angles = self.logic.pathAngles
+    if angles is not None and index < len(angles):
+      self.insertionAngleSpinBox.text = round(angles[index],1)
+
+  def updateExtendedPath(self):
+    """Move the extended path and its marker to the point slider"""
+    lookup = self.logic.pathLookup
+    index = self.pathIndex(self.pathSliderValue)
+    if lookup is None or not 0 <= index < len(lookup):
+      return
+
+    self.virtualMarkerPosition = [float(c) for c in lookup.pointOnPath(index, self.pointSliderValue)]
+    SphereModel().drop(self.virtualMarkerPosition[0], self.virtualMarkerPosition[1], self.virtualMarkerPosition[2], self.virtualMarkerTransform)
+    self.virtualPath, self.virtualPathDistance = lookup.extension(index, self.virtualMarkerPosition)
     NeedlePathModel().modify(self.virtualPath, 1, self.VISIBLE, self.red, "extendedPath", self.extendedLine, self.virtualPathModel, self.virtualPath, self.virtualPathPoints)
 
     self.lengthOfPathSpinBox.text = round(self.virtualPathDistance,1)
 
+  def onCheckSortByAngle(self):
+    if self.apReceived != None and self.nPathReceived > 0:
+      self.updateSelectedPath()
+
   def skinModelOpacitySliderValueChanged(self,newValue):
     if(self.skinModelSelector.currentNode() != None):
         skinModel = self.skinModelSelector.currentNode()
@@ -545,18 +827,150 @@ class PercutaneousApproachAnalysisWidget:
         modelDisplay = obstacleModel.GetDisplayNode()
         modelDisplay.SetOpacity(newValue/1000.0)
         
+  def needleLengthSliderValueChanged(self,newValue):
+    logic = self.logic
+    logic.needleLength = newValue
+    # A running analysis scores with the length at Apply; onAnalysisTimer()
+    # rescores its results with this one
+    if self.analysisTask != None:
+      return
+    skinModel = self.skinModelSelector.currentNode()
+    if skinModel == None:
+      return
+
+    result = logic.rescore(skinModel)
+    if result != None and self.colorMapName == "Colors":
+      self.accessibilityScore.text = round(result[0],1)
+
+    targetResults = logic.rescoreMultiTarget()
+    if targetResults != None:
+      self.showTargetTable(skinModel, targetResults)
+      if self.colorMapName in self.targetColorMapNames:
+        self.accessibilityScore.text = self.targetTable.item(self.targetColorMapNames.index(self.colorMapName), 1).text()
+
   def allPathsOpacitySliderValueChanged(self,newValue):
     self.allPaths.SetOpacity(newValue/1000.0)
+    if self.samplePaths != None:
+      # Fewer lines, so as opaque as the full set looks
+      self.samplePaths.SetOpacity(min(1.0, self.sampleRatio*newValue/1000.0))
+
+  def updatePathSample(self):
+    """Rebuild the sample of the candidate paths drawn while the camera
+    moves; it stays hidden until then"""
+    points = self.logic.pathSamplePoints()
+    if points is None:
+      points = numpy.zeros([0,3])
+    nSample = len(points) // 2
+    self.sampleRatio = float(self.nPathReceived) / nSample if nSample > 0 else 1.0
+    self.samplePathsModel, p, self.samplePaths, self.samplePathsPoints = NeedlePathModel().reuse(self.samplePathsModel, points, nSample, self.INVISIBLE, self.yellow, "candidatePathsSample", self.sampleLines)
+    self.samplePaths.SetOpacity(min(1.0, self.sampleRatio*self.allPaths.GetOpacity()))
+
+  def addCameraObservers(self):
+    self.removeCameraObservers()
+    cameras = slicer.mrmlScene.GetNodesByClass('vtkMRMLCameraNode')
+    for index in range(cameras.GetNumberOfItems()):
+      camera = cameras.GetItemAsObject(index)
+      self.cameraObservers.append((camera, camera.AddObserver(vtk.vtkCommand.ModifiedEvent, self.onCameraModified)))
+
+  def removeCameraObservers(self):
+    for (node, tag) in self.cameraObservers:
+      node.RemoveObserver(tag)
+    self.cameraObservers = []
+    self.cameraTimer.stop()
+
+  def onCameraModified(self, caller, event):
+    # Swap the full set for the sample until the camera stops
+    if not self.levelOfDetailCheckBox.checked or not self.allPathsCheckBox.checked:
+      return
+    if self.samplePaths == None or self.sampleLines.GetNumberOfLines() == 0:
+      return
+    if not self.cameraTimer.isActive():
+      self.allPaths.SetVisibility(self.OFF)
+      self.samplePaths.SetVisibility(self.ON)
+    self.cameraTimer.start()
+
+  def onCameraStill(self):
+    self.cameraTimer.stop()
+    if self.samplePaths != None:
+      self.samplePaths.SetVisibility(self.OFF)
+    if self.deleteModelsButton.enabled:
+      self.allPaths.SetVisibility(self.ON if self.allPathsCheckBox.checked else self.OFF)
 
   def onSelect(self):
     if (self.targetSelector.currentNode() != None) and (self.obstacleModelSelector.currentNode() != None) and (self.skinModelSelector.currentNode() != None):
       self.applyButton.enabled = True
+    self.targetSwitch = 0
     if (self.targetModelSelector.currentNode() != None) and (self.obstacleModelSelector.currentNode() != None) and (self.skinModelSelector.currentNode() != None):
       self.applyButton.enabled = True
       self.targetSwitch = 1
 
     self.skinModelOpacitySliderValueChanged(self.skinModelOpacitySlider.value)
     self.obstacleModelOpacitySliderValueChanged(self.obstacleModelOpacitySlider.value)
+    self.onCheckLiveUpdate()
+
+  def onCheckLiveUpdate(self):
+    self.removeLiveObservers()
+    if not self.liveUpdateCheckBox.checked:
+      return
+    targetPoint = self.targetSelector.currentNode()
+    if targetPoint != None:
+      event = getattr(slicer.vtkMRMLMarkupsNode, 'PointModifiedEvent', vtk.vtkCommand.ModifiedEvent)
+      self.liveObservers.append((targetPoint, targetPoint.AddObserver(event, self.onTargetPointModified)))
+    obstacleModel = self.obstacleModelSelector.currentNode()
+    if obstacleModel != None:
+      event = getattr(slicer.vtkMRMLModelNode, 'PolyDataModifiedEvent', vtk.vtkCommand.ModifiedEvent)
+      self.liveObservers.append((obstacleModel, obstacleModel.AddObserver(event, self.onObstacleModelModified)))
+
+  def removeLiveObservers(self):
+    for (node, tag) in self.liveObservers:
+      node.RemoveObserver(tag)
+    self.liveObservers = []
+
+  def onTargetPointModified(self, caller, event):
+    # Only update an existing analysis of the target point
+    if not self.deleteModelsButton.enabled or self.targetSwitch == 1:
+      return
+    if not self.previewTimer.isActive():
+      self.previewTimer.start()
+    self.refineTimer.start()
+
+  def onObstacleModelModified(self, caller, event):
+    # The logic only re-casts the rays near the edited part of the obstacle,
+    # so go straight to the full analysis
+    if not self.deleteModelsButton.enabled:
+      return
+    self.refineTimer.start()
+
+  def onPreviewTimer(self):
+    if self.analysisTask != None:
+      return
+    logic = self.logic
+    targetPoint = self.targetSelector.currentNode()
+    obstacleModel = self.obstacleModelSelector.currentNode()
+    skinModel = self.skinModelSelector.currentNode()
+    voxelSize = logic.previewVoxelSize
+
+    self.apReceived, self.minimumPoint, self.minimumDistance, self.maximumPoint, self.maximumDistance = logic.makePaths(targetPoint, None, 0, obstacleModel, skinModel, True, voxelSize)
+    self.nPathReceived = len(self.apReceived)
+    self.pathOrder = logic.rankedPaths()
+    NeedlePathModel().fillPolyData(self.apReceived.interleavedPoints(), self.nPathReceived, self.allLines)
+    self.updatePathSample()
+    self.numbersOfAllpathsSpinBox.text = self.nPathReceived
+    logic.showInsertionAngleMap(skinModel, self.apReceived, logic.pathAngles)
+
+    (score, mind, mindp) = logic.runPointWise(targetPoint, obstacleModel, skinModel, True, voxelSize)
+    self.accessibilityScore.text = round(score,1)
+    self.colorMapName = "Colors"
+    self.onCheckColorMappedSkin()
+
+  def onRefineTimer(self):
+    self.previewTimer.stop()
+    # A running analysis is for an outdated target; start again once it stops
+    if self.analysisTask != None:
+      self.analysisTask.cancel()
+      self.refineTimer.start()
+      return
+    self.onApplyButton()
 
   def onCreatePointOnThePathButton(self):
     entryPointsNode = self.entryPointsSelector.currentNode()
@@ -569,6 +983,9 @@ class PercutaneousApproachAnalysisWidget:
     SphereModel().drop(self.virtualMarkerPosition[0], self.virtualMarkerPosition[1], self.virtualMarkerPosition[2], droppedMarkerTransform)
 
   def onCheckAllPaths(self):
+    self.cameraTimer.stop()
+    if self.samplePaths != None:
+      self.samplePaths.SetVisibility(self.OFF)
     if self.allPathsCheckBox.checked == True:
       self.allPaths.SetVisibility(self.ON)
       self.allPathsOpacitySlider.enabled = True
@@ -592,7 +1009,10 @@ class PercutaneousApproachAnalysisWidget:
 
       # Need to reload the skin model after "displayNode.SetActiveScalarName("Normals")" 
       # to display color map correctly 
-      displayNode.SetActiveScalarName("Colors")
+      name = "InsertionAngle" if self.angleMapCheckBox.checked else self.colorMapName
+      displayNode.SetActiveScalarName(name)
+      scalarRange = self.colorMapRanges.get(name, (0.0, 20.0))
+      displayNode.SetScalarRange(scalarRange[0], scalarRange[1])
       scalarSetting.setScalarsVisibility(visible)
             
       self.coloredSkinModelOpacitySlider.enabled = True
@@ -601,8 +1021,11 @@ class PercutaneousApproachAnalysisWidget:
       self.coloredSkinModelOpacitySlider.enabled = False
 
 
+  def onCheckInsertionAngleMap(self):
+    self.colorMapCheckBox.checked = True
+    self.onCheckColorMappedSkin()
+
   def onCheckTheLongestPath(self):
-    print(self.maximumPoint-1)
     if self.maximumLengthPathCheckBox.checked == True:
       self.theLongestPath.SetVisibility(self.ON)
       self.theLongestPathPointMarker.SetVisibility(self.ON)
@@ -611,7 +1034,6 @@ class PercutaneousApproachAnalysisWidget:
       self.theLongestPathPointMarker.SetVisibility(self.OFF)    
 
   def onCheckTheShortestPath(self):
-    print(self.minimumPoint-1)
     if self.minimumLengthPathCheckBox.checked == True:
       self.theShortestPath.SetVisibility(self.ON)
       self.theShortestPathPointMarker.SetVisibility(self.ON)
@@ -638,59 +1060,167 @@ class PercutaneousApproachAnalysisWidget:
       self.createPointOnThePathButton.enabled = False
      
   def onApplyButton(self):
-    logic = PercutaneousApproachAnalysisLogic()
-    print("onApplyButton() is called ")
+    import numpy
+    from PercutaneousApproachAnalysisLib import BackgroundTask
+
+    if self.analysisTask != None:
+      return
+    logic = self.logic
+    logic.setNumberOfWorkers(self.numberOfWorkersSpinBox.value)
+    logic.needleLength = self.needleLengthSlider.value
+    logic.candidateFilter.maximumDistance = logic.needleLength if self.cullReachCheckBox.checked else None
+    logic.candidateFilter.backFacing = self.cullBackFacingCheckBox.checked
+    logic.candidateFilter.maximumAngle = self.maximumInsertionAngleSpinBox.value if self.maximumInsertionAngleSpinBox.value > 0 else None
+    if self.diskCacheCheckBox.checked:
+      if logic.diskCache is None:
+        logic.setDiskCache(os.path.join(slicer.app.temporaryPath, 'PercutaneousApproachAnalysis'))
+    else:
+      logic.setDiskCache(None)
+    logic.targetVoxelSize = self.targetSamplingSpinBox.value if self.targetSamplingSpinBox.value > 0 else None
     targetPoint = self.targetSelector.currentNode()
     targetModel = self.targetModelSelector.currentNode()
     obstacleModel = self.obstacleModelSelector.currentNode()
     skinModel = self.skinModelSelector.currentNode()
+    targetSwitch = self.targetSwitch
+    progressive = self.progressiveCheckBox.checked
+    targetMap = self.targetMapCheckBox.checked
+    multiTarget = self.multiTargetCheckBox.checked
+
+    # The target point and "All Target Points" need a control point
+    if (targetSwitch == 0 or multiTarget) and (targetPoint == None or targetPoint.GetNumberOfFiducials() == 0):
+      slicer.util.errorDisplay("Select a target point node with at least one control point.")
+      return
+
+    # clean up work space; showAnalysisResults() reuses the path and
+    # marker nodes and their transforms
+    self.resetOutcomes()
+
+    # Cast the rays in a worker thread; the coarse color maps of the
+    # progressive levels and the final results are applied on the main
+    # thread by onAnalysisTimer().  Everything the worker needs from the
+    # scene is read here, and it computes on its own copy of the logic.
+    snapshot = logic.geometrySnapshot(skinModel, obstacleModel)
+    if targetSwitch == 1:
+      targetClusters = logic.targetModelClusters(targetModel)
+      (points, samples, representatives) = targetClusters
+      targetPoints = points[samples]
+    else:
+      tPoint = targetPoint.GetMarkupPointVector(0, 0)
+      pTarget = [tPoint[0], tPoint[1], tPoint[2]]
+      targetPoints = numpy.array([pTarget])
+    if multiTarget:
+      (multiTargetPoints, labels) = logic.targetNodePoints(targetPoint)
+    worker = logic.threadCopy()
+
+    def analysis(task):
+      worker.progress = task.reportProgress
+      (skin, obstacleBVH) = worker.analysisGeometry(snapshot)
+      result = {'geometry': (skin, obstacleBVH), 'multiTarget': multiTarget}
+      if targetSwitch == 1:
+        reachability = worker.targetSweep(skin, obstacleBVH, targetPoints).reachability()
+        scores = worker.targetAccessibilityScores(skin, obstacleBVH, targetClusters) if targetMap else None
+        result['sweepResult'] = (reachability, scores)
+      else:
+        worker.computeVisibility(pTarget, skin, obstacleBVH, progressive, lambda *level: task.post('level', level))
+        result['pointWise'] = worker.pointWiseValues(pTarget, skin, obstacleBVH)
+      if multiTarget:
+        result['targetResults'] = worker.multiTargetResults(skin, obstacleBVH, multiTargetPoints, labels)
+      result['paths'] = worker.batchPaths(skin, obstacleBVH, targetPoints, targetSwitch)
+      result['state'] = worker.analysisState()
+      return result
+
+    self.analysisNodes = (targetPoint, targetModel, obstacleModel, skinModel)
+    self.analysisSnapshot = snapshot
+    self.analysisNeedleLength = worker.needleLength
+    self.analysisTask = BackgroundTask(analysis)
+    self.applyButton.enabled = False
+    self.cancelButton.enabled = True
+    self.progressBar.value = 0
+    self.progressBar.visible = True
+    self.analysisTask.start()
+    self.analysisTimer.start()
+
+  def onCancelButton(self):
+    if self.analysisTask != None:
+      self.analysisTask.cancel()
+      self.cancelButton.enabled = False
+
+  def onAnalysisTimer(self):
+    task = self.analysisTask
+    (targetPoint, targetModel, obstacleModel, skinModel) = self.analysisNodes
+
+    for (kind, value) in task.poll():
+      if kind == 'progress':
+        (done, total) = value
+        self.progressBar.value = int(100.0 * done / total) if total > 0 else 100
+      elif kind == 'level' and not task.cancelRequested():
+        (score, mind, mindp, pointValues) = value
+        self.logic.showColorMapValues(skinModel, pointValues)
+        self.accessibilityScore.text = round(score,1)
+        self.colorMapName = "Colors"
+        self.colorMapCheckBox.checked = True
+        self.onCheckColorMappedSkin()
 
-    # clean up work space
-    self.onDeleteModelsButton()
-    self.onDeleteTransformsButton() 
+    if not task.finished:
+      return
 
-    # make all paths
-    self.pathReceived, self.nPathReceived, self.apReceived, self.minimumPoint, self.minimumDistance, self.maximumPoint, self.maximumDistance = logic.makePaths(targetPoint, targetModel, 0, obstacleModel, skinModel)
-    # display all paths model
-    self.modelReceived, pReceived, self.allPaths, self.allPathPoints = NeedlePathModel().make(self.pathReceived, self.nPathReceived, self.VISIBLE, self.yellow, "candidatePaths", self.allLines)
+    self.analysisTimer.stop()
+    self.analysisTask = None
+    self.applyButton.enabled = True
+    self.cancelButton.enabled = False
+    self.progressBar.visible = False
 
-    # display sphere model
-    self.selectedPathTipModel, self.pointMarker, self.pointMarkerTransform = SphereModel().make(self.INVISIBLE, self.red, "selectedPathTip")
-    self.markerPosition = SphereModel().move(self.apReceived, self.pathSliderValue, self.pointSliderValue, self.pointMarkerTransform)
-    self.extendedPathTipModel, self.virtualMarker, self.virtualMarkerTransform = SphereModel().make(self.INVISIBLE, self.red, "extendedPathTip")
-    self.virtualMarkerPosition = SphereModel().move(self.apReceived, self.pathSliderValue, self.pointSliderValue, self.virtualMarkerTransform)
-
-    # make and display single path candidate
-    self.onePath, self.onePathDistance = logic.makeSinglePath(self.apReceived, self.pathSliderValue)
-    self.singlePathModel, self.singleP, self.singlePath, self.singlePathPoints = NeedlePathModel().make(self.onePath, 2, self.INVISIBLE, self.red, "selectedPath", self.singleLine)
-    # make and display virtual path candidate    
-    self.virtualPath, self.virtualPathDistance = logic.makeVirtualPath(self.apReceived, self.pathSliderValue, self.virtualMarkerPosition)
-    self.virtualPathModel, self.virtualP, self.virtualPath2, self.virtualPathPoints = NeedlePathModel().make(self.virtualPath, 2, self.INVISIBLE, self.red, "extendedPath", self.extendedLine)
-    
-    self.lengthOfPathSpinBox.text = round(self.virtualPathDistance,1)
+    if task.cancelled:
+      logging.info("Analysis cancelled")
+    elif task.error != None:
+      logging.error(task.errorTraceback)
+      slicer.util.errorDisplay("The analysis failed: %s" % task.error)
+    else:
+      result = task.result
+      self.logic.adoptResults(self.analysisSnapshot, result.pop('geometry'), result.pop('state'), skinModel, obstacleModel)
+      self.showAnalysisResults(targetPoint, targetModel, obstacleModel, skinModel, **result)
+      # The needle length moved while the analysis ran
+      if self.needleLengthSlider.value != self.analysisNeedleLength:
+        self.needleLengthSliderValueChanged(self.needleLengthSlider.value)
+    self.analysisSnapshot = None
+
+  def showAnalysisResults(self, targetPoint, targetModel, obstacleModel, skinModel, paths, pointWise=None, sweepResult=None,
+                          multiTarget=False, targetResults=None):
+    """Build the path models and the color maps from the results of the
+    analysis thread.  paths is the result of batchPaths, pointWise the
+    one of pointWiseValues for a target point and sweepResult
+    (reachability, target scores) for a target model.  targetResults is
+    the result of multiTargetResults.  Non-triangulated skins, for which
+    pointWise and targetResults are None, are scored cell by cell here."""
+    logic = self.logic
+    targetSwitch = 1 if sweepResult is not None else 0
 
-    # make the longest path
-    self.theLongestPathTmp, self.distanceDummy = logic.makeSinglePath(self.apReceived, self.maximumPoint-1)
-    # display the longest path
-    self.theLongestPathModel, self.theLongestPathP, self.theLongestPath, self.points = NeedlePathModel().make(self.theLongestPathTmp, 2, self.INVISIBLE, self.green, "longestPath", self.longestLine)
-    # make the point marker on the longest path 
-    self.longestPathTipModel, self.theLongestPathPointMarker, self.theLongestPathPointMarkerTransform = SphereModel().make(self.INVISIBLE, self.green, "longestPathTip")
-    self.theLongestPathPointMarkerPosition = SphereModel().move(self.apReceived, self.maximumPoint-1, 0, self.theLongestPathPointMarkerTransform)
+    # make all paths
+    self.apReceived, self.minimumPoint, self.minimumDistance, self.maximumPoint, self.maximumDistance = paths
+    self.nPathReceived = len(self.apReceived)
+    self.pathOrder = logic.rankedPaths()
+    # display all paths model
+    self.modelReceived, pReceived, self.allPaths, self.allPathPoints = NeedlePathModel().reuse(self.modelReceived, self.apReceived.interleavedPoints(), self.nPathReceived, self.VISIBLE, self.yellow, "candidatePaths", self.allLines)
 
-    # make the shortest path
-    self.theShortestPathTmp, self.distanceDummy = logic.makeSinglePath(self.apReceived, self.minimumPoint-1)
-    # display the shortest path
-    self.theShortestPathModel, self.theShortestPathP, self.theShortestPath, self.points = NeedlePathModel().make(self.theShortestPathTmp, 2, self.INVISIBLE, self.blue,"shortestPath", self.shortestLine)
-    # make the point marker on the shortest path 
-    self.shortestPathTipModel, self.theShortestPathPointMarker, self.theShortestPathPointMarkerTransform = SphereModel().make(self.INVISIBLE, self.blue, "shortestPathTip")
-    self.theShortestPathPointMarkerPosition = SphereModel().move(self.apReceived, self.minimumPoint-1, 0, self.theShortestPathPointMarkerTransform)
+    # The selected, longest and shortest paths and their markers need a path
+    hasPaths = self.nPathReceived > 0
+    if hasPaths:
+      self.showPathModels()
 
     # update outcomes
     self.numbersOfAllpathsSpinBox.text = self.nPathReceived
-    self.pathSlider.maximum = self.nPathReceived-1
+    self.culledRaysLabel.text = logic.cullingReport()
+    self.pathSlider.maximum = max(self.nPathReceived-1, 0)
     self.allPathsCheckBox.checked = True
     self.allPathsCheckBox.enabled = True
-    self.pathCandidateCheckBox.enabled = True
+    self.pathCandidateCheckBox.enabled = hasPaths
+    self.maximumLengthPathCheckBox.enabled = hasPaths
+    self.minimumLengthPathCheckBox.enabled = hasPaths
+    if not hasPaths:
+      self.pathCandidateCheckBox.checked = False
+      self.pathSlider.enabled = False
+      self.pointSlider.enabled = False
+      self.createPointOnThePathButton.enabled = False
     self.outcomesList.collapsed = False
     self.cleaningList.collapsed = False
     self.allPathsOpacitySlider.enabled = True
@@ -698,11 +1228,14 @@ class PercutaneousApproachAnalysisWidget:
     self.deleteTransformsButton.enabled = True
 
     self.allPaths.SetOpacity(6.0/1000.0)
+    self.updatePathSample()
+    self.addCameraObservers()
     self.skinModelOpacitySliderValueChanged(900.0)
     self.skinModelOpacitySlider.value = 900
 
     # calculate the length of the Path No.1 and display the length
-    self.pathSliderValueChanged(0)
+    self.pathSliderValue = 0
+    self.updateSelectedPath()
 
     #self.maximumLengthSpinBox.value = self.maximumDistance
     self.maximumLengthSpinBox.text = round(self.maximumDistance,1)
@@ -710,16 +1243,93 @@ class PercutaneousApproachAnalysisWidget:
     self.minimumLengthSpinBox.text = round(self.minimumDistance,1)
     self.minimumLengthPathSpinBox.text = self.minimumPoint-1
 
-    # make color mapped skin
+    # make color mapped skin: the reachable fraction of the target model,
+    # or the accessibility of the target point
     start = time.time()
-    (score, mind, mindp) = logic.runPointWise(targetPoint, obstacleModel, skinModel)
-      
-    self.accessibilityScore.text = round(score,1)
+    if targetSwitch == 1:
+      (reachability, targetScores) = sweepResult
+      logic.showReachabilityMap(skinModel, reachability)
+      if targetScores is not None:
+        logic.showTargetAccessibilityMap(targetModel, targetScores)
+      self.colorMapName = "Reachability"
+      self.accessibilityScore.text = ""
+    else:
+      if pointWise is None:
+        (score, mind, mindp) = logic.runPointWise(targetPoint, obstacleModel, skinModel)
+      else:
+        (score, mind, mindp, pointValues) = pointWise
+        logic.showColorMapValues(skinModel, pointValues)
+      self.colorMapName = "Colors"
+      self.accessibilityScore.text = round(score,1)
+
+    logic.showInsertionAngleMap(skinModel, self.apReceived, logic.pathAngles)
+    self.angleMapCheckBox.enabled = True
 
     self.colorMapCheckBox.checked = True
     self.colorMapCheckBox.enabled = True
     self.onCheckColorMappedSkin()
 
+    if multiTarget and targetResults is None:
+      targetResults = logic.runMultiTarget(targetPoint, obstacleModel, skinModel)
+    self.showTargetTable(skinModel, targetResults)
+
+  def showPathModels(self):
+    """Selected, extended, longest and shortest path models and their
+    markers, for an analysis with at least one path"""
+    logic = self.logic
+
+    # display sphere model
+    self.selectedPathTipModel, self.pointMarker, self.pointMarkerTransform = SphereModel().reuse(self.selectedPathTipModel, self.INVISIBLE, self.red, "selectedPathTip")
+    self.markerPosition = SphereModel().move(self.apReceived, self.pathIndex(self.pathSliderValue), self.pointSliderValue, self.pointMarkerTransform)
+    self.extendedPathTipModel, self.virtualMarker, self.virtualMarkerTransform = SphereModel().reuse(self.extendedPathTipModel, self.INVISIBLE, self.red, "extendedPathTip")
+    self.virtualMarkerPosition = SphereModel().move(self.apReceived, self.pathIndex(self.pathSliderValue), self.pointSliderValue, self.virtualMarkerTransform)
+
+    # make and display single path candidate
+    self.onePath, self.onePathDistance = logic.makeSinglePath(self.apReceived, self.pathIndex(self.pathSliderValue))
+    self.singlePathModel, self.singleP, self.singlePath, self.singlePathPoints = NeedlePathModel().reuse(self.singlePathModel, self.onePath, 2, self.INVISIBLE, self.red, "selectedPath", self.singleLine)
+    # make and display virtual path candidate    
+    self.virtualPath, self.virtualPathDistance = logic.makeVirtualPath(self.apReceived, self.pathIndex(self.pathSliderValue), self.virtualMarkerPosition)
+    self.virtualPathModel, self.virtualP, self.virtualPath2, self.virtualPathPoints = NeedlePathModel().reuse(self.virtualPathModel, self.virtualPath, 2, self.INVISIBLE, self.red, "extendedPath", self.extendedLine)
+
+    self.lengthOfPathSpinBox.text = round(self.virtualPathDistance,1)
+
+    # make the longest path
+    self.theLongestPathTmp, self.distanceDummy = logic.makeSinglePath(self.apReceived, self.maximumPoint-1)
+    # display the longest path
+    self.theLongestPathModel, self.theLongestPathP, self.theLongestPath, self.points = NeedlePathModel().reuse(self.theLongestPathModel, self.theLongestPathTmp, 2, self.INVISIBLE, self.green, "longestPath", self.longestLine)
+    # make the point marker on the longest path 
+    self.longestPathTipModel, self.theLongestPathPointMarker, self.theLongestPathPointMarkerTransform = SphereModel().reuse(self.longestPathTipModel, self.INVISIBLE, self.green, "longestPathTip")
+    self.theLongestPathPointMarkerPosition = SphereModel().move(self.apReceived, self.maximumPoint-1, 0, self.theLongestPathPointMarkerTransform)
+
+    # make the shortest path
+    self.theShortestPathTmp, self.distanceDummy = logic.makeSinglePath(self.apReceived, self.minimumPoint-1)
+    # display the shortest path
+    self.theShortestPathModel, self.theShortestPathP, self.theShortestPath, self.points = NeedlePathModel().reuse(self.theShortestPathModel, self.theShortestPathTmp, 2, self.INVISIBLE, self.blue,"shortestPath", self.shortestLine)
+    # make the point marker on the shortest path 
+    self.shortestPathTipModel, self.theShortestPathPointMarker, self.theShortestPathPointMarkerTransform = SphereModel().reuse(self.shortestPathTipModel, self.INVISIBLE, self.blue, "shortestPathTip")
+    self.theShortestPathPointMarkerPosition = SphereModel().move(self.apReceived, self.minimumPoint-1, 0, self.theShortestPathPointMarkerTransform)
+
+  def showTargetTable(self, skinModel, targetResults):
+    self.targetTable.visible = targetResults is not None
+    self.targetTable.setRowCount(0)
+    self.targetColorMapNames = []
+    if targetResults is None:
+      return
+
+    self.targetColorMapNames = self.logic.showMultiTargetColorMaps(skinModel, targetResults)
+    self.targetTable.setRowCount(len(targetResults))
+    for (row, (label, score, mind, mindp, pointValues)) in enumerate(targetResults):
+      self.targetTable.setItem(row, 0, qt.QTableWidgetItem(label))
+      self.targetTable.setItem(row, 1, qt.QTableWidgetItem(str(round(score,1))))
+      self.targetTable.setItem(row, 2, qt.QTableWidgetItem(str(round(mind,1))))
+
+  def onTargetTableClicked(self, row, column):
+    self.colorMapName = self.targetColorMapNames[row]
+    self.angleMapCheckBox.checked = False
+    self.accessibilityScore.text = self.targetTable.item(row, 1).text()
+    self.colorMapCheckBox.checked = True
+    self.onCheckColorMappedSkin()
+
   def onReload(self,moduleName="PercutaneousApproachAnalysis"):
     """Generic reload method for any scripted module.
     ModuleWizard will subsitute correct default moduleName.
@@ -777,7 +1387,8 @@ class PercutaneousApproachAnalysisWidget:
       qt.QMessageBox.warning(slicer.util.mainWindow(), 
           "Reload and Test", 'Exception!\n\n' + str(e) + "\n\nSee Python Console for Stack Trace")
 
-  def onDeleteModelsButton(self):
+  def resetOutcomes(self):
+    """Reset the outcome controls and hide the path and marker models"""
     if self.deleteModelsButton.enabled == True:
         # reset all status
         self.deleteModelsButton.enabled = False
@@ -799,9 +1410,23 @@ class PercutaneousApproachAnalysisWidget:
         self.minimumLengthPathCheckBox.enabled = False
         self.allPathsOpacitySlider.enabled = False
 
+        self.removeCameraObservers()
+        for display in [self.allPaths, self.samplePaths, self.singlePath, self.pointMarker, self.virtualPath2, self.virtualMarker,
+                        self.theLongestPath, self.theLongestPathPointMarker, self.theShortestPath, self.theShortestPathPointMarker]:
+          if display != None:
+            display.SetVisibility(self.OFF)
+
+  def onDeleteModelsButton(self):
+    if self.deleteModelsButton.enabled == True:
+        self.resetOutcomes()
+
         # delete all models
         logic = PercutaneousApproachAnalysisLogic()
         logic.removeModel(self.modelReceived)
+        if self.samplePathsModel != None:
+          logic.removeModel(self.samplePathsModel)
+          self.samplePathsModel = None
+          self.samplePaths = None
         logic.removeModel(self.singlePathModel)
         logic.removeModel(self.virtualPathModel)
         logic.removeModel(self.theLongestPathModel)
@@ -833,8 +1458,102 @@ class PercutaneousApproachAnalysisLogic:
   this class and make use of the functionality without
   requiring an instance of the Widget
   """
-  def __init__(self):
-    pass
+  def __init__(self, numberOfWorkers=1, maximumCacheSize=512*1024*1024):
+    from PercutaneousApproachAnalysisLib import LRUCache, CandidateFilter
+
+    # Number of threads used for ray casting (1 runs in the calling thread)
+    # and their pool, see setNumberOfWorkers
+    self.numberOfWorkers = 1
+    self.pool = None
+    self.setNumberOfWorkers(numberOfWorkers)
+
+    # Preprocessed skins and obstacle locators, keyed by geometryKey()
+    self.geometryCache = LRUCache(maximumCacheSize, self.geometryMemorySize)
+
+    # Result of the last visibility pass, shared by makePaths and runPointWise
+    self.visibility = None
+
+    # Voxel size (mm) of the coarse visibility pass used for live previews
+    self.previewVoxelSize = 10.0
+
+    # Measured ray casting throughput, used to plan progressive levels
+    self.raysPerSecond = 100000.0
+
+    # Called as progress(done, total) between chunks of rays; an exception
+    # raised by it (e.g. AnalysisCancelled) stops the analysis
+    self.progress = None
+
+    # Storage of the approachable paths: 'indices' (uint32 skin point
+    # indices) or 'bitset' (one bit per target and skin point pair)
+    self.pathStorage = 'indices'
+
+    # Gather the path coordinates in single precision
+    self.singlePrecisionPaths = False
+
+    # Voxel size (mm) used to subsample the target model vertices; None
+    # sweeps all of them
+    self.targetVoxelSize = None
+
+    # Result of the last target model sweep
+    self.sweep = None
+
+    # Needle reach (mm): triangles farther from the target do not count in
+    # the score and the color map
+    self.needleLength = 130.0
+
+    # (SkinGeometry, Accessibility.ApproachTable) of the last point-wise
+    # run and (SkinGeometry, [(label, ApproachTable), ...]) of the last
+    # multi-target run, kept to rescore for another needle length
+    self.approachTable = None
+    self.targetApproachTables = None
+
+    # Tests that reject path entry points before their rays are cast (all
+    # off by default), and the number of rays each one saved in the last
+    # makePaths
+    self.candidateFilter = CandidateFilter()
+    self.culledRays = None
+
+    # Insertion angle (degrees from the skin normal) and PathLookup of
+    # every path of the last makePaths
+    self.pathAngles = None
+    self.pathLookup = None
+
+    # Number of paths drawn while the camera moves, see pathSamplePoints
+    self.lodPathCount = 5000
+
+    # DiskCache of the preprocessed skins and obstacles and of the full
+    # visibility passes, kept across sessions; None disables it
+    self.diskCache = None
+
+  def setNumberOfWorkers(self, numberOfWorkers):
+    """
+    Ray casting threads.  Call it from the main thread: the pool is created
+    here, never from the analysis thread.  Worker processes are left to the
+    command line tools (PercutaneousApproachAnalysisLib.Headless), as they
+    cannot be started safely from within Slicer.
+    """
+    from PercutaneousApproachAnalysisLib import RayCastingThreads
+
+    numberOfWorkers = max(1, int(numberOfWorkers))
+    if self.pool is not None and self.pool.numberOfWorkers == numberOfWorkers:
+      return
+    self.closeRayCastingPool()
+    self.numberOfWorkers = numberOfWorkers
+    if numberOfWorkers > 1:
+      self.pool = RayCastingThreads(numberOfWorkers)
+
+  def setDiskCache(self, directory, maximumSize=1024*1024*1024):
+    """Store the preprocessed skins and obstacles and the visibility passes
+    in directory, keyed by the content of the skin, the obstacle and the
+    target.  None disables the cache."""
+    from PercutaneousApproachAnalysisLib import DiskCache
+
+    self.diskCache = None
+    if directory != None:
+      self.diskCache = DiskCache(directory, maximumSize)
+
+  def cleanup(self):
+    self.closeRayCastingPool()
 
   def hasImageData(self,volumeNode):
     """This is a dummy logic method that 
@@ -870,13 +1589,474 @@ class PercutaneousApproachAnalysisLogic:
     scene = slicer.mrmlScene
     scene.RemoveNode(transform)    
 
+  def obstacleLocator(self, obstacleModelNode, batchRayCasting=True):
+    """
+    Return the ObstacleBVH (or the vtkModifiedBSPTree when batchRayCasting
+    is False) of the obstacle model.  Locators are cached until the
+    points or cells of the model are modified.
+    """
+    from PercutaneousApproachAnalysisLib import cachedObstacleBVH
+
+    kind = 'bvh' if batchRayCasting else 'bsp'
+    polyData = obstacleModelNode.GetPolyData()
+    key = self.geometryKey(kind, obstacleModelNode)
+
+    locator = self.geometryCache.get(key)
+    if locator is not None:
+      return locator
+
+    if batchRayCasting:
+      locator = cachedObstacleBVH(polyData, self.diskCache)
+    else:
+      locator = vtk.vtkModifiedBSPTree()
+      locator.SetDataSet(polyData)
+      locator.BuildLocator()
+    self.cacheGeometry(key, locator)
+
+    return locator
+
+  def skinGeometry(self, skinModelNode):
+    """
+    Return the preprocessed skin (normals, triangle centers and areas) of
+    the skin model, computed once per version of its polydata
+    """
+    from PercutaneousApproachAnalysisLib import cachedSkinGeometry
+
+    key = self.geometryKey('skin', skinModelNode)
+
+    skin = self.geometryCache.get(key)
+    if skin is not None:
+      return skin
+
+    skin = cachedSkinGeometry(skinModelNode.GetPolyData(), self.diskCache)
+    self.cacheGeometry(key, skin)
+
+    return skin
+
+  def cacheGeometry(self, key, item):
+    # Older versions of the model can no longer be hit
+    self.geometryCache.removeIf(lambda oldKey: oldKey[:2] == key[:2])
+    self.geometryCache.put(key, item)
+
+  def geometryKey(self, kind, modelNode):
+    """
+    Cache key of the kind of structure made from the model: (kind, node
+    ID) and the geometryVersion of its polydata, so that the color maps
+    written to the point scalars do not invalidate it
+    """
+    from PercutaneousApproachAnalysisLib import geometryVersion
+
+    return (kind, modelNode.GetID()) + geometryVersion(modelNode.GetPolyData())
+
+  def geometrySnapshot(self, skinModelNode, obstacleModelNode):
+    """
+    What the analysis thread needs of the skin and obstacle models, taken
+    on the main thread: their cached SkinGeometry and ObstacleBVH or, when
+    they are not cached, a copy of their points and cells.  See
+    analysisGeometry().
+    """
+    from PercutaneousApproachAnalysisLib import geometryCopy
+
+    snapshot = {'skinKey': self.geometryKey('skin', skinModelNode), 'obstacleKey': self.geometryKey('bvh', obstacleModelNode)}
+    snapshot['skin'] = self.geometryCache.get(snapshot['skinKey'])
+    if snapshot['skin'] is None:
+      snapshot['skinPolyData'] = geometryCopy(skinModelNode.GetPolyData())
+    snapshot['obstacle'] = self.geometryCache.get(snapshot['obstacleKey'])
+    if snapshot['obstacle'] is None:
+      snapshot['obstaclePolyData'] = geometryCopy(obstacleModelNode.GetPolyData())
+
+    return snapshot
+
+  def analysisGeometry(self, snapshot):
+    """
+    (SkinGeometry, ObstacleBVH) of a geometrySnapshot, read from the disk
+    cache or built from its copies when they were not in the geometry
+    cache.  Touches neither the scene nor the geometry cache, so this can
+    run in a worker thread.
+    """
+    from PercutaneousApproachAnalysisLib import cachedObstacleBVH, cachedSkinGeometry
+
+    skin = snapshot['skin']
+    if skin is None:
+      skin = cachedSkinGeometry(snapshot['skinPolyData'], self.diskCache)
+    obstacleBVH = snapshot['obstacle']
+    if obstacleBVH is None:
+      obstacleBVH = cachedObstacleBVH(snapshot['obstaclePolyData'], self.diskCache)
+
+    return (skin, obstacleBVH)
+
+  def threadCopy(self):
+    """
+    Copy of the logic for the analysis thread.  It shares the ray casting
+    threads and the disk cache, but the results it computes stay in the
+    copy until adoptResults() is called on the main thread.
+    """
+    import copy
+
+    worker = copy.copy(self)
+    worker.candidateFilter = copy.copy(self.candidateFilter)
+    worker.geometryCache = None
+    return worker
+
+  # Attributes of a threadCopy() that adoptResults() takes over
+  analysisStateNames = ('visibility', 'sweep', 'raysPerSecond', 'approachTable', 'targetApproachTables',
+                        'culledRays', 'paths', 'pathAngles', 'pathLookup')
+
+  def analysisState(self):
+    return dict((name, getattr(self, name)) for name in self.analysisStateNames)
+
+  def adoptResults(self, snapshot, geometry, state, skinModelNode, obstacleModelNode):
+    """
+    Take over on the main thread what the analysis thread computed: the
+    analysisState() of its logic copy, and the skin and obstacle it built,
+    which are cached unless the models were modified meanwhile.
+    """
+    (skin, obstacleBVH) = geometry
+    if snapshot['skin'] is None and self.geometryKey('skin', skinModelNode) == snapshot['skinKey']:
+      self.cacheGeometry(snapshot['skinKey'], skin)
+    if snapshot['obstacle'] is None and self.geometryKey('bvh', obstacleModelNode) == snapshot['obstacleKey']:
+      obstacleBVH.polyData = obstacleModelNode.GetPolyData()
+      self.cacheGeometry(snapshot['obstacleKey'], obstacleBVH)
+
+    for name in self.analysisStateNames:
+      setattr(self, name, state[name])
+
+  def geometryMemorySize(self, item):
+    from PercutaneousApproachAnalysisLib import ObstacleBVH, SkinGeometry
+
+    if isinstance(item, (ObstacleBVH, SkinGeometry)):
+      return item.memorySize()
+    # vtkModifiedBSPTree does not report its size; use the dataset as an estimate
+    return 1024 * item.GetDataSet().GetActualMemorySize()
+
+  def skinVisibility(self, skin, obstacleBVH, target, voxelSize=None):
+    """
+    Visibility of the skin vertices and triangle centers from the target.
+    Both are cast in one batch, which is reused until the skin, the
+    obstacle or the target changes.  A voxelSize gives a coarse result
+    from one ray per voxel.  When only the obstacle has changed, only the
+    rays near the changed triangles are cast again.
+    """
+    from PercutaneousApproachAnalysisLib import SkinVisibility
+
+    previous = self.visibility
+    if previous is not None and previous.matches(skin, obstacleBVH, target, voxelSize, self.candidateFilter):
+      return previous
+
+    self.visibility = None
+    if voxelSize == None:
+      self.visibility = self.cachedVisibility(skin, obstacleBVH, target)
+    if self.visibility is None:
+      self.visibility = self.updatedVisibility(previous, skin, obstacleBVH, target, voxelSize)
+    if self.visibility is None:
+      self.visibility = SkinVisibility(skin, obstacleBVH, target, self.segmentsClear, voxelSize, candidateFilter=self.candidateFilter)
+    if voxelSize == None:
+      self.storeVisibility(self.visibility)
+
+    return self.visibility
+
+  def updatedVisibility(self, previous, skin, obstacleBVH, target, voxelSize=None):
+    """
+    The previous visibility pass, re-cast only near the changed triangles
+    of the obstacle.  None when it is for another skin, target or voxel
+    size, or when too much of the obstacle changed.
+    """
+    if previous is None or not previous.matches(skin, previous.obstacle, target, voxelSize, self.candidateFilter):
+      return None
+    return previous.updatedForObstacle(obstacleBVH, self.segmentsClear)
+
+  def cachedVisibility(self, skin, obstacleBVH, target):
+    """
+    Full visibility pass read from the disk cache, or None
+    """
+    from PercutaneousApproachAnalysisLib import SkinVisibility, visibilityKey
+
+    key = visibilityKey(skin, obstacleBVH, target, self.candidateFilter)
+    if self.diskCache is None or key is None:
+      return None
+    arrays = self.diskCache.get(key)
+    if arrays is None:
+      return None
+    try:
+      return SkinVisibility.fromClear(skin, obstacleBVH, target, arrays['clear'], self.candidateFilter)
+    except (KeyError, ValueError):
+      return None
+
+  def storeVisibility(self, visibility):
+    from PercutaneousApproachAnalysisLib import visibilityKey
+
+    key = visibilityKey(visibility.skin, visibility.obstacle, visibility.target, self.candidateFilter)
+    if self.diskCache is None or key is None:
+      return
+    if not os.path.exists(self.diskCache.fileName(key)):
+      self.diskCache.put(key, {'clear': visibility.clear})
+
+  def segmentsClear(self, obstacleBVH, starts, ends):
+    """
+    Batch visibility test, sharded over the threads of self.pool when
+    there is more than one worker
+    """
+    start = time.time()
+    pool = self.pool
+    if pool is None or len(starts) < 2*pool.numberOfWorkers:
+      clear = obstacleBVH.segmentsClear(starts, ends, progress=self.progress)
+    else:
+      clear = pool.segmentsClear(obstacleBVH, starts, ends, progress=self.progress)
+
+    elapsed = time.time() - start
+    if len(starts) >= 10000 and elapsed > 0:
+      self.raysPerSecond = len(starts) / elapsed
+
+    return clear
+
+  def closeRayCastingPool(self):
+    if self.pool is not None:
+      self.pool.close()
+      self.pool = None
+    self.numberOfWorkers = 1
+
+  def targetModelPoints(self, targetModelNode):
+    """
+    Vertices of the target model, or one vertex per voxel of
+    self.targetVoxelSize
+    """
+    (points, samples, representatives) = self.targetModelClusters(targetModelNode)
+    return points[samples]
+
+  def targetModelClusters(self, targetModelNode):
+    """
+    All the target model vertices, the indices of the ones that are
+    analyzed and, for every vertex, the index of its analyzed vertex
+    """
+    import numpy
+    from vtk.util import numpy_support
+    from PercutaneousApproachAnalysisLib import voxelClusters
+
+    polyT = targetModelNode.GetPolyData()
+    if polyT.GetNumberOfPoints() == 0:
+      return (numpy.zeros([0,3]), numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int))
+    points = numpy_support.vtk_to_numpy(polyT.GetPoints().GetData()).astype(numpy.float64)
+    if self.targetVoxelSize == None:
+      return (points, numpy.arange(len(points)), numpy.arange(len(points)))
+
+    (samples, representatives) = voxelClusters(points, self.targetVoxelSize)
+    return (points, samples, representatives)
+
+  def targetSweep(self, skin, obstacleBVH, targetPoints):
+    """
+    Visibility of the skin vertices from all the target points, reused
+    until the skin, the obstacle or the targets change
+    """
+    import numpy
+    from PercutaneousApproachAnalysisLib import TargetSweep
+
+    if self.sweep is None or not self.sweep.matches(skin, obstacleBVH, targetPoints, self.candidateFilter):
+      self.sweep = None
+      dtype = numpy.float32 if self.singlePrecisionPaths else numpy.float64
+      self.sweep = TargetSweep(skin, obstacleBVH, targetPoints, self.segmentsClear, pathStorage=self.pathStorage, dtype=dtype,
+                               candidateFilter=self.candidateFilter)
+
+    return self.sweep
+
+  def runTargetSweep(self, targetModelNode, obstacleModelNode, skinModelNode):
+    """
+    Sweep all the target model vertices.  Returns the fraction of the
+    target reachable from each skin vertex.  Nothing is written to the
+    scene, so this can run in a worker thread.
+    """
+    skin = self.skinGeometry(skinModelNode)
+    obstacleBVH = self.obstacleLocator(obstacleModelNode)
+    targetPoints = self.targetModelPoints(targetModelNode)
+    logging.debug("runTargetSweep(): %d target points", len(targetPoints))
+
+    return self.targetSweep(skin, obstacleBVH, targetPoints).reachability()
+
+  def runTargetAccessibility(self, targetModelNode, obstacleModelNode, skinModelNode):
+    """
+    Accessible skin area score (see calcApproachScore) of every vertex of
+    the target model.  With self.targetVoxelSize, the vertices of a voxel
+    share the score of one of them.  The skin and the obstacle are
+    preprocessed once and the rays of many targets are cast together.
+    Returns None for non-triangulated skins.  Nothing is written to the
+    scene.
+    """
+    skin = self.skinGeometry(skinModelNode)
+    if skin.triangles is None:
+      return None
+    obstacleBVH = self.obstacleLocator(obstacleModelNode)
+
+    return self.targetAccessibilityScores(skin, obstacleBVH, self.targetModelClusters(targetModelNode))
+
+  def targetAccessibilityScores(self, skin, obstacleBVH, targetClusters):
+    """
+    runTargetAccessibility for a SkinGeometry, an ObstacleBVH and the
+    targetModelClusters of the target model.  Does not touch the scene.
+    """
+    from PercutaneousApproachAnalysisLib import targetScores
+
+    if skin.triangles is None:
+      return None
+    (points, samples, representatives) = targetClusters
+    logging.debug("runTargetAccessibility(): %d of %d target points", len(samples), len(points))
+
+    scores = targetScores(skin, obstacleBVH, points[samples], self.segmentsClear, self.needleLength)
+
+    return scores[representatives]
+
+  def targetNodePoints(self, targetPointNode):
+    """Positions and labels of all the control points of the target node"""
+    import numpy
+
+    nTargets = targetPointNode.GetNumberOfFiducials()
+    targetPoints = numpy.zeros([nTargets,3])
+    labels = []
+    for index in range(nTargets):
+      tPoint = targetPointNode.GetMarkupPointVector(index, 0)
+      targetPoints[index] = [tPoint[0], tPoint[1], tPoint[2]]
+      labels.append(targetPointNode.GetNthFiducialLabel(index))
+
+    return (targetPoints, labels)
+
+  def runMultiTarget(self, targetPointNode, obstacleModelNode, skinModelNode):
+    """
+    Point-wise analysis of every control point of the target node in one
+    pass: the skin and the obstacle are preprocessed once and the rays of
+    all the targets are cast together (over the worker processes).
+    Returns one (label, score, mind, mindp, pointValues) per target, equal
+    to runPointWise for that target and its "Colors" values; pointValues
+    is None for non-triangulated skins.  Nothing is written to the scene.
+    """
+    skin = self.skinGeometry(skinModelNode)
+    obstacleBVH = self.obstacleLocator(obstacleModelNode)
+    (targetPoints, labels) = self.targetNodePoints(targetPointNode)
+
+    if skin.triangles is None:
+      self.targetApproachTables = None
+      results = []
+      for (label, point) in zip(labels, targetPoints):
+        (score, mind, mindp) = self.calcApproachScore(list(point), skin, obstacleBVH)
+        results.append((label, score, mind, mindp, None))
+      return results
+
+    return self.multiTargetResults(skin, obstacleBVH, targetPoints, labels)
+
+  def multiTargetResults(self, skin, obstacleBVH, targetPoints, labels):
+    """
+    runMultiTarget for a triangulated SkinGeometry, an ObstacleBVH and the
+    targetNodePoints of the target node; None for other skins, which are
+    scored cell by cell against the obstacle model.  Does not touch the
+    scene.
+    """
+    from PercutaneousApproachAnalysisLib import targetBatches, Accessibility
+
+    self.targetApproachTables = None
+    if skin.triangles is None:
+      return None
+    logging.debug("runMultiTarget(): %d targets", len(targetPoints))
+
+    results = []
+    tables = []
+    for (begin, clear) in targetBatches(skin.centers, targetPoints, obstacleBVH, self.segmentsClear):
+      for (index, cellClear) in enumerate(clear):
+        table = Accessibility.ApproachTable(skin.centers, skin.areas, cellClear, targetPoints[begin + index])
+        tables.append((labels[begin + index], table))
+        results.append((labels[begin + index],) + self.tableColorMapValues(skin, table))
+    self.targetApproachTables = (skin, tables)
+
+    return results
+
+  def cullingReport(self):
+    """Rays saved by each culling test in the last makePaths, as text"""
+    from PercutaneousApproachAnalysisLib.Culling import countsText
+
+    if self.culledRays is None:
+      return "culling off"
+    return countsText(self.culledRays) or "none"
+
+  def rescoreMultiTarget(self, needleLength=None):
+    """
+    Results of the last runMultiTarget for another needle length, from the
+    kept per-triangle tables; no ray is cast.  Returns None when there is
+    nothing to rescore.
+    """
+    if self.targetApproachTables is None:
+      return None
+    if needleLength != None:
+      self.needleLength = needleLength
+
+    (skin, tables) = self.targetApproachTables
+    return [(label,) + self.tableColorMapValues(skin, table) for (label, table) in tables]
+
+  def showMultiTargetColorMaps(self, skinModelNode, results):
+    """
+    Add the color values of every target as the point scalars
+    "Colors_1", "Colors_2", ... of the skin model and return their names
+    """
+    names = []
+    for (index, (label, score, mind, mindp, pointValues)) in enumerate(results):
+      name = "Colors_%d" % (index + 1)
+      if pointValues is not None:
+        self.updatePointScalars(skinModelNode, name, pointValues)
+      names.append(name)
+    skinModelNode.Modified()
+
+    return names
+
+  def showTargetAccessibilityMap(self, targetModelNode, scores):
+    from vtk.util import numpy_support
+
+    pointValue = numpy_support.numpy_to_vtk(scores, deep=1, array_type=vtk.VTK_DOUBLE)
+    pointValue.SetName("AccessibilityScore")
+    self.showColorMap(targetModelNode, pointValue, (0.0, max(float(scores.max()), 1.0) if len(scores) > 0 else 1.0))
+    if targetModelNode.GetModelDisplayNode() != None:
+      targetModelNode.GetModelDisplayNode().SetScalarVisibility(1)
+
+  def showReachabilityMap(self, skinModelNode, reachability):
+    from vtk.util import numpy_support
+
+    pointValue = numpy_support.numpy_to_vtk(reachability, deep=1, array_type=vtk.VTK_DOUBLE)
+    pointValue.SetName("Reachability")
+    self.showColorMap(skinModelNode, pointValue, (0.0, 1.0))
+
+  def rankedPaths(self):
+    """Path numbers of the last makePaths by increasing insertion angle"""
+    import numpy
+
+    if self.pathAngles is None:
+      return None
+    return numpy.argsort(self.pathAngles, kind='mergesort')
+
+  def pathSamplePoints(self):
+    """Target and entry points, interleaved, of at most lodPathCount paths
+    of the last makePaths spread over the skin, or None when there are not
+    more paths than that"""
+    from PercutaneousApproachAnalysisLib import stratifiedSample
+
+    if self.pathLookup is None or len(self.pathLookup) <= self.lodPathCount:
+      return None
+    return self.pathLookup.interleavedPoints(stratifiedSample(self.paths, self.lodPathCount))
+
+  def showInsertionAngleMap(self, skinModelNode, paths, angles):
+    """
+    Add the smallest insertion angle of the paths entering at each skin
+    point as the "InsertionAngle" point scalars (-1 where none enters)
+    """
+    from PercutaneousApproachAnalysisLib import insertionAngleMap
+
+    if angles is None:
+      return
+    self.updatePointScalars(skinModelNode, "InsertionAngle", insertionAngleMap(paths, angles))
+
   def makeSinglePath(self, p, pointNumber):  
     import numpy 
 
     tipPoint = numpy.zeros([2,3])
 
-    targetP = [p[pointNumber*2][0], p[pointNumber*2][1], p[pointNumber*2][2]]
-    skinP = [p[pointNumber*2+1][0], p[pointNumber*2+1][1], p[pointNumber*2+1][2]]
+    # p is the PathTable returned by makePaths
+    target = p.targetPoint(pointNumber)
+    skin = p.entryPoint(pointNumber)
+    targetP = [float(target[0]), float(target[1]), float(target[2])]
+    skinP = [float(skin[0]), float(skin[1]), float(skin[2])]
 
     tipPoint[0] = targetP
     tipPoint[1] = skinP
@@ -884,7 +2064,7 @@ class PercutaneousApproachAnalysisLogic:
     onePath = [targetP]
     onePath.append(skinP)
 
-    distance = numpy.sqrt(numpy.power(p[pointNumber*2]-p[pointNumber*2+1],2).sum())
+    distance = numpy.sqrt(numpy.power(numpy.array(targetP)-numpy.array(skinP),2).sum())
 
     self.tmpSwitch = 1      
 
@@ -896,7 +2076,8 @@ class PercutaneousApproachAnalysisLogic:
     tipPoint = numpy.zeros([2,3])
 
     targetP = [virtualPosition[0], virtualPosition[1], virtualPosition[2]]
-    skinP = [p[pointNumber*2+1][0], p[pointNumber*2+1][1], p[pointNumber*2+1][2]]
+    skin = p.entryPoint(pointNumber)
+    skinP = [float(skin[0]), float(skin[1]), float(skin[2])]
 
     tipPoint[0] = targetP
     tipPoint[1] = skinP
@@ -904,67 +2085,53 @@ class PercutaneousApproachAnalysisLogic:
     onePath = [targetP]
     onePath.append(skinP)
 
-    distance = numpy.sqrt(numpy.power(p[pointNumber*2+1]-virtualPosition,2).sum())
+    distance = numpy.sqrt(numpy.power(numpy.array(skinP)-numpy.array(virtualPosition),2).sum())
 
     return (onePath, distance)
 
-  def makePaths(self, targetPointNode, targetModelNode, targetSwitch, obstacleModelNode, skinModelNode):
+  def makePaths(self, targetPointNode, targetModelNode, targetSwitch, obstacleModelNode, skinModelNode, batchRayCasting=True, voxelSize=None):
     """
     Run the actual algorithm
+    voxelSize makes a coarse preview (see skinVisibility)
+    Returns (paths, minimumPoint, minimumDistance, maximumPoint,
+    maximumDistance) where paths is a PathTable and the path numbers are
+    1-based.
     """
-    print ('makePaths() is called')
-
     import numpy
+    from PercutaneousApproachAnalysisLib import PathTable, PathLookup, pathInsertionAngles
     
     # The variable nPoints represents numbers of polygons for skin model
-    poly = skinModelNode.GetPolyData()
-    polyDataNormals = vtk.vtkPolyDataNormals()
-    
-    if vtk.VTK_MAJOR_VERSION <= 5:    
-      polyDataNormals.SetInput(poly)
-    else:
-      polyDataNormals.SetInputData(poly)
-
-    polyDataNormals.Update()
-    polyData = polyDataNormals.GetOutput()
-    nPoints = polyData.GetNumberOfPoints()
+    skin = self.skinGeometry(skinModelNode)
+    polyData = skin.polyData
+    nPoints = skin.numberOfPoints
     nPoints2 = nPoints*2
 
-    # The variable nPointsT represents numbers of polygons for target model
+    # The variable nPointsT represents numbers of target points: the
+    # (subsampled) vertices of the target model, or the target fiducial
     if targetSwitch == 1:
-      polyT = targetModelNode.GetPolyData()
-      polyTDataNormals = vtk.vtkPolyDataNormals()
-
-      if vtk.VTK_MAJOR_VERSION <= 5:    
-        polyTDataNormals.SetInput(polyT)
-      else:
-        polyTDataNormals.SetInputData(polyT)
-
-      polyTDataNormals.Update()
-      polyTData = polyTDataNormals.GetOutput()
-      nPointsT = polyTData.GetNumberOfPoints()
-      nPointsT2 = nPointsT*2
-      p2 = [0.0, 0.0, 0.0]
+      targetPoints = self.targetModelPoints(targetModelNode)
     else:
-      nPointsT = 1
-      nPointsT2 = nPointsT*2
       tPoint = targetPointNode.GetMarkupPointVector(0, 0)
-      p2 = [tPoint[0], tPoint[1], tPoint[2]]
+      targetPoints = numpy.array([[tPoint[0], tPoint[1], tPoint[2]]])
+    nPointsT = len(targetPoints)
+
+    if batchRayCasting:
+      # Test all the skin points at once against a BVH of the obstacle
+      return self.batchPaths(skin, self.obstacleLocator(obstacleModelNode), targetPoints, targetSwitch, voxelSize)
 
     # The variable approachablePoints represents number of approachable polygons on the skin model 
     approachablePoints = 0 
 
+    # Fall back to one vtkModifiedBSPTree query per skin point
     p1=[0.0, 0.0, 0.0]
-    
+
     tolerance = 0.001
     t = vtk.mutable(0.0)
     x = [0.0, 0.0, 0.0] # The coordinate of the intersection 
     pcoords = [0.0, 0.0, 0.0]
     subId = vtk.mutable(0)
 
-    bspTree = vtk.vtkModifiedBSPTree()
-    bspTree.SetDataSet(obstacleModelNode.GetPolyData())
-    bspTree.BuildLocator()
+    bspTree = self.obstacleLocator(obstacleModelNode, False)
 
     maximumDistance = 0.0
     minimumDistance = 1000.0 
@@ -972,22 +2139,31 @@ class PercutaneousApproachAnalysisLogic:
     maximumPoint = 0
     minimumPoint = 0
 
-    # Create an array for needle passing points 
-    self.p = numpy.zeros([nPointsT*nPoints2,3])
+    # Approachable paths, stored as (target, skin point) indices
+    self.paths = PathTable(targetPoints, skin.points, self.pathStorage, numpy.float32 if self.singlePrecisionPaths else numpy.float64)
+
+    # The rejected skin points are never queried
+    self.culledRays = None
+    if self.candidateFilter.enabled():
+      self.culledRays = self.candidateFilter.newCounts()
+      candidates = self.candidateFilter.mask(skin.points, skin.outwardPointNormals(), targetPoints, self.culledRays)
+      logging.debug("makePaths(): rays culled: %s", self.cullingReport())
+    else:
+      candidates = numpy.ones((nPointsT, nPoints), dtype=bool)
 
     for indexT in range(0, nPointsT):
 
-      p2 = [tPoint[0], tPoint[1], tPoint[2]]
+      p2 = [float(c) for c in targetPoints[indexT]]
 
-      for index in range(0, nPoints):
+      clear = numpy.zeros(nPoints, dtype=bool)
+      for index in numpy.nonzero(candidates[indexT])[0].tolist():
         polyData.GetPoint(index, p1)
         iD = bspTree.IntersectWithLine(p1, p2, tolerance, t, x, pcoords, subId)
-  
+
         if iD == 0:
           coord1 = [p2[0],p2[1],p2[2]]
-          self.p[approachablePoints*2] = coord1        
           coord2 = [p1[0],p1[1],p1[2]]
-          self.p[approachablePoints*2+1] = coord2
+          clear[index] = True
           approachablePoints = approachablePoints + 1 
 
           #
@@ -1004,47 +2180,254 @@ class PercutaneousApproachAnalysisLogic:
             minimumDistance = distance
             minimumPoint = approachablePoints
 
-    # Create the list for needle passing points to draw virtual ray 
-    self.path = [self.p[0]]
-    for index in range(1, approachablePoints*2):
-      self.path.append(self.p[index])  
-  
-    # Create an array for all approachable points 
-    pReceived = numpy.zeros([approachablePoints,3])
+      self.paths.setTarget(indexT, clear)
+
+    self.pathAngles = pathInsertionAngles(self.paths, skin.outwardPointNormals())
+    self.pathLookup = PathLookup(self.paths)
+    return (self.paths, minimumPoint, minimumDistance, maximumPoint, maximumDistance)
 
-    return (self.path, approachablePoints, self.p, minimumPoint, minimumDistance, maximumPoint, maximumDistance)
+  def batchPaths(self, skin, obstacleBVH, targetPoints, targetSwitch, voxelSize=None):
+    """
+    makePaths for a SkinGeometry, an ObstacleBVH and the target points,
+    all the skin points being tested at once.  Does not touch the scene,
+    so this can run in a worker thread.
+    """
+    import numpy
+    from PercutaneousApproachAnalysisLib import PathTable, PathLookup, pathExtremes, pathInsertionAngles
+
+    # Approachable paths, stored as (target, skin point) indices
+    if targetSwitch == 1:
+      sweep = self.targetSweep(skin, obstacleBVH, targetPoints)
+      self.paths = sweep.paths
+      self.culledRays = sweep.removed
+    else:
+      self.paths = PathTable(targetPoints, skin.points, self.pathStorage, numpy.float32 if self.singlePrecisionPaths else numpy.float64)
+      visibility = self.skinVisibility(skin, obstacleBVH, targetPoints[0], voxelSize)
+      self.paths.setTarget(0, visibility.vertexClear)
+      self.culledRays = visibility.removed
+    if self.culledRays is not None:
+      logging.debug("makePaths(): rays culled: %s", self.cullingReport())
 
-  def runPointWise(self, targetPointNode, obstacleModelNode, skinModelNode):
+    #
+    # Create length calculation algorithm
+    # 
+    # Ties go to the last path, as in the per-point loop
+    (minimumPoint, minimumDistance, maximumPoint, maximumDistance) = pathExtremes(self.paths)
+    self.pathAngles = pathInsertionAngles(self.paths, skin.outwardPointNormals())
+    self.pathLookup = PathLookup(self.paths)
+    return (self.paths, minimumPoint, minimumDistance, maximumPoint, maximumDistance)
+
+  def runPointWise(self, targetPointNode, obstacleModelNode, skinModelNode, batchRayCasting=True, voxelSize=None):
     """
     Run point-wise analysis
+    voxelSize makes a coarse preview (see skinVisibility)
     """
-    print ("runPointWise()")
     tPoint = targetPointNode.GetMarkupPointVector(0, 0)
     pTarget = [tPoint[0], tPoint[1], tPoint[2]]
-    poly = skinModelNode.GetPolyData()
-    polyDataNormals = vtk.vtkPolyDataNormals()
+    skin = self.skinGeometry(skinModelNode)
 
-    if vtk.VTK_MAJOR_VERSION <= 5:
-      polyDataNormals.SetInput(poly)
+    obstacleLocator = self.obstacleLocator(obstacleModelNode, batchRayCasting)
+
+    (score, mind, mindp) = self.calcApproachScore(pTarget, skin, obstacleLocator, skinModelNode, voxelSize)
+
+    logging.debug("runPointWise(): accessible area %f, minimum distance %f", score, mind)
+
+    return (score, mind, mindp)
+
+  def calcApproachScore(self, point, skin, obstacleLocator, skinModelNode=None, voxelSize=None):
+    """
+    Compute the accessible area score and the "Colors" map of the skin.
+    skin is a SkinGeometry or a skin polydata with normals.
+    obstacleLocator is either an ObstacleBVH, for which all the triangles
+    are processed as arrays, or a vtkModifiedBSPTree queried cell by cell.
+    """
+    from PercutaneousApproachAnalysisLib import ObstacleBVH, SkinGeometry
+
+    if not isinstance(skin, SkinGeometry):
+      skin = SkinGeometry(skin)
+
+    self.approachTable = None
+    if not isinstance(obstacleLocator, ObstacleBVH):
+      return self.calcApproachScoreByCell(point, skin.polyData, obstacleLocator, skinModelNode)
+
+    # Meshes with non-triangular cells go through the per-cell loop, which
+    # reports and skips those cells
+    if skin.triangles is None:
+      bspTree = vtk.vtkModifiedBSPTree()
+      bspTree.SetDataSet(obstacleLocator.polyData)
+      bspTree.BuildLocator()
+      return self.calcApproachScoreByCell(point, skin.polyData, bspTree, skinModelNode)
+
+    (score, minDistance, minDistancePoint, pointValues) = self.pointWiseValues(point, skin, obstacleLocator, voxelSize)
+    if skinModelNode != None:
+      self.showColorMapValues(skinModelNode, pointValues)
+
+    return (score, minDistance, minDistancePoint)
+
+  def pointWiseValues(self, point, skin, obstacleBVH, voxelSize=None):
+    """
+    Score, minimum distance, minimum distance point and "Colors" values of
+    a triangulated SkinGeometry from the visibility pass of the point,
+    keeping its approach table for rescore().  Returns None for other
+    skins, which are scored cell by cell (see calcApproachScore).  Does
+    not touch the scene.
+    """
+    from PercutaneousApproachAnalysisLib import Accessibility
+
+    self.approachTable = None
+    if skin.triangles is None:
+      return None
+
+    clear = self.skinVisibility(skin, obstacleBVH, point, voxelSize).cellClear
+    self.approachTable = (skin, Accessibility.ApproachTable(skin.centers, skin.areas, clear, point))
+
+    return self.tableColorMapValues(skin, self.approachTable[1])
+
+  def scoreFromCellVisibility(self, point, skin, cellClear, skinModelNode=None):
+    """
+    Score and "Colors" map of a triangulated SkinGeometry given the
+    visibility of its triangle centers
+    """
+    from PercutaneousApproachAnalysisLib import Accessibility
+
+    table = Accessibility.ApproachTable(skin.centers, skin.areas, cellClear, point)
+    return self.scoreFromTable(skin, table, skinModelNode)
+
+  def scoreFromTable(self, skin, table, skinModelNode=None):
+    (score, minDistance, minDistancePoint, pointValues) = self.tableColorMapValues(skin, table)
+
+    if skinModelNode != None:
+      self.showColorMapValues(skinModelNode, pointValues)
+
+    return (score, minDistance, minDistancePoint)
+
+  def rescore(self, skinModelNode=None, needleLength=None):
+    """
+    Score and "Colors" map of the last point-wise run for another needle
+    length, recomputed from the kept per-triangle visibility and distances
+    without casting any ray.  Returns None when there is nothing to
+    rescore.
+    """
+    if self.approachTable is None:
+      return None
+    if needleLength != None:
+      self.needleLength = needleLength
+
+    (skin, table) = self.approachTable
+    (score, minDistance, minDistancePoint, pointValues) = self.tableColorMapValues(skin, table)
+    if skinModelNode != None:
+      self.updatePointScalars(skinModelNode, "Colors", pointValues)
+
+    return (score, minDistance, minDistancePoint)
+
+  def colorMapValues(self, point, skin, cellClear):
+    """
+    Score, minimum distance, minimum distance point and per-point color
+    values, without touching the scene
+    """
+    from PercutaneousApproachAnalysisLib import Accessibility
+
+    return self.tableColorMapValues(skin, Accessibility.ApproachTable(skin.centers, skin.areas, cellClear, point))
+
+  def tableColorMapValues(self, skin, table):
+    from PercutaneousApproachAnalysisLib import Accessibility
+
+    (score, minDistance, minDistancePoint, cellValues) = table.score(self.needleLength)
+    pointValues = Accessibility.pointValuesFromCells(skin.triangles, cellValues, skin.numberOfPoints, skin.lastCells())
+
+    return (score, minDistance, minDistancePoint, pointValues)
+
+  def showColorMapValues(self, skinModelNode, pointValues):
+    from vtk.util import numpy_support
+
+    pointValue = numpy_support.numpy_to_vtk(pointValues, deep=1, array_type=vtk.VTK_DOUBLE)
+    pointValue.SetName("Colors")
+    self.showColorMap(skinModelNode, pointValue)
+
+  def updatePointScalars(self, modelNode, name, values):
+    """
+    Write values into the point scalars called name of the model, in place
+    when the array already has the right size
+    """
+    from vtk.util import numpy_support
+
+    array = modelNode.GetPolyData().GetPointData().GetArray(name)
+    if array is None or array.GetNumberOfComponents() != 1 or array.GetNumberOfTuples() != len(values):
+      array = numpy_support.numpy_to_vtk(values, deep=1, array_type=vtk.VTK_DOUBLE)
+      array.SetName(name)
+      modelNode.AddPointScalars(array)
     else:
-      polyDataNormals.SetInputData(poly)
+      numpy_support.vtk_to_numpy(array)[:] = values
+      array.Modified()
+    modelNode.Modified()
+
+  def runPointWiseProgressive(self, targetPointNode, obstacleModelNode, skinModelNode, latencyBudget=0.5):
+    """
+    Coarse-to-fine version of runPointWise.  Yields (score, mind, mindp)
+    after updating the color map at each level; the first level is planned
+    to take about latencyBudget seconds and the last one is the exact
+    result of runPointWise.
+    """
+    tPoint = targetPointNode.GetMarkupPointVector(0, 0)
+    pTarget = [tPoint[0], tPoint[1], tPoint[2]]
+    skin = self.skinGeometry(skinModelNode)
+    obstacleBVH = self.obstacleLocator(obstacleModelNode)
 
-    polyDataNormals.ComputeCellNormalsOn()
-    polyDataNormals.Update()
-    polyData = polyDataNormals.GetOutput()
+    for (voxelSize, cellClear) in self.progressiveCellVisibility(pTarget, skin, obstacleBVH, latencyBudget):
+      yield self.scoreFromCellVisibility(pTarget, skin, cellClear, skinModelNode)
 
-    bspTree = vtk.vtkModifiedBSPTree()
-    bspTree.SetDataSet(obstacleModelNode.GetPolyData())
-    bspTree.BuildLocator()
+    yield self.runPointWise(targetPointNode, obstacleModelNode, skinModelNode)
 
-    (score, mind, mindp) = self.calcApproachScore(pTarget, polyData, bspTree, skinModelNode)
+  def progressiveCellVisibility(self, pTarget, skin, obstacleBVH, latencyBudget=0.5):
+    """
+    Yield (voxelSize, cellClear) for each coarse level, then leave the full
+    visibility pass in self.visibility.  There are no levels when the pass
+    is already done, in the disk cache, or only needs an update for a
+    modified obstacle.  Does not touch the scene.
+    """
+    from PercutaneousApproachAnalysisLib import SkinVisibility, ProgressiveCellVisibility, progressiveVoxelSizes
+
+    done = self.visibility is not None and self.visibility.matches(skin, obstacleBVH, pTarget, None, self.candidateFilter)
+    if not done:
+      known = self.cachedVisibility(skin, obstacleBVH, pTarget)
+      if known is None:
+        known = self.updatedVisibility(self.visibility, skin, obstacleBVH, pTarget)
+        if known is not None:
+          self.storeVisibility(known)
+      if known is not None:
+        self.visibility = known
+        done = True
+    if skin.triangles is not None and not done:
+      progressive = ProgressiveCellVisibility(skin, obstacleBVH, pTarget, self.segmentsClear)
+      for voxelSize in progressiveVoxelSizes(skin, self.raysPerSecond, latencyBudget):
+        logging.debug("progressiveCellVisibility(): %g mm level", voxelSize)
+        yield (voxelSize, progressive.level(voxelSize))
+
+      # The vertices and the remaining triangles are cast in the full pass
+      self.visibility = SkinVisibility(skin, obstacleBVH, pTarget, self.segmentsClear, knownCells=progressive.knownCells(),
+                                       candidateFilter=self.candidateFilter)
+      self.storeVisibility(self.visibility)
+
+  def computeVisibility(self, pTarget, skin, obstacleBVH, progressive=True, levelCallback=None):
+    """
+    Heavy part of the analysis: cast the visibility rays of a SkinGeometry
+    and an ObstacleBVH, leaving the result in self.visibility where
+    batchPaths and pointWiseValues pick it up.  Nothing is written to the
+    scene, so this can run in a worker thread.  With progressive,
+    levelCallback(score, mind, mindp, pointValues) receives the coarse
+    color maps as they are computed.
+    """
+    if skin.triangles is None:
+      return
 
-    print ("Accessible Area = %f" % (score))
-    print ("Minmum Distance = %f" % (mind))
+    if progressive:
+      for (voxelSize, cellClear) in self.progressiveCellVisibility(pTarget, skin, obstacleBVH):
+        if levelCallback is not None:
+          levelCallback(*self.colorMapValues(pTarget, skin, cellClear))
 
-    return (score, mind, mindp)
+    self.skinVisibility(skin, obstacleBVH, pTarget)
 
-  def calcApproachScore(self, point, skinPolyData, obstacleBspTree, skinModelNode=None):
+  def calcApproachScoreByCell(self, point, skinPolyData, obstacleBspTree, skinModelNode=None):
 
     pTarget = point
     polyData = skinPolyData
@@ -1096,14 +2479,14 @@ class PercutaneousApproachAnalysisLogic:
           if skinModelNode != None:
             d = vtk.vtkMath.Distance2BetweenPoints(pSurface, pTarget)
             d = math.sqrt(d)
-            modifiedArea = area * (130 - d) / 130
+            modifiedArea = area * (self.needleLength - d) / self.needleLength
             
             if d < minDistance or minDistance < 0:
               minDistance = d
               minDistancePoint = [pSurface[0],pSurface[1],pSurface[2]]
             
             v = 0  
-            if d < 130:
+            if d < self.needleLength:
               v = d + 101
               accessibleArea = accessibleArea + modifiedArea
             else:
@@ -1127,46 +2510,72 @@ class PercutaneousApproachAnalysisLogic:
     score = accessibleArea
 
     if skinModelNode != None:
-      visible = 1
-      invisible = 0
-      skinModelNode.AddPointScalars(pointValue)
-      skinModelNode.SetActivePointScalars("Colors", vtk.vtkDataSetAttributes.SCALARS)
-      skinModelNode.Modified()
-      displayNode = skinModelNode.GetModelDisplayNode()
-      displayNode.SetActiveScalarName("Colors")
-      displayNode.SetScalarRange(0.0,20.0)
-      scalarSetting = slicer.modulewidget.qMRMLModelDisplayNodeWidget()
-      scalarSetting.setMRMLModelDisplayNode(displayNode)
-      scalarSetting.setScalarsVisibility(invisible)
+      self.showColorMap(skinModelNode, pointValue)
 
     return (score, minDistance, minDistancePoint)
+
+  def showColorMap(self, skinModelNode, pointValue, scalarRange=(0.0, 20.0)):
+    visible = 1
+    invisible = 0
+    name = pointValue.GetName()
+    skinModelNode.AddPointScalars(pointValue)
+    skinModelNode.SetActivePointScalars(name, vtk.vtkDataSetAttributes.SCALARS)
+    skinModelNode.Modified()
+    # The widget shows the scalars (see onCheckColorMappedSkin); the logic
+    # only sets up the display node, so it also runs without the GUI
+    displayNode = skinModelNode.GetModelDisplayNode()
+    if displayNode != None:
+      displayNode.SetActiveScalarName(name)
+      displayNode.SetScalarRange(scalarRange[0], scalarRange[1])
+      displayNode.SetScalarVisibility(invisible)
     
 class SphereModel:
 
   def __init__(self):
     pass
 
-  def make(self, visibilityParam, color, modelName):
+  # Marker mesh shared by all the sphere models
+  polyData = None
+
+  def sphere(self):
+    if SphereModel.polyData is None:
+      sphere = vtk.vtkSphereSource()
+      sphere.SetRadius(0.5)
+      sphere.SetPhiResolution(16)
+      sphere.SetThetaResolution(16)
+      sphere.Update()
+      SphereModel.polyData = sphere.GetOutput()
+    return SphereModel.polyData
+
+  def reuse(self, model, visibilityParam, color, modelName):
+    """make(), but keep model, its display node and its transform when
+    they are still in the scene"""
     scene = slicer.mrmlScene
+    if model == None or not scene.IsNodePresent(model) or model.GetDisplayNode() == None:
+      return self.make(visibilityParam, color, modelName)
 
-    sphere = vtk.vtkSphereSource()
-    sphere.SetRadius(0.5)
-    sphere.SetPhiResolution(100)
-    sphere.SetThetaResolution(100)
-    sphere.Update()
+    cursorModelDisplay = model.GetDisplayNode()
+    cursorModelDisplay.SetColor(color[0], color[1], color[2])
+    cursorModelDisplay.SetVisibility(visibilityParam)
 
-    sphere1 = vtk.vtkSphereSource()
-    sphere1.SetRadius(2.5)
-    sphere1.SetPhiResolution(100)
-    sphere1.SetThetaResolution(100)
-    sphere1.SetCenter(20,20,20)
-    sphere1.Update()
+    transform = model.GetParentTransformNode()
+    if transform == None:
+      transform = slicer.vtkMRMLLinearTransformNode()
+      transform.SetName(scene.GenerateUniqueName(modelName + "Transform"))
+      scene.AddNode(transform)
+      model.SetAndObserveTransformNodeID(transform.GetID())
+
+    return (model, cursorModelDisplay, transform)
+
+  def make(self, visibilityParam, color, modelName):
+    scene = slicer.mrmlScene
+    sphere = self.sphere()
 
     # Create model node
     sphereCursor = slicer.vtkMRMLModelNode()
     sphereCursor.SetScene(scene)
     sphereCursor.SetName(scene.GenerateUniqueName(modelName))
-    sphereCursor.SetAndObservePolyData(sphere.GetOutput())
+    sphereCursor.SetAndObservePolyData(sphere)
 
     # Create display node
     cursorModelDisplay = slicer.vtkMRMLModelDisplayNode()
@@ -1181,7 +2590,7 @@ class SphereModel:
 
     # Add to scene
     if vtk.VTK_MAJOR_VERSION <= 5:
-      cursorModelDisplay.SetInputPolyData(sphere.GetOutput())
+      cursorModelDisplay.SetInputPolyData(sphere)
 
     scene.AddNode(sphereCursor)
 
@@ -1196,13 +2605,10 @@ class SphereModel:
 
   def move(self, p, pointNumber, pointSliderValue, transform):
 
-    r = p[pointNumber*2+1][0]
-    a = p[pointNumber*2+1][1]
-    s = p[pointNumber*2+1][2]
+    # p is the PathTable returned by makePaths
+    (r, a, s) = [float(c) for c in p.entryPoint(pointNumber)]
     
-    targetR = p[pointNumber*2][0]
-    targetA = p[pointNumber*2][1]
-    targetS = p[pointNumber*2][2]
+    (targetR, targetA, targetS) = [float(c) for c in p.targetPoint(pointNumber)]
     
     dirVectorR = r - targetR
     dirVectorA = a - targetA
@@ -1234,9 +2640,9 @@ class SphereModel:
 
 # NeedlePathModel class is based on EndoscopyPathModel class for Endoscopy module
 class NeedlePathModel:
-  """Create a vtkPolyData for a polyline:
-       - Add one point per path point.
-       - Add a single polyline
+  """Create a vtkPolyData of needle paths:
+       - Add one point per path end.
+       - Add one two-point line per path
   """
   def __init__(self):
     pass
@@ -1262,79 +2668,43 @@ class NeedlePathModel:
     return polyData
 
   def modify(self, path, approachablePoints, visibilityParam, color, modelName, lineType, model, modelDisplay, points):
+    """Move the paths of a model made by make() to path.  With the same
+    number of points, the point buffer is overwritten in place and the
+    lines are kept, so the model does not grow and an update costs the
+    same whatever the number of earlier updates."""
     import numpy
+    from PercutaneousApproachAnalysisLib import movePathLines
 
-    # Create an array for all approachable points 
-    p = numpy.zeros([approachablePoints*2,3])
-    p1 = [0.0, 0.0, 0.0]
+    path = numpy.asarray(path).reshape(-1, 3)
+    if approachablePoints == 0:
+      path = path[:0]
+    if not movePathLines(lineType, path):
+      self.fillPolyData(path, approachablePoints, lineType)
 
+  def reuse(self, model, path, approachablePoints, visibilityParam, color, modelName, lineType):
+    """make(), but refill and keep model and its display node when they
+    are still in the scene"""
     scene = slicer.mrmlScene
+    if model == None or not scene.IsNodePresent(model) or model.GetDisplayNode() == None:
+      return self.make(path, approachablePoints, visibilityParam, color, modelName, lineType)
 
-    polyData = vtk.vtkPolyData()
-    polyData = lineType
-
-    lines = vtk.vtkCellArray()
-    polyData.SetLines(lines)
-    linesIDArray = lines.GetData()
-    linesIDArray.Reset()
-    linesIDArray.InsertNextTuple1(0)
-
-    polygons = vtk.vtkCellArray()
-    polyData.SetPolys( polygons )
-    idArray = polygons.GetData()
-    idArray.Reset()
-    idArray.InsertNextTuple1(0)
-
-    if approachablePoints != 0:
+    p = self.fillPolyData(path, approachablePoints, lineType)
+    if model.GetPolyData() != lineType:
+      model.SetAndObservePolyData(lineType)
+    modelDisplay = model.GetDisplayNode()
+    modelDisplay.SetColor(color[0], color[1], color[2])
+    modelDisplay.SetVisibility(visibilityParam)
+    if vtk.VTK_MAJOR_VERSION <= 5:
+      modelDisplay.SetInputPolyData(lineType)
 
-      for point in path:
-        pointIndex = points.InsertNextPoint(*point)
-        linesIDArray.InsertNextTuple1(pointIndex)
-        linesIDArray.SetTuple1( 0, linesIDArray.GetNumberOfTuples() - 1 )
-        lines.SetNumberOfCells(1)
+    return (model, p, modelDisplay, self.points)
 
   def make(self, path, approachablePoints, visibilityParam, color, modelName, lineType):
 
-    import numpy
-
-    # Create an array for all approachable points 
-    p = numpy.zeros([approachablePoints*2,3])
-    p1 = [0.0, 0.0, 0.0]
-
     scene = slicer.mrmlScene
-     
-    self.points = vtk.vtkPoints()
-    polyData = vtk.vtkPolyData()
-    polyData = lineType
-    polyData.SetPoints(self.points)
- 
-    lines = vtk.vtkCellArray()
-    polyData.SetLines(lines)
-    linesIDArray = lines.GetData()
-    linesIDArray.Reset()
-    linesIDArray.InsertNextTuple1(0)
 
-    polygons = vtk.vtkCellArray()
-    polyData.SetPolys( polygons )
-    idArray = polygons.GetData()
-    idArray.Reset()
-    idArray.InsertNextTuple1(0)
-
-    if approachablePoints != 0:
-
-      for point in path:
-        pointIndex = self.points.InsertNextPoint(*point)
-        linesIDArray.InsertNextTuple1(pointIndex)
-        linesIDArray.SetTuple1( 0, linesIDArray.GetNumberOfTuples() - 1 )
-        lines.SetNumberOfCells(1)
-
-        # Save all approachable points 
-        p1[0] = linesIDArray.GetTuple1(1)
-        p1[1] = linesIDArray.GetTuple1(2)
-        p1[2] = linesIDArray.GetTuple1(3)
-
-        coord = [p1[0], p1[1], p1[2]]
-        p[pointIndex] = coord
+    p = self.fillPolyData(path, approachablePoints, lineType)
+    polyData = lineType
 
     # Create model node
     model = slicer.vtkMRMLModelNode()
@@ -1356,7 +2726,22 @@ class NeedlePathModel:
       modelDisplay.SetInputPolyData(model.GetPolyData())
     scene.AddNode(model)
 
-    return (model, p, modelDisplay, self.points)    
+    return (model, p, modelDisplay, self.points)
+
+  def fillPolyData(self, path, approachablePoints, lineType):
+    """(Re)build lineType from path, an array of points where every two
+    consecutive rows are the ends of one line cell (see
+    Paths.pathLinesPolyData); returns the points array that backs it."""
+
+    import numpy
+    from PercutaneousApproachAnalysisLib import pathLinesPolyData
+
+    p = numpy.asarray(path).reshape(-1, 3)
+    if approachablePoints == 0:
+      p = p[:0]
+    (self.points, p) = pathLinesPolyData(lineType, p)
+
+    return p
 
 class PercutaneousApproachAnalysisTest(unittest.TestCase):
   """
@@ -0,0 +1,156 @@
+import numpy
+from vtk.util import numpy_support
+
+from .Cache import cellConnectivity
+
+#
+# Array versions of the per-triangle accessibility computation
+#
+
+def skinTriangles(polyData):
+  """Return the points (n x 3) and triangles (m x 3) of a skin polydata,
+  or None if the polydata has any cell that is not a triangle.
+  """
+  nCells = polyData.GetNumberOfCells()
+  if polyData.GetNumberOfPolys() != nCells or nCells == 0:
+    return None
+
+  (offsets, ids) = cellConnectivity(polyData.GetPolys())
+  if len(ids) != 3*nCells or (numpy.diff(offsets) != 3).any():
+    return None
+
+  points = numpy_support.vtk_to_numpy(polyData.GetPoints().GetData()).astype(numpy.float64)
+  triangles = ids.reshape(-1, 3)
+
+  return (points, triangles)
+
+
+# Whether vtkTriangle.ComputeArea() takes the norm of the cross product of
+# two edges (VTK 9) or uses the squared edge lengths (earlier versions);
+# found once by checkCrossProductArea()
+crossProductArea = None
+
+
+def checkCrossProductArea():
+  """Which formula this VTK uses, from a triangle on which they differ in
+  the last bit"""
+  global crossProductArea
+  if crossProductArea is None:
+    import vtk
+    probe = numpy.array([[0.1, 0.2, 0.3], [1.7, 0.1, 0.4], [0.3, 2.9, 0.5]])
+    area = vtk.vtkTriangle.TriangleArea(list(probe[0]), list(probe[1]), list(probe[2]))
+    crossProductArea = bool(crossProductAreas(probe[0:1], probe[1:2], probe[2:3])[0] == area)
+  return crossProductArea
+
+
+def crossProductAreas(p0, p1, p2):
+  """Row-wise vtkTriangle.TriangleArea() of VTK 9, in the same operation
+  order"""
+  a = p2 - p1
+  b = p0 - p1
+  nx = a[:,1]*b[:,2] - a[:,2]*b[:,1]
+  ny = a[:,2]*b[:,0] - a[:,0]*b[:,2]
+  nz = a[:,0]*b[:,1] - a[:,1]*b[:,0]
+  return 0.5 * numpy.sqrt(nx*nx + ny*ny + nz*nz)
+
+
+def triangleCentersAndAreas(points, triangles):
+  """Centers and areas computed with the same formulas as
+  vtkTriangle.TriangleCenter() and vtkTriangle.ComputeArea()
+  """
+  p0 = points[triangles[:,0]]
+  p1 = points[triangles[:,1]]
+  p2 = points[triangles[:,2]]
+
+  centers = (p0 + p1 + p2) / 3.0
+
+  if checkCrossProductArea():
+    areas = crossProductAreas(p0, p1, p2)
+  else:
+    a = squaredDistances(p0, p1)
+    b = squaredDistances(p1, p2)
+    c = squaredDistances(p2, p0)
+    areas = 0.25 * numpy.sqrt(numpy.fabs(4.0*a*c - (a-b+c)*(a-b+c)))
+
+  return (centers, areas)
+
+
+def squaredDistances(p, q):
+  """Row-wise vtkMath.Distance2BetweenPoints()"""
+  d = p - q
+  return d[:,0]*d[:,0] + d[:,1]*d[:,1] + d[:,2]*d[:,2]
+
+
+def approachScore(centers, areas, clear, target, needleLength=130.0):
+  """Accessible area score of the triangles of a skin model.
+
+  A triangle counts when the segment from its center to the target is
+  clear and shorter than the needle, weighted by (needleLength - d) /
+  needleLength.  Returns (score, minimum distance, minimum distance point,
+  per-triangle color value).
+  """
+  return ApproachTable(centers, areas, clear, target).score(needleLength)
+
+
+class ApproachTable(object):
+  """Visibility and distance to the target of every skin triangle.
+
+  The table is what approachScore() needs besides the needle length, so
+  keeping it after a run lets score() follow a new needle length without
+  casting any ray.
+  """
+
+  def __init__(self, centers, areas, clear, target):
+    self.centers = centers
+    self.areas = areas
+    self.clear = numpy.asarray(clear, dtype=bool)
+    self.target = numpy.asarray(target, dtype=numpy.float64)
+    self.distances = numpy.sqrt(squaredDistances(centers, self.target[None,:]))
+
+    # The nearest clear triangle does not depend on the needle length
+    self.minDistance = -1
+    self.minDistancePoint = [0.0, 0.0, 0.0]
+    if self.clear.any():
+      clearIndices = numpy.nonzero(self.clear)[0]
+      nearest = clearIndices[numpy.argmin(self.distances[clearIndices])]
+      self.minDistance = float(self.distances[nearest])
+      self.minDistancePoint = [float(c) for c in centers[nearest]]
+
+  def score(self, needleLength=130.0):
+    """(score, minimum distance, minimum distance point, per-triangle color
+    value) for one needle length, as returned by approachScore()"""
+    distances = self.distances
+    reachable = self.clear & (distances < needleLength)
+    values = -numpy.ones(len(distances))
+    values[reachable] = distances[reachable] + 101
+
+    # cumsum adds in cell order, so the score is bit-identical to the
+    # accumulation in the per-cell loop
+    modifiedAreas = self.areas[reachable] * (needleLength - distances[reachable]) / needleLength
+    score = float(numpy.cumsum(modifiedAreas)[-1]) if len(modifiedAreas) > 0 else 0.0
+
+    return (score, self.minDistance, list(self.minDistancePoint), values)
+
+
+def pointValuesFromCells(triangles, cellValues, nPoints, lastCells=None):
+  """Scatter per-triangle values to the points.  A point shared by several
+  triangles takes the value of the last one, as with repeated
+  vtkDoubleArray.InsertValue() calls in cell order.  lastCells, from
+  lastCellOfPoints(), saves recomputing that order for every map.
+  """
+  if lastCells is None:
+    lastCells = lastCellOfPoints(triangles, nPoints)
+
+  pointValues = numpy.zeros(nPoints)
+  used = lastCells >= 0
+  pointValues[used] = cellValues[lastCells[used]]
+
+  return pointValues
+
+
+def lastCellOfPoints(triangles, nPoints):
+  """Index of the last triangle using each point, -1 for unused points"""
+  lastCells = -numpy.ones(nPoints, dtype=numpy.int64)
+  cellIds = numpy.repeat(numpy.arange(len(triangles)), 3)
+  numpy.maximum.at(lastCells, triangles.ravel(), cellIds)
+  return lastCells
@@ -0,0 +1,176 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+
+import vtk
+
+from . import Headless
+from .Cache import DiskCache
+
+#
+# Batch analysis of many cases
+#
+#   python -m PercutaneousApproachAnalysisLib.Batch manifest.json
+#     --output results --concurrency 4
+#
+# The manifest is a JSON file
+#
+#   {"cases": [{"name": "patient01", "skin": "p01/skin.vtk",
+#               "obstacles": ["p01/bones.stl", "p01/vessels.stl"],
+#               "targets": "p01/targets.fcsv"}, ...]}
+#
+# with paths relative to the manifest.  Every case is written to a
+# temporary directory that is renamed to <output>/<name> once complete, so
+# an interrupted batch is resumed by running it again: the cases that have
+# their directory are skipped, and the temporary directories of the
+# others are removed before they run again.
+#
+
+def readManifest(fileName):
+  """Cases of a manifest, with absolute file names"""
+  manifest = json.load(open(fileName))
+  directory = os.path.dirname(os.path.abspath(fileName))
+
+  cases = []
+  for case in manifest['cases']:
+    obstacles = case.get('obstacles', [])
+    if 'obstacle' in case:
+      obstacles = [case['obstacle']] + list(obstacles)
+    cases.append({'name': case['name'],
+                  'skin': os.path.join(directory, case['skin']),
+                  'obstacles': [os.path.join(directory, obstacle) for obstacle in obstacles],
+                  'targets': os.path.join(directory, case['targets'])})
+
+  return cases
+
+
+def readObstacles(fileNames):
+  """All the obstacle surfaces of a case in one polydata"""
+  append = vtk.vtkAppendPolyData()
+  for fileName in fileNames:
+    if vtk.VTK_MAJOR_VERSION <= 5:
+      append.AddInput(Headless.readPolyData(fileName))
+    else:
+      append.AddInputData(Headless.readPolyData(fileName))
+  append.Update()
+  return append.GetOutput()
+
+
+def caseDirectory(outputDirectory, case):
+  return os.path.join(outputDirectory, case['name'])
+
+
+def runCase(case, outputDirectory, numberOfWorkers=1, cacheDirectory=None):
+  """Analyze one case and move its results into place.  Returns a summary
+  dict with the wall time, or the error message if the case failed."""
+  start = time.time()
+  finalDirectory = caseDirectory(outputDirectory, case)
+  temporaryDirectory = "%s.tmp-%d" % (finalDirectory, os.getpid())
+  summary = {'name': case['name']}
+
+  try:
+    # Leftovers of this case from killed runs, whatever their process
+    for leftover in glob.glob("%s.tmp-*" % finalDirectory):
+      if os.path.isdir(leftover):
+        shutil.rmtree(leftover)
+    (targets, labels) = Headless.readTargets(case['targets'])
+    diskCache = DiskCache(cacheDirectory) if cacheDirectory != None else None
+    (skin, paths, results) = Headless.analyzeCase(Headless.readPolyData(case['skin']), readObstacles(case['obstacles']),
+                                                  targets, labels, numberOfWorkers, diskCache=diskCache)
+    Headless.writeResults(temporaryDirectory, skin, paths, results)
+
+    summary['targets'] = len(targets)
+    summary['scores'] = [result['score'] for result in results]
+    summary['seconds'] = time.time() - start
+    summaryFile = open(os.path.join(temporaryDirectory, 'summary.json'), 'w')
+    json.dump(summary, summaryFile, indent=2)
+    summaryFile.close()
+
+    os.rename(temporaryDirectory, finalDirectory)
+  except Exception as e:
+    if os.path.isdir(temporaryDirectory):
+      shutil.rmtree(temporaryDirectory)
+    summary['error'] = "%s: %s" % (e.__class__.__name__, e)
+    summary['seconds'] = time.time() - start
+
+  return summary
+
+
+def runCaseTask(task):
+  (case, outputDirectory, cacheDirectory) = task
+  return runCase(case, outputDirectory, cacheDirectory=cacheDirectory)
+
+
+def runBatch(cases, outputDirectory, concurrency=1, numberOfWorkers=1, report=None, cacheDirectory=None):
+  """Run the cases that are not done yet over concurrency processes.
+
+  With concurrency 1 the cases run one after the other in this process and
+  each one may cast its rays over numberOfWorkers processes; otherwise
+  every case runs in a single pool process.  report(summary) is called as
+  each case finishes.  With a cacheDirectory, the visibility passes are
+  shared through a DiskCache there.  Returns the summaries of the cases
+  run.
+  """
+  if not os.path.isdir(outputDirectory):
+    os.makedirs(outputDirectory)
+  todo = [case for case in cases if not os.path.isdir(caseDirectory(outputDirectory, case))]
+
+  summaries = []
+  if concurrency <= 1:
+    for case in todo:
+      summaries.append(runCase(case, outputDirectory, numberOfWorkers, cacheDirectory))
+      if report is not None:
+        report(summaries[-1])
+  else:
+    pool = multiprocessing.Pool(concurrency)
+    try:
+      for summary in pool.imap_unordered(runCaseTask, [(case, outputDirectory, cacheDirectory) for case in todo]):
+        summaries.append(summary)
+        if report is not None:
+          report(summary)
+    finally:
+      pool.close()
+      pool.join()
+
+  return summaries
+
+
+def printSummary(summary):
+  if 'error' in summary:
+    print ("%s: failed after %.1f s (%s)" % (summary['name'], summary['seconds'], summary['error']))
+  else:
+    print ("%s: %d targets in %.1f s" % (summary['name'], summary['targets'], summary['seconds']))
+  sys.stdout.flush()
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Percutaneous approach analysis of the cases of a manifest")
+  parser.add_argument('manifest', help="JSON manifest of the cases")
+  parser.add_argument('--output', required=True, help="output directory, one subdirectory per case")
+  parser.add_argument('--concurrency', type=int, default=1, help="number of cases run at the same time")
+  parser.add_argument('--workers', type=int, default=1, help="ray casting processes per case when the concurrency is 1")
+  parser.add_argument('--cache', help="directory of the visibility cache shared by the cases and the next runs")
+  args = parser.parse_args(argv)
+
+  cases = readManifest(args.manifest)
+  start = time.time()
+  summaries = runBatch(cases, args.output, args.concurrency, args.workers, printSummary, args.cache)
+  elapsed = time.time() - start
+
+  done = [summary for summary in summaries if 'error' not in summary]
+  skipped = len(cases) - len(summaries)
+  print ("%d cases run (%d failed), %d already done, in %.1f s" % (len(summaries), len(summaries) - len(done), skipped, elapsed))
+  if len(done) > 0 and elapsed > 0:
+    targets = sum([summary['targets'] for summary in done])
+    print ("Throughput: %.1f cases/hour, %.2f targets/s" % (3600.0 * len(done) / elapsed, targets / elapsed))
+
+  return 1 if len(done) < len(summaries) else 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,231 @@
+import collections
+import glob
+import hashlib
+import os
+import time
+
+import numpy
+import vtk
+from vtk.util import numpy_support
+
+#
+# In-memory cache for expensive per-geometry structures, and on-disk cache
+# for analysis results
+#
+
+class LRUCache(object):
+  """Least-recently-used cache bounded by the total size of its items.
+
+  sizeFunction(value) returns the size of an item in bytes.  An item larger
+  than maximumSize is returned to the caller but never stored.
+  """
+
+  def __init__(self, maximumSize, sizeFunction):
+    self.maximumSize = maximumSize
+    self.sizeFunction = sizeFunction
+    self.items = collections.OrderedDict()
+    self.totalSize = 0
+    self.hits = 0
+    self.misses = 0
+
+  def __len__(self):
+    return len(self.items)
+
+  def __contains__(self, key):
+    return key in self.items
+
+  def get(self, key, default=None):
+    if key not in self.items:
+      self.misses += 1
+      return default
+    self.hits += 1
+    (value, size) = self.items.pop(key)
+    self.items[key] = (value, size)
+    return value
+
+  def put(self, key, value):
+    if key in self.items:
+      self.totalSize -= self.items.pop(key)[1]
+    size = self.sizeFunction(value)
+    if size > self.maximumSize:
+      return
+    self.items[key] = (value, size)
+    self.totalSize += size
+    while self.totalSize > self.maximumSize:
+      (oldKey, (oldValue, oldSize)) = self.items.popitem(last=False)
+      self.totalSize -= oldSize
+
+  def getOrCreate(self, key, create):
+    """Return the cached value for key, calling create() on a miss"""
+    value = self.get(key)
+    if value is None:
+      value = create()
+      self.put(key, value)
+    return value
+
+  def removeIf(self, predicate):
+    """Remove the items whose key satisfies predicate(key)"""
+    for key in [key for key in self.items if predicate(key)]:
+      self.totalSize -= self.items.pop(key)[1]
+
+  def clear(self):
+    self.items.clear()
+    self.totalSize = 0
+
+
+def digest(*parts):
+  """SHA-1 hex digest of numpy arrays (dtype, shape and contents) and of
+  the repr() of any other value"""
+  sha = hashlib.sha1()
+  for part in parts:
+    if isinstance(part, numpy.ndarray):
+      sha.update(repr((part.dtype.str, part.shape)).encode('utf-8'))
+      sha.update(numpy.ascontiguousarray(part).tobytes())
+    else:
+      sha.update(repr(part).encode('utf-8'))
+  return sha.hexdigest()
+
+
+def geometryVersion(polyData):
+  """Modification times of the points and cells of a polydata.  Unlike
+  polyData.GetMTime(), they do not change when point or cell data arrays,
+  e.g. the scalars of a color map, are added or modified."""
+  parts = (polyData.GetPoints(), polyData.GetVerts(), polyData.GetLines(), polyData.GetPolys(), polyData.GetStrips())
+  return tuple(0 if part is None else part.GetMTime() for part in parts)
+
+
+def cellConnectivity(cells):
+  """Offsets (one per cell, followed by the end) and point ids of a
+  vtkCellArray, as int64 arrays.  VTK 9 stores them as two arrays; older
+  versions store (number of points, point ids...) per cell in one."""
+  if vtk.VTK_MAJOR_VERSION >= 9:
+    offsets = numpy_support.vtk_to_numpy(cells.GetOffsetsArray()).astype(numpy.int64)
+    ids = numpy_support.vtk_to_numpy(cells.GetConnectivityArray()).astype(numpy.int64)
+    return (offsets, ids)
+
+  nCells = cells.GetNumberOfCells()
+  legacy = numpy_support.vtk_to_numpy(cells.GetData()).astype(numpy.int64)
+  if len(legacy) == 4*nCells and (legacy[::4] == 3).all():
+    return (numpy.arange(0, 3*nCells + 1, 3, dtype=numpy.int64), legacy.reshape(-1, 4)[:,1:].ravel())
+  offsets = numpy.zeros(nCells + 1, dtype=numpy.int64)
+  ids = [numpy.zeros(0, dtype=numpy.int64)]
+  position = 0
+  for index in range(nCells):
+    n = legacy[position]
+    ids.append(legacy[position+1:position+1+n])
+    offsets[index+1] = offsets[index] + n
+    position += n + 1
+  return (offsets, numpy.concatenate(ids))
+
+
+def polyDataDigest(polyData):
+  """Content hash of the points and cells of a polydata as they are read,
+  without triangulating or building anything from them, so that the
+  structures made from the polydata can be looked up in a cache"""
+  points = polyData.GetPoints()
+  parts = [numpy_support.vtk_to_numpy(points.GetData()) if points is not None else None]
+  for cells in (polyData.GetVerts(), polyData.GetLines(), polyData.GetPolys(), polyData.GetStrips()):
+    if cells is None or cells.GetNumberOfCells() == 0:
+      parts.append(None)
+    else:
+      parts.extend(cellConnectivity(cells))
+  return digest(*parts)
+
+
+class DiskCache(object):
+  """Content-addressed cache of numpy arrays, one .npz file per key.
+
+  Files are written under a temporary name and renamed, so a reader never
+  sees a partial entry.  Reading an entry updates its modification time;
+  after every write the least recently used files are deleted until the
+  cache takes at most maximumSize bytes.  Temporary files left by killed
+  writers are deleted once they are temporaryFileAge seconds old.
+  """
+
+  temporaryFileAge = 3600.0
+
+  def __init__(self, directory, maximumSize=1024*1024*1024):
+    self.directory = directory
+    self.maximumSize = maximumSize
+    self.hits = 0
+    self.misses = 0
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+
+  def fileName(self, key):
+    return os.path.join(self.directory, key + '.npz')
+
+  def get(self, key):
+    """Return the arrays stored for key, or None"""
+    fileName = self.fileName(key)
+    try:
+      entry = numpy.load(fileName)
+      arrays = dict((name, entry[name]) for name in entry.files)
+      entry.close()
+    except (IOError, OSError, ValueError):
+      self.misses += 1
+      return None
+    try:
+      os.utime(fileName, None)
+    except OSError:
+      pass
+    self.hits += 1
+    return arrays
+
+  def put(self, key, arrays):
+    fileName = self.fileName(key)
+    temporaryFileName = "%s.tmp-%d" % (fileName, os.getpid())
+    try:
+      output = open(temporaryFileName, 'wb')
+      try:
+        numpy.savez(output, **arrays)
+      finally:
+        output.close()
+      try:
+        os.rename(temporaryFileName, fileName)
+      except OSError:
+        # Windows does not replace an existing file
+        os.remove(fileName)
+        os.rename(temporaryFileName, fileName)
+    except Exception:
+      self.remove(temporaryFileName)
+      raise
+    self.evict()
+
+  def remove(self, fileName):
+    try:
+      os.remove(fileName)
+    except OSError:
+      pass
+
+  def removeStaleTemporaryFiles(self):
+    """Delete the temporary files older than temporaryFileAge; younger
+    ones may still be written by another process"""
+    oldest = time.time() - self.temporaryFileAge
+    for fileName in glob.glob(os.path.join(self.directory, '*.npz.tmp-*')):
+      try:
+        if os.path.getmtime(fileName) < oldest:
+          os.remove(fileName)
+      except OSError:
+        pass
+
+  def evict(self):
+    self.removeStaleTemporaryFiles()
+    entries = []
+    for fileName in glob.glob(os.path.join(self.directory, '*.npz')):
+      try:
+        entries.append((os.path.getmtime(fileName), os.path.getsize(fileName), fileName))
+      except OSError:
+        pass
+    entries.sort()
+    totalSize = sum([size for (mtime, size, fileName) in entries])
+    for (mtime, size, fileName) in entries:
+      if totalSize <= self.maximumSize:
+        break
+      self.remove(fileName)
+      totalSize -= size
+
+  def clear(self):
+    for fileName in glob.glob(os.path.join(self.directory, '*.npz')):
+      os.remove(fileName)
+    self.removeStaleTemporaryFiles()
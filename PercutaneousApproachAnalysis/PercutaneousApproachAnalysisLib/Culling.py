@@ -0,0 +1,76 @@
+import math
+
+import numpy
+
+#
+# Vectorized rejection of candidate paths before ray casting
+#
+
+class CandidateFilter(object):
+  """Geometric tests that reject skin entry points before any ray is cast.
+
+  A candidate is a skin point, with its outward normal, and a target.  The
+  tests run in this order and each is off until its parameter is set:
+
+    'reach'   the point is not closer to the target than maximumDistance
+    'facing'  with backFacing, the normal points away from the path, i.e.
+              the needle would enter the skin from inside
+    'angle'   the path makes more than maximumAngle degrees with the normal
+
+  A rejected candidate is not approachable.  mask() adds the number of
+  candidates each test rejected to a removed dict, see newCounts().
+  """
+
+  names = ('reach', 'facing', 'angle')
+
+  def __init__(self, maximumDistance=None, backFacing=False, maximumAngle=None):
+    self.maximumDistance = maximumDistance
+    self.backFacing = backFacing
+    self.maximumAngle = maximumAngle
+
+  def enabled(self):
+    return self.maximumDistance != None or self.backFacing or self.maximumAngle != None
+
+  def key(self):
+    """Parameters of the tests, for matching and cache keys"""
+    if not self.enabled():
+      return None
+    return (self.maximumDistance, bool(self.backFacing), self.maximumAngle)
+
+  def newCounts(self):
+    return dict((name, 0) for name in self.names)
+
+  def mask(self, points, normals, targets, removed=None):
+    """Candidates that pass all the tests.  For one target, returns a
+    boolean array over the points; for an m x 3 array of targets, an
+    m x n array where [i, j] is points[j] towards targets[i].
+    """
+    targets = numpy.asarray(targets, dtype=numpy.float64)
+    single = targets.ndim == 1
+    targets = targets.reshape(-1, 3)
+    keep = numpy.ones((len(targets), len(points)), dtype=bool)
+    if removed is None:
+      removed = self.newCounts()
+
+    if self.enabled() and len(points) > 0:
+      # Paths from the targets out to the skin points
+      directions = points[None,:,:] - targets[:,None,:]
+      lengths = numpy.sqrt((directions*directions).sum(axis=2))
+      cosines = (directions*normals[None,:,:]).sum(axis=2) / numpy.maximum(lengths, 1e-12)
+
+      tests = [('reach', None if self.maximumDistance == None else lengths < self.maximumDistance),
+               ('facing', cosines > 0.0 if self.backFacing else None),
+               ('angle', None if self.maximumAngle == None else cosines >= math.cos(math.radians(self.maximumAngle)))]
+      for (name, passed) in tests:
+        if passed is None:
+          continue
+        removed[name] += int(numpy.count_nonzero(keep & ~passed))
+        keep &= passed
+
+    return keep[0] if single else keep
+
+
+def countsText(removed):
+  """One line summary of the removed counts of CandidateFilter.mask()"""
+  labels = {'reach': "beyond reach", 'facing': "back-facing", 'angle': "outside the cone"}
+  return ", ".join(["%d %s" % (removed[name], labels[name]) for name in CandidateFilter.names if removed.get(name, 0) > 0])
@@ -0,0 +1,211 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy
+import vtk
+
+from . import Accessibility
+from .Cache import DiskCache
+from .Parallel import RayCastingPool
+from .Paths import PathTable, pathExtremes, pathInsertionAngles
+from .RayCasting import cachedObstacleBVH
+from .SkinGeometry import cachedSkinGeometry
+from .Visibility import SkinVisibility, visibilityKey
+
+#
+# Analysis of surface and fiducial files without Slicer
+#
+#   python -m PercutaneousApproachAnalysisLib.Headless --skin skin.vtk
+#     --obstacle obstacles.stl --targets targets.fcsv --output results
+#
+# All the inputs must be in the same coordinate system.  Only numpy and
+# vtk are imported; Qt and MRML are not needed.
+#
+
+def readPolyData(fileName):
+  """Read a .vtk, .vtp or .stl surface"""
+  extension = os.path.splitext(fileName)[1].lower()
+  if extension == '.stl':
+    reader = vtk.vtkSTLReader()
+  elif extension == '.vtp':
+    reader = vtk.vtkXMLPolyDataReader()
+  elif extension == '.vtk':
+    reader = vtk.vtkPolyDataReader()
+  else:
+    raise ValueError("unsupported surface file: %s" % fileName)
+  if not os.path.isfile(fileName):
+    raise IOError("no such file: %s" % fileName)
+
+  reader.SetFileName(fileName)
+  reader.Update()
+  return reader.GetOutput()
+
+
+def readTargets(fileName):
+  """Positions and labels of the points of a Slicer fiducial list (.fcsv)
+  or of a CSV file with x,y,z[,label] rows.  Lines starting with # and
+  rows without coordinates (e.g. a header) are skipped.
+  """
+  fiducialList = os.path.splitext(fileName)[1].lower() == '.fcsv'
+  points = []
+  labels = []
+  for line in open(fileName):
+    line = line.strip()
+    if len(line) == 0 or line.startswith('#'):
+      continue
+    fields = [field.strip() for field in line.split(',')]
+    # .fcsv columns: id,x,y,z,ow,ox,oy,oz,vis,sel,lock,label,...
+    (coordinates, labelColumn) = (fields[1:4], 11) if fiducialList else (fields[0:3], 3)
+    try:
+      point = [float(c) for c in coordinates]
+    except ValueError:
+      continue
+    if len(point) != 3:
+      continue
+    points.append(point)
+    label = fields[labelColumn] if len(fields) > labelColumn else ""
+    labels.append(label if len(label) > 0 else "F-%d" % (len(points)))
+
+  return (numpy.array(points, dtype=numpy.float64).reshape(-1, 3), labels)
+
+
+def analyzeCase(skinPolyData, obstaclePolyData, targets, labels=None, numberOfWorkers=1, pathStorage='indices', diskCache=None,
+                needleLength=130.0):
+  """Point-wise analysis of every target, as done by the module for one
+  target point: candidate paths, accessibility score and color map.
+
+  Returns (skin, paths, results): the SkinGeometry whose points the color
+  values refer to, the PathTable of all the targets, and one dict per
+  target with label, target, score, minimumDistance,
+  minimumDistancePoint, colors, numberOfPaths, shortestPath,
+  shortestDistance, longestPath and longestDistance (path numbers are
+  1-based within the target).
+  """
+  targets = numpy.asarray(targets, dtype=numpy.float64).reshape(-1, 3)
+  if labels is None:
+    labels = ["F-%d" % (index + 1) for index in range(len(targets))]
+
+  # With a disk cache, the preprocessed skin and obstacle are read back too
+  skin = cachedSkinGeometry(skinPolyData, diskCache)
+  if skin.triangles is None:
+    raise ValueError("the skin surface must only have triangles")
+  obstacle = cachedObstacleBVH(obstaclePolyData, diskCache)
+
+  pool = None
+  if numberOfWorkers > 1:
+    pool = RayCastingPool(obstacle, numberOfWorkers)
+
+  def segmentsClear(obstacle, starts, ends):
+    if pool is None or len(starts) < 2*numberOfWorkers:
+      return obstacle.segmentsClear(starts, ends)
+    return pool.segmentsClear(starts, ends)
+
+  paths = PathTable(targets, skin.points, pathStorage)
+  results = []
+  try:
+    for (index, target) in enumerate(targets):
+      visibility = None
+      if diskCache is not None:
+        key = visibilityKey(skin, obstacle, target)
+        arrays = diskCache.get(key)
+        if arrays is not None:
+          visibility = SkinVisibility.fromClear(skin, obstacle, target, arrays['clear'])
+      if visibility is None:
+        visibility = SkinVisibility(skin, obstacle, target, segmentsClear)
+        if diskCache is not None:
+          diskCache.put(key, {'clear': visibility.clear})
+      paths.setTarget(index, visibility.vertexClear)
+
+      (score, minDistance, minDistancePoint, cellValues) = Accessibility.approachScore(skin.centers, skin.areas, visibility.cellClear, target, needleLength)
+      colors = Accessibility.pointValuesFromCells(skin.triangles, cellValues, skin.numberOfPoints, skin.lastCells())
+
+      targetPaths = PathTable([target], skin.points)
+      targetPaths.setTarget(0, visibility.vertexClear)
+      (shortestPath, shortestDistance, longestPath, longestDistance) = pathExtremes(targetPaths)
+
+      results.append({'label': labels[index], 'target': target, 'score': score,
+                      'minimumDistance': minDistance, 'minimumDistancePoint': minDistancePoint,
+                      'colors': colors, 'numberOfPaths': len(targetPaths),
+                      'shortestPath': shortestPath, 'shortestDistance': shortestDistance,
+                      'longestPath': longestPath, 'longestDistance': longestDistance})
+  finally:
+    if pool is not None:
+      pool.close()
+
+  return (skin, paths, results)
+
+
+def writeResults(outputDirectory, skin, paths, results):
+  """Write scores.csv (one row per target), colors.vtk (the skin with one
+  "Colors_<n>" point array per target) and paths.npz (the PathTable
+  arrays and the insertion angle of every path).  Returns the names of the
+  written files.
+  """
+  if not os.path.isdir(outputDirectory):
+    os.makedirs(outputDirectory)
+
+  scoresFileName = os.path.join(outputDirectory, 'scores.csv')
+  scoresFile = open(scoresFileName, 'w')
+  scoresFile.write("label,x,y,z,score,minimumDistance,paths,shortestDistance,longestDistance\n")
+  for result in results:
+    target = result['target']
+    scoresFile.write("%s,%.6f,%.6f,%.6f,%.6f,%.6f,%d,%.6f,%.6f\n" % (
+      result['label'], target[0], target[1], target[2], result['score'], result['minimumDistance'],
+      result['numberOfPaths'], result['shortestDistance'], result['longestDistance']))
+  scoresFile.close()
+
+  from vtk.util import numpy_support
+
+  colored = vtk.vtkPolyData()
+  colored.ShallowCopy(skin.polyData)
+  for (index, result) in enumerate(results):
+    colors = numpy_support.numpy_to_vtk(result['colors'], deep=1, array_type=vtk.VTK_DOUBLE)
+    colors.SetName("Colors_%d" % (index + 1))
+    colored.GetPointData().AddArray(colors)
+  colorsFileName = os.path.join(outputDirectory, 'colors.vtk')
+  writer = vtk.vtkPolyDataWriter()
+  writer.SetFileName(colorsFileName)
+  writer.SetFileTypeToBinary()
+  if vtk.VTK_MAJOR_VERSION <= 5:
+    writer.SetInput(colored)
+  else:
+    writer.SetInputData(colored)
+  writer.Write()
+
+  pathsFileName = os.path.join(outputDirectory, 'paths.npz')
+  arrays = paths.toArrays()
+  arrays['labels'] = numpy.array([result['label'] for result in results])
+  arrays['insertionAngles'] = pathInsertionAngles(paths, skin.outwardPointNormals())
+  numpy.savez(pathsFileName, **arrays)
+
+  return [scoresFileName, colorsFileName, pathsFileName]
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Percutaneous approach analysis of surface files")
+  parser.add_argument('--skin', required=True, help="skin surface (.vtk, .vtp or .stl)")
+  parser.add_argument('--obstacle', required=True, help="obstacle surface (.vtk, .vtp or .stl)")
+  parser.add_argument('--targets', required=True, help="target points (.fcsv or x,y,z[,label] .csv)")
+  parser.add_argument('--output', required=True, help="output directory")
+  parser.add_argument('--workers', type=int, default=1, help="number of ray casting processes")
+  parser.add_argument('--bitset', action='store_true', help="store the paths as a bitset")
+  parser.add_argument('--cache', help="directory of the visibility cache, reused by the next runs")
+  parser.add_argument('--needle-length', type=float, default=130.0, help="reach of the needle in mm")
+  args = parser.parse_args(argv)
+
+  start = time.time()
+  (targets, labels) = readTargets(args.targets)
+  diskCache = DiskCache(args.cache) if args.cache else None
+  (skin, paths, results) = analyzeCase(readPolyData(args.skin), readPolyData(args.obstacle), targets, labels,
+                                       args.workers, 'bitset' if args.bitset else 'indices', diskCache, args.needle_length)
+  for fileName in writeResults(args.output, skin, paths, results):
+    print ("Wrote %s" % (fileName))
+  print ("%d targets in %.1f s" % (len(targets), time.time() - start))
+
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
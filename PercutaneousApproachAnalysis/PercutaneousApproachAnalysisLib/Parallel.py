@@ -0,0 +1,161 @@
+import collections
+import multiprocessing
+import multiprocessing.pool
+import multiprocessing.sharedctypes
+import numpy
+
+from .RayCasting import ObstacleBVH
+
+#
+# Ray casting sharded over worker processes or threads
+#
+# The BVH arrays are copied once into shared memory when the process pool
+# starts, so every task only carries its own chunk of segment start points.
+# Process pools are for the command line tools only: in Slicer, spawned
+# children would start the Slicer launcher instead of Python and forked
+# ones would copy a multi-threaded Qt process.  The module uses
+# RayCastingThreads instead.
+#
+
+workerObstacle = None
+
+
+def sharedArrays(arrays):
+  """Copy float arrays into shared memory, returning (RawArray, shape) pairs"""
+  shared = {}
+  for (name, array) in arrays.items():
+    raw = multiprocessing.sharedctypes.RawArray('d', max(array.size, 1))
+    numpy.ctypeslib.as_array(raw)[:array.size] = array.ravel()
+    shared[name] = (raw, array.shape)
+  return shared
+
+
+def sharedArraysView(shared):
+  """NumPy views onto arrays created with sharedArrays()"""
+  arrays = {}
+  for (name, (raw, shape)) in shared.items():
+    size = int(numpy.prod(shape))
+    arrays[name] = numpy.ctypeslib.as_array(raw)[:size].reshape(shape)
+  return arrays
+
+
+def initializeWorker(shared, parameters):
+  global workerObstacle
+  workerObstacle = ObstacleBVH.fromArrays(sharedArraysView(shared), parameters)
+
+
+def segmentsClearTask(task):
+  (starts, ends) = task
+  return workerObstacle.segmentsClear(starts, ends)
+
+
+def segmentChunks(starts, ends, nChunks):
+  """Split the segments into nChunks contiguous (starts, ends) chunks.
+  Returns the chunks and the index of the first segment of each chunk,
+  followed by the number of segments."""
+  bounds = numpy.linspace(0, len(starts), nChunks + 1).astype(int)
+  chunks = []
+  for (begin, stop) in zip(bounds[:-1], bounds[1:]):
+    chunkEnds = ends if ends.ndim == 1 else ends[begin:stop]
+    chunks.append((starts[begin:stop], chunkEnds))
+  return (chunks, bounds)
+
+
+def orderedResults(results, bounds, progress):
+  """Concatenate the results of the chunks, which imap returns in order,
+  calling progress(done, total) after each one"""
+  done = []
+  for result in results:
+    done.append(result)
+    progress(bounds[len(done)], bounds[-1])
+  return numpy.concatenate(done)
+
+
+class RayCastingPool(object):
+  """Pool of worker processes that share one ObstacleBVH.
+
+  Segments are split into contiguous chunks and the chunk results are
+  concatenated in order, so the output is identical to
+  ObstacleBVH.segmentsClear() run in a single process.  progress(done,
+  total) is called as the chunks complete; if it raises, the workers are
+  terminated and the pool cannot be used any more.
+  """
+
+  def __init__(self, obstacleBVH, numberOfWorkers):
+    self.numberOfWorkers = numberOfWorkers
+    self.obstacle = obstacleBVH
+    self.terminated = False
+    (arrays, parameters) = obstacleBVH.toArrays()
+    self.pool = multiprocessing.Pool(numberOfWorkers, initializeWorker, (sharedArrays(arrays), parameters))
+
+  def segmentsClear(self, starts, ends, chunksPerWorker=4, progress=None):
+    starts = numpy.asarray(starts, dtype=numpy.float64).reshape(-1, 3)
+    ends = numpy.asarray(ends, dtype=numpy.float64)
+    if len(starts) == 0:
+      return numpy.ones(0, dtype=bool)
+
+    (tasks, bounds) = segmentChunks(starts, ends, min(len(starts), self.numberOfWorkers * chunksPerWorker))
+    if progress is None:
+      return numpy.concatenate(self.pool.map(segmentsClearTask, tasks))
+
+    try:
+      return orderedResults(self.pool.imap(segmentsClearTask, tasks), bounds, progress)
+    except Exception:
+      self.terminate()
+      raise
+
+  def close(self):
+    self.pool.close()
+    self.pool.join()
+    self.terminated = True
+
+  def terminate(self):
+    self.pool.terminate()
+    self.pool.join()
+    self.terminated = True
+
+
+class RayCastingThreads(object):
+  """Threads that cast chunks of segments against any ObstacleBVH.
+
+  This is the pool used inside Slicer.  NumPy releases the GIL in the
+  array kernels of the traversal, so the chunks overlap without leaving
+  the process, and the obstacle is passed by reference with every call
+  instead of being copied to the workers.  The results are identical to
+  ObstacleBVH.segmentsClear().  With a progress callback the chunks are
+  handed out one per free worker; if progress raises, which is how a
+  cancelled BackgroundTask stops, no further chunk starts.  Create it on
+  the main thread.
+  """
+
+  def __init__(self, numberOfWorkers):
+    self.numberOfWorkers = numberOfWorkers
+    self.pool = multiprocessing.pool.ThreadPool(numberOfWorkers)
+
+  def segmentsClear(self, obstacleBVH, starts, ends, chunksPerWorker=4, progress=None):
+    starts = numpy.asarray(starts, dtype=numpy.float64).reshape(-1, 3)
+    ends = numpy.asarray(ends, dtype=numpy.float64)
+    if len(starts) == 0:
+      return numpy.ones(0, dtype=bool)
+
+    (tasks, bounds) = segmentChunks(starts, ends, min(len(starts), self.numberOfWorkers * chunksPerWorker))
+    castChunk = lambda task: obstacleBVH.segmentsClear(task[0], task[1])
+    if progress is None:
+      return numpy.concatenate(self.pool.map(castChunk, tasks))
+    # Keep one chunk per worker in flight; after a cancellation only those
+    # still finish, and their results are dropped
+    pending = collections.deque()
+    done = []
+    for task in tasks:
+      if len(pending) == self.numberOfWorkers:
+        done.append(pending.popleft().get())
+        progress(bounds[len(done)], bounds[-1])
+      pending.append(self.pool.apply_async(castChunk, (task,)))
+    while pending:
+      done.append(pending.popleft().get())
+      progress(bounds[len(done)], bounds[-1])
+    return numpy.concatenate(done)
+
+  def close(self):
+    self.pool.close()
+    self.pool.join()
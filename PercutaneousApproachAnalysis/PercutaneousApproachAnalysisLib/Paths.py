@@ -0,0 +1,311 @@
+import numpy
+import vtk
+from vtk.util import numpy_support
+
+#
+# Compact storage of the approachable paths
+#
+
+class PathTable(object):
+  """Approachable needle paths stored as point indices.
+
+  A path goes from targetPoints[t] to skinPoints[s].  The point arrays are
+  shared with the caller and every path only costs its skin index: with
+  storage='indices', the uint32 skin indices of each target are kept in one
+  array (4 bytes per path); with storage='bitset', one bit per (target,
+  skin point) pair, which is smaller when more than 1/32 of the pairs are
+  approachable.  Paths are numbered by target, then by skin index, and
+  their coordinates are gathered only when asked for, as float64 or, with
+  dtype=numpy.float32, in single precision.
+  """
+
+  def __init__(self, targetPoints, skinPoints, storage='indices', dtype=numpy.float64):
+    if storage not in ('indices', 'bitset'):
+      raise ValueError("storage must be 'indices' or 'bitset'")
+    self.targetPoints = numpy.asarray(targetPoints, dtype=dtype).reshape(-1, 3)
+    self.skinPoints = numpy.asarray(skinPoints, dtype=dtype).reshape(-1, 3)
+    self.storage = storage
+    self.dtype = dtype
+
+    nTargets = len(self.targetPoints)
+    self.counts = numpy.zeros(nTargets, dtype=numpy.int64)
+    self.offsets = None
+    if storage == 'indices':
+      self.rows = [None] * nTargets
+      self.skinIndices = None
+    else:
+      self.bits = numpy.zeros((nTargets, (len(self.skinPoints) + 7) // 8), dtype=numpy.uint8)
+
+  def __len__(self):
+    return int(self.counts.sum())
+
+  def setTarget(self, targetIndex, clear):
+    """Store the paths from one target to the skin points where the
+    boolean array clear is True"""
+    clear = numpy.asarray(clear, dtype=bool)
+    self.counts[targetIndex] = numpy.count_nonzero(clear)
+    self.offsets = None
+    if self.storage == 'indices':
+      self.rows[targetIndex] = numpy.nonzero(clear)[0].astype(numpy.uint32)
+      self.skinIndices = None
+    else:
+      self.bits[targetIndex] = numpy.packbits(clear)
+
+  def compact(self):
+    """Path offsets of the targets and, for 'indices', the skin indices of
+    all the paths in one array"""
+    if self.offsets is None:
+      self.offsets = numpy.concatenate(([0], numpy.cumsum(self.counts)))
+    if self.storage == 'indices' and self.skinIndices is None:
+      rows = [row for row in self.rows if row is not None]
+      self.skinIndices = numpy.concatenate(rows) if len(rows) > 0 else numpy.zeros(0, dtype=numpy.uint32)
+      # The rows now live in skinIndices
+      self.rows = [None if row is None else self.skinIndices[self.offsets[t]:self.offsets[t+1]] for (t, row) in enumerate(self.rows)]
+
+  def targetSkinIndices(self, targetIndex):
+    """Skin indices of the paths of one target"""
+    if self.storage == 'indices':
+      row = self.rows[targetIndex]
+      return row if row is not None else numpy.zeros(0, dtype=numpy.uint32)
+    clear = numpy.unpackbits(self.bits[targetIndex])[:len(self.skinPoints)]
+    return numpy.nonzero(clear)[0].astype(numpy.uint32)
+
+  def pathIndices(self, index):
+    """(target index, skin index) of path number index"""
+    self.compact()
+    if index < 0 or index >= self.offsets[-1]:
+      raise IndexError("path index out of range")
+    targetIndex = int(numpy.searchsorted(self.offsets, index, side='right')) - 1
+    if self.storage == 'indices':
+      return (targetIndex, int(self.skinIndices[index]))
+    return (targetIndex, int(self.targetSkinIndices(targetIndex)[index - self.offsets[targetIndex]]))
+
+  def indexArrays(self, begin=0, end=None):
+    """Target and skin indices of the paths begin to end - 1"""
+    self.compact()
+    total = int(self.offsets[-1])
+    end = total if end is None else min(end, total)
+    begin = min(begin, end)
+
+    first = int(numpy.searchsorted(self.offsets, begin, side='right')) - 1 if end > begin else 0
+    last = int(numpy.searchsorted(self.offsets, end, side='left')) if end > begin else 0
+    targets = numpy.repeat(numpy.arange(first, last, dtype=numpy.uint32), self.counts[first:last])
+    if self.storage == 'indices':
+      skins = self.skinIndices[self.offsets[first]:self.offsets[last]] if end > begin else numpy.zeros(0, dtype=numpy.uint32)
+    else:
+      rows = [self.targetSkinIndices(t) for t in range(first, last)]
+      skins = numpy.concatenate(rows) if len(rows) > 0 else numpy.zeros(0, dtype=numpy.uint32)
+
+    skip = begin - int(self.offsets[first]) if end > begin else 0
+    return (targets[skip:skip + end - begin], skins[skip:skip + end - begin])
+
+  def targetPoint(self, index):
+    return self.targetPoints[self.pathIndices(index)[0]]
+
+  def entryPoint(self, index):
+    return self.skinPoints[self.pathIndices(index)[1]]
+
+  def endPoints(self, begin=0, end=None):
+    """Target and skin entry coordinates of the paths begin to end - 1"""
+    (targets, skins) = self.indexArrays(begin, end)
+    return (self.targetPoints[targets], self.skinPoints[skins])
+
+  def interleavedPoints(self, begin=0, end=None):
+    """Coordinates as rows target, entry, target, entry, ..."""
+    (targets, entries) = self.endPoints(begin, end)
+    points = numpy.empty((2*len(targets), 3), dtype=self.dtype)
+    points[0::2] = targets
+    points[1::2] = entries
+    return points
+
+  def toArrays(self):
+    """Point arrays and paths as plain arrays, e.g. for numpy.savez"""
+    (targets, skins) = self.indexArrays()
+    return {'targetPoints': self.targetPoints, 'skinPoints': self.skinPoints,
+            'targetIndices': targets, 'skinIndices': skins}
+
+  def memorySize(self):
+    """Size of the path storage in bytes, without the shared point arrays"""
+    size = self.counts.nbytes
+    if self.storage == 'indices':
+      self.compact()
+      size += self.skinIndices.nbytes + self.offsets.nbytes
+    else:
+      size += self.bits.nbytes
+    return size
+
+
+class PathLookup(object):
+  """Geometry of every path of a PathTable, computed once with NumPy so
+  that browsing the paths costs a few array lookups: entry points,
+  directions (entry - target), lengths and unit vectors.
+  """
+
+  def __init__(self, paths):
+    (targets, entries) = paths.endPoints()
+    self.entries = entries.astype(numpy.float64)
+    self.directions = self.entries - targets
+    self.lengths = numpy.sqrt((self.directions*self.directions).sum(axis=1))
+    self.units = self.directions / numpy.maximum(self.lengths, 1e-12)[:,None]
+
+  def __len__(self):
+    return len(self.lengths)
+
+  def path(self, index):
+    """([target, entry], length) of a path"""
+    entry = self.entries[index]
+    return (numpy.array([entry - self.directions[index], entry]), float(self.lengths[index]))
+
+  def pointOnPath(self, index, position):
+    """Point at position thousandths of the path length beyond the entry
+    point (inside for negative positions)"""
+    return self.entries[index] + position*0.001*self.directions[index]
+
+  def extension(self, index, point):
+    """([point, entry], distance) from a point to the entry of a path"""
+    entry = self.entries[index]
+    d = entry - point
+    return (numpy.array([point, entry]), float(numpy.sqrt((d*d).sum())))
+
+  def interleavedPoints(self, indices):
+    """Coordinates of the given paths as rows target, entry, ..."""
+    points = numpy.empty((2*len(indices), 3))
+    points[1::2] = self.entries[indices]
+    points[0::2] = points[1::2] - self.directions[indices]
+    return points
+
+
+def pathExtremes(paths):
+  """(minimumPoint, minimumDistance, maximumPoint, maximumDistance) of the
+  paths of a PathTable.  Path numbers are 1-based and ties go to the last
+  path; minimumPoint and maximumPoint are 0 when there is no path.
+  """
+  maximumDistance = 0.0
+  minimumDistance = 1000.0
+  maximumPoint = 0
+  minimumPoint = 0
+
+  paths.compact()
+  for targetIndex in range(len(paths.targetPoints)):
+    entryPoints = paths.skinPoints[paths.targetSkinIndices(targetIndex)]
+    if len(entryPoints) == 0:
+      continue
+    first = int(paths.offsets[targetIndex])
+    target = paths.targetPoints[targetIndex]
+    distances = numpy.sqrt(numpy.power(entryPoints-numpy.array(target),2).sum(axis=1))
+    last = len(distances) - 1
+    maximumIndex = last - numpy.argmax(distances[::-1])
+    if distances[maximumIndex] >= maximumDistance:
+      maximumDistance = float(distances[maximumIndex])
+      maximumPoint = int(first + maximumIndex + 1)
+    minimumIndex = last - numpy.argmin(distances[::-1])
+    if distances[minimumIndex] <= minimumDistance:
+      minimumDistance = float(distances[minimumIndex])
+      minimumPoint = int(first + minimumIndex + 1)
+
+  return (minimumPoint, minimumDistance, maximumPoint, maximumDistance)
+
+
+def stratifiedSample(paths, maximumCount):
+  """Sorted numbers of at most maximumCount paths of a PathTable spread over
+  the skin.  The entry points are binned on a grid of about maximumCount
+  cells over their bounding box and the paths are taken one per cell in
+  turn, the lowest numbers first, so that sparse regions keep their paths.
+  """
+  (targets, skins) = paths.indexArrays()
+  n = len(skins)
+  if n <= maximumCount:
+    return numpy.arange(n)
+
+  entries = paths.skinPoints[skins].astype(numpy.float64)
+  low = entries.min(axis=0)
+  extent = max(float((entries.max(axis=0) - low).max()), 1e-12)
+  # The entry points lie on a surface, so k*k cells rather than k*k*k
+  k = max(1, int(numpy.sqrt(maximumCount)))
+  cells = numpy.minimum(((entries - low) * (k / extent)).astype(numpy.int64), k - 1)
+  keys = (cells[:,0]*k + cells[:,1])*k + cells[:,2]
+
+  # Rank of every path within its cell
+  order = numpy.argsort(keys, kind='mergesort')
+  sortedKeys = keys[order]
+  starts = numpy.concatenate(([True], sortedKeys[1:] != sortedKeys[:-1]))
+  first = numpy.maximum.accumulate(numpy.where(starts, numpy.arange(n), 0))
+  ranks = numpy.empty(n, dtype=numpy.int64)
+  ranks[order] = numpy.arange(n) - first
+
+  return numpy.sort(numpy.argsort(ranks, kind='mergesort')[:maximumCount])
+
+
+def pathInsertionAngles(paths, normals):
+  """Angle in degrees between every path of a PathTable, taken from the
+  target out to the entry point, and the outward skin normal at its entry
+  point (normals[skin index]).  0 is a perpendicular insertion; above 90
+  the needle would enter the skin from inside.
+  """
+  (targets, skins) = paths.indexArrays()
+  directions = paths.skinPoints[skins].astype(numpy.float64) - paths.targetPoints[targets]
+  lengths = numpy.sqrt((directions*directions).sum(axis=1))
+  cosines = (directions*normals[skins]).sum(axis=1) / numpy.maximum(lengths, 1e-12)
+  return numpy.degrees(numpy.arccos(numpy.clip(cosines, -1.0, 1.0)))
+
+
+def insertionAngleMap(paths, angles):
+  """Smallest insertion angle of the paths entering at each skin point,
+  -1 where no path enters"""
+  (targets, skins) = paths.indexArrays()
+  values = numpy.empty(len(paths.skinPoints))
+  values.fill(numpy.inf)
+  numpy.minimum.at(values, skins.astype(numpy.int64), angles)
+  values[numpy.isinf(values)] = -1.0
+  return values
+
+
+def pathLinesPolyData(polyData, points):
+  """(Re)build polyData from points, an array where every two consecutive
+  rows are the ends of one line cell.  The points and the connectivity
+  are handed to VTK as NumPy buffers, float32 and float64 points without
+  a copy.  Returns the vtkPoints and the array that backs them.
+  """
+  p = numpy.ascontiguousarray(numpy.asarray(points).reshape(-1, 3))
+  if p.dtype not in (numpy.float32, numpy.float64):
+    p = p.astype(numpy.float64)
+  nLines = len(p) // 2
+
+  vtkPoints = vtk.vtkPoints()
+  # numpy_to_vtk keeps a reference to p, which the points share
+  vtkPoints.SetData(numpy_support.numpy_to_vtk(p, deep=0))
+
+  lines = vtk.vtkCellArray()
+  idType = numpy.int64 if vtk.vtkIdTypeArray().GetDataTypeSize() == 8 else numpy.int32
+  ids = numpy.arange(2*nLines, dtype=idType)
+  if vtk.VTK_MAJOR_VERSION >= 9:
+    offsets = numpy.arange(0, 2*nLines + 1, 2, dtype=idType)
+    lines.SetData(numpy_support.numpy_to_vtkIdTypeArray(offsets, deep=0), numpy_support.numpy_to_vtkIdTypeArray(ids, deep=0))
+  else:
+    # Legacy layout: (2, first point, second point) per line
+    cells = numpy.empty((nLines, 3), dtype=idType)
+    cells[:,0] = 2
+    cells[:,1:] = ids.reshape(-1, 2)
+    lines.SetCells(nLines, numpy_support.numpy_to_vtkIdTypeArray(cells.ravel(), deep=1))
+
+  polyData.SetPoints(vtkPoints)
+  polyData.SetLines(lines)
+  polyData.SetPolys(vtk.vtkCellArray())
+  polyData.Modified()
+
+  return (vtkPoints, p)
+
+
+def movePathLines(polyData, points):
+  """Move the line ends of a polydata made by pathLinesPolyData() to
+  points, overwriting its point buffer in place.  Returns False, leaving
+  polyData alone, when points has another number of lines."""
+  points = numpy.asarray(points).reshape(-1, 3)
+  vtkPoints = polyData.GetPoints()
+  if vtkPoints is None or vtkPoints.GetNumberOfPoints() != len(points) or polyData.GetNumberOfLines() != len(points) // 2:
+    return False
+
+  numpy_support.vtk_to_numpy(vtkPoints.GetData())[:] = points
+  vtkPoints.Modified()
+  polyData.Modified()
+  return True
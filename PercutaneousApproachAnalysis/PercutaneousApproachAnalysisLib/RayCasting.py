@@ -0,0 +1,340 @@
+import numpy
+import vtk
+from vtk.util import numpy_support
+
+from .Cache import digest, cellConnectivity, polyDataDigest
+
+# Bump when the hierarchy changes, so that one cached on disk by an older
+# version is not used
+BVH_VERSION = 1
+
+#
+# Batched segment-versus-obstacle intersection tests
+#
+# The obstacle surface is triangulated and stored in a bounding volume
+# hierarchy (BVH).  All needle segments are tested against it at once with
+# NumPy, so no per-ray Python call is needed.
+#
+
+def triangulatedArrays(polyData):
+  """Return the points (n x 3) and triangle connectivity (m x 3) of a
+  polydata after triangulating its polygons and strips.
+  """
+  triangleFilter = vtk.vtkTriangleFilter()
+  if vtk.VTK_MAJOR_VERSION <= 5:
+    triangleFilter.SetInput(polyData)
+  else:
+    triangleFilter.SetInputData(polyData)
+  triangleFilter.PassVertsOff()
+  triangleFilter.PassLinesOff()
+  triangleFilter.Update()
+  output = triangleFilter.GetOutput()
+
+  if output.GetNumberOfPoints() == 0 or output.GetNumberOfPolys() == 0:
+    return (numpy.zeros([0,3]), numpy.zeros([0,3], dtype=numpy.int64))
+
+  points = numpy_support.vtk_to_numpy(output.GetPoints().GetData()).astype(numpy.float64)
+  triangles = cellConnectivity(output.GetPolys())[1].reshape(-1, 3)
+
+  return (points, triangles)
+
+
+def mortonCodes(centers):
+  """Interleave 10-bit quantized coordinates into 30-bit Morton codes"""
+  lower = centers.min(axis=0)
+  extent = centers.max(axis=0) - lower
+  extent[extent <= 0.0] = 1.0
+  quantized = ((centers - lower) / extent * 1023.0).astype(numpy.uint64)
+
+  codes = numpy.zeros(len(centers), dtype=numpy.uint64)
+  for axis in range(3):
+    v = quantized[:,axis]
+    v = (v | (v << numpy.uint64(16))) & numpy.uint64(0x030000FF)
+    v = (v | (v << numpy.uint64(8))) & numpy.uint64(0x0300F00F)
+    v = (v | (v << numpy.uint64(4))) & numpy.uint64(0x030C30C3)
+    v = (v | (v << numpy.uint64(2))) & numpy.uint64(0x09249249)
+    codes |= v << numpy.uint64(2 - axis)
+
+  return codes
+
+
+class ObstacleBVH(object):
+  """Bounding volume hierarchy over the triangles of an obstacle model.
+
+  Triangles are sorted along a Morton curve and grouped into leaves of
+  leafSize triangles.  The leaves form a complete binary tree stored as a
+  heap (children of node i are 2i+1 and 2i+2), so the whole hierarchy is a
+  handful of flat arrays built without any Python-level recursion.
+  sourceDigest is the polyDataDigest of the obstacle when it was made by
+  cachedObstacleBVH, and None otherwise.
+  """
+
+  def __init__(self, points, triangles, leafSize=4, tolerance=0.001):
+    self.leafSize = leafSize
+    self.tolerance = tolerance
+    self.polyData = None
+    self.contentDigest = None
+    self.sourceDigest = None
+    self.numberOfTriangles = len(triangles)
+
+    if self.numberOfTriangles == 0:
+      self.numberOfLeaves = 0
+      self.lower = numpy.zeros([0,3])
+      self.upper = numpy.zeros([0,3])
+      self.v0 = numpy.zeros([0,3])
+      self.e1 = numpy.zeros([0,3])
+      self.e2 = numpy.zeros([0,3])
+      self.margins = numpy.zeros([0,3])
+      return
+
+    corners = points[triangles]
+    order = numpy.argsort(mortonCodes(corners.mean(axis=1)), kind='mergesort')
+    corners = corners[order]
+
+    self.v0 = corners[:,0]
+    self.e1 = corners[:,1] - corners[:,0]
+    self.e2 = corners[:,2] - corners[:,0]
+
+    # Barycentric slack equivalent to "tolerance" mm from each edge, which
+    # mimics the tolerance of vtkCell.IntersectWithLine()
+    doubleArea = numpy.sqrt((numpy.cross(self.e1, self.e2)**2).sum(axis=1))
+    doubleArea[doubleArea == 0.0] = numpy.inf
+    edge0 = numpy.sqrt(((corners[:,2] - corners[:,1])**2).sum(axis=1))
+    edge1 = numpy.sqrt((self.e2**2).sum(axis=1))
+    edge2 = numpy.sqrt((self.e1**2).sum(axis=1))
+    self.margins = tolerance * numpy.column_stack((edge1, edge2, edge0)) / doubleArea[:,None]
+
+    # Leaf bounds (padded to a power of two with empty boxes)
+    nLeaves = (self.numberOfTriangles + leafSize - 1) // leafSize
+    self.numberOfLeaves = 1
+    while self.numberOfLeaves < nLeaves:
+      self.numberOfLeaves *= 2
+
+    padded = nLeaves * leafSize
+    triLower = numpy.inf * numpy.ones([padded,3])
+    triUpper = -numpy.inf * numpy.ones([padded,3])
+    triLower[:self.numberOfTriangles] = corners.min(axis=1) - tolerance
+    triUpper[:self.numberOfTriangles] = corners.max(axis=1) + tolerance
+
+    nNodes = 2*self.numberOfLeaves - 1
+    self.lower = numpy.inf * numpy.ones([nNodes,3])
+    self.upper = -numpy.inf * numpy.ones([nNodes,3])
+    first = self.numberOfLeaves - 1
+    self.lower[first:first+nLeaves] = triLower.reshape(nLeaves, leafSize, 3).min(axis=1)
+    self.upper[first:first+nLeaves] = triUpper.reshape(nLeaves, leafSize, 3).max(axis=1)
+
+    # Internal node bounds, one tree level at a time
+    while first > 0:
+      parents = numpy.arange((first-1)//2, first)
+      self.lower[parents] = numpy.minimum(self.lower[2*parents+1], self.lower[2*parents+2])
+      self.upper[parents] = numpy.maximum(self.upper[2*parents+1], self.upper[2*parents+2])
+      first = parents[0]
+
+    # Move the empty padding boxes to infinity so that the slab test
+    # rejects them without a separate check
+    empty = self.lower[:,0] > self.upper[:,0]
+    self.lower[empty] = numpy.inf
+    self.upper[empty] = numpy.inf
+
+  @classmethod
+  def fromPolyData(cls, polyData, leafSize=4, tolerance=0.001):
+    (points, triangles) = triangulatedArrays(polyData)
+    bvh = cls(points, triangles, leafSize, tolerance)
+    bvh.polyData = polyData
+    return bvh
+
+  def memorySize(self):
+    """Approximate size of the hierarchy in bytes"""
+    (arrays, parameters) = self.toArrays()
+    return sum(array.nbytes for array in arrays.values())
+
+  def digest(self):
+    """Content hash of the hierarchy, computed once"""
+    if self.contentDigest is None:
+      (arrays, parameters) = self.toArrays()
+      self.contentDigest = digest(*([arrays[name] for name in sorted(arrays)] + [sorted(parameters.items())]))
+    return self.contentDigest
+
+  def toArrays(self):
+    """Return the hierarchy as a dictionary of float arrays plus the
+    scalar parameters, e.g. to place it in shared memory.
+    """
+    arrays = {
+      'lower': self.lower, 'upper': self.upper,
+      'v0': self.v0, 'e1': self.e1, 'e2': self.e2, 'margins': self.margins,
+      }
+    parameters = {
+      'leafSize': self.leafSize, 'tolerance': self.tolerance,
+      'numberOfTriangles': self.numberOfTriangles, 'numberOfLeaves': self.numberOfLeaves,
+      }
+    return (arrays, parameters)
+
+  @classmethod
+  def fromArrays(cls, arrays, parameters):
+    """Rebuild a hierarchy from the output of toArrays() without copying"""
+    bvh = cls.__new__(cls)
+    bvh.polyData = None
+    bvh.contentDigest = None
+    bvh.sourceDigest = None
+    for (name, value) in parameters.items():
+      setattr(bvh, name, value)
+    for (name, value) in arrays.items():
+      setattr(bvh, name, value)
+    return bvh
+
+  def segmentsClear(self, starts, ends, chunkSize=4096, boxesOnly=False, progress=None):
+    """Return a boolean array that is True for every segment
+    starts[i]-ends[i] that does not intersect the obstacle.
+    ends may be a single point shared by all segments.
+    With boxesOnly, a segment is not clear as soon as it crosses the
+    bounding box of a leaf, without testing the triangles.
+    progress(done, total) is called after every chunk; an exception
+    raised by it stops the casting.
+    """
+    starts = numpy.asarray(starts, dtype=numpy.float64).reshape(-1, 3)
+    ends = numpy.asarray(ends, dtype=numpy.float64)
+    if ends.ndim == 1:
+      ends = numpy.tile(ends, (len(starts), 1))
+
+    clear = numpy.ones(len(starts), dtype=bool)
+    if self.numberOfTriangles == 0:
+      return clear
+
+    with numpy.errstate(over='ignore', invalid='ignore'):
+      for begin in range(0, len(starts), chunkSize):
+        stop = min(begin + chunkSize, len(starts))
+        clear[begin:stop] = ~self.segmentsHit(starts[begin:stop], ends[begin:stop], boxesOnly)
+        if progress is not None:
+          progress(stop, len(starts))
+
+    return clear
+
+  def segmentsHit(self, origins, ends, boxesOnly=False):
+    """Any-hit traversal for one chunk of segments"""
+    directions = ends - origins
+    safe = numpy.where(directions == 0.0, 1e-300, directions)
+    inverse = 1.0 / safe
+    ox, oy, oz = origins[:,0].copy(), origins[:,1].copy(), origins[:,2].copy()
+    ix, iy, iz = inverse[:,0].copy(), inverse[:,1].copy(), inverse[:,2].copy()
+    lx, ly, lz = self.lower[:,0].copy(), self.lower[:,1].copy(), self.lower[:,2].copy()
+    ux, uy, uz = self.upper[:,0].copy(), self.upper[:,1].copy(), self.upper[:,2].copy()
+
+    hit = numpy.zeros(len(origins), dtype=bool)
+    rays = numpy.arange(len(origins))
+    nodes = numpy.zeros(len(origins), dtype=numpy.int64)
+    firstLeaf = self.numberOfLeaves - 1
+
+    while len(rays) > 0:
+      # Segment / box slab test, one axis at a time
+      tNear = numpy.zeros(len(rays))
+      tFar = numpy.ones(len(rays))
+      for (o, i, l, u) in ((ox, ix, lx, ux), (oy, iy, ly, uy), (oz, iz, lz, uz)):
+        oRay = o[rays]
+        iRay = i[rays]
+        t0 = (l[nodes] - oRay) * iRay
+        t1 = (u[nodes] - oRay) * iRay
+        numpy.maximum(tNear, numpy.minimum(t0, t1), out=tNear)
+        numpy.minimum(tFar, numpy.maximum(t0, t1), out=tFar)
+      overlap = tNear <= tFar
+      rays = rays[overlap]
+      nodes = nodes[overlap]
+
+      isLeaf = nodes >= firstLeaf
+      if boxesOnly:
+        hit[rays[isLeaf]] = True
+      elif isLeaf.any():
+        leafRays = rays[isLeaf]
+        leaves = nodes[isLeaf] - firstLeaf
+        pairRays = numpy.repeat(leafRays, self.leafSize)
+        pairTriangles = (leaves[:,None]*self.leafSize + numpy.arange(self.leafSize)).ravel()
+        valid = pairTriangles < self.numberOfTriangles
+        pairRays = pairRays[valid]
+        pairTriangles = pairTriangles[valid]
+        hits = self.segmentsHitTriangles(origins[pairRays], directions[pairRays], pairTriangles)
+        hit[pairRays[hits]] = True
+
+      # Descend into the children of the internal nodes of rays not yet hit
+      inner = ~isLeaf
+      rays = rays[inner]
+      nodes = nodes[inner]
+      pending = ~hit[rays]
+      rays = numpy.repeat(rays[pending], 2)
+      nodes = (2*numpy.repeat(nodes[pending], 2) + numpy.tile([1, 2], pending.sum()))
+
+    return hit
+
+  def segmentsHitTriangles(self, origins, directions, triangles):
+    """Moller-Trumbore test of segment i against triangle i"""
+    e1 = self.e1[triangles]
+    e2 = self.e2[triangles]
+    pvec = numpy.cross(directions, e2)
+    det = (e1 * pvec).sum(axis=1)
+    nonParallel = numpy.abs(det) > 1e-12
+    inverseDet = 1.0 / numpy.where(nonParallel, det, 1.0)
+
+    tvec = origins - self.v0[triangles]
+    u = (tvec * pvec).sum(axis=1) * inverseDet
+    qvec = numpy.cross(tvec, e1)
+    v = (directions * qvec).sum(axis=1) * inverseDet
+    t = (e2 * qvec).sum(axis=1) * inverseDet
+
+    margins = self.margins[triangles]
+    return (nonParallel & (t >= 0.0) & (t <= 1.0) &
+            (u >= -margins[:,0]) & (v >= -margins[:,1]) & (u + v <= 1.0 + margins[:,2]))
+
+
+def cachedObstacleBVH(polyData, diskCache=None, leafSize=4, tolerance=0.001):
+  """ObstacleBVH.fromPolyData, read back from the DiskCache when the same
+  points and cells were seen before.  The entry is keyed by the
+  polyDataDigest of the polydata, so a hit neither triangulates it nor
+  builds the hierarchy.
+  """
+  sourceDigest = polyDataDigest(polyData)
+  key = digest('ObstacleBVH', BVH_VERSION, sourceDigest, leafSize, tolerance)
+  parameterNames = ('leafSize', 'tolerance', 'numberOfTriangles', 'numberOfLeaves')
+
+  bvh = None
+  if diskCache is not None:
+    arrays = diskCache.get(key)
+    if arrays is not None:
+      try:
+        parameters = dict((name, arrays.pop(name).item()) for name in parameterNames)
+        bvh = ObstacleBVH.fromArrays(arrays, parameters)
+        bvh.polyData = polyData
+      except (KeyError, ValueError):
+        bvh = None
+  if bvh is None:
+    bvh = ObstacleBVH.fromPolyData(polyData, leafSize, tolerance)
+    if diskCache is not None:
+      (arrays, parameters) = bvh.toArrays()
+      arrays = dict(arrays)
+      for name in parameterNames:
+        arrays[name] = numpy.array(parameters[name])
+      diskCache.put(key, arrays)
+  bvh.sourceDigest = sourceDigest
+
+  return bvh
+
+
+
+def changedTriangles(oldBVH, newBVH):
+  """Return the vertices (k x 3 x 3) of the triangles that are in only one
+  of the two hierarchies, i.e. the removed and the added triangles.
+  """
+  oldRows = numpy.hstack((oldBVH.v0, oldBVH.e1, oldBVH.e2))
+  newRows = numpy.hstack((newBVH.v0, newBVH.e1, newBVH.e2))
+  rows = numpy.vstack((oldRows, newRows))
+  labels = numpy.concatenate((numpy.zeros(len(oldRows), dtype=int), numpy.ones(len(newRows), dtype=int)))
+
+  # Identical triangles become neighbors after a lexicographic sort
+  order = numpy.lexsort(rows.T[::-1])
+  rows = rows[order]
+  labels = labels[order]
+  same = (rows[1:] == rows[:-1]).all(axis=1) & (labels[1:] != labels[:-1])
+  matched = numpy.zeros(len(rows), dtype=bool)
+  matched[1:] |= same
+  matched[:-1] |= same
+
+  changed = rows[~matched]
+  v0 = changed[:,0:3]
+  return numpy.concatenate((v0[:,None], (v0 + changed[:,3:6])[:,None], (v0 + changed[:,6:9])[:,None]), axis=1)
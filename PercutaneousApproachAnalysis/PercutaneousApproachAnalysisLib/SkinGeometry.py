@@ -0,0 +1,220 @@
+import numpy
+import vtk
+from vtk.util import numpy_support
+
+from . import Accessibility
+from .Cache import digest, cellConnectivity, polyDataDigest
+
+# Bump when the preprocessing changes, so that a skin cached on disk by an
+# older version is not used
+SKIN_GEOMETRY_VERSION = 1
+
+#
+# Skin preprocessing shared by path generation, scoring and the color map
+#
+
+def voxelClusters(positions, voxelSize):
+  """Group positions by cubic voxels of edge voxelSize.  Returns the index
+  of one sample per occupied voxel and, for every position, the index into
+  the samples of the voxel it belongs to.
+  """
+  if len(positions) == 0:
+    return (numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64))
+
+  cells = numpy.floor((positions - positions.min(axis=0)) / voxelSize).astype(numpy.int64)
+  dimensions = cells.max(axis=0) + 1
+  keys = (cells[:,0]*dimensions[1] + cells[:,1])*dimensions[2] + cells[:,2]
+  (unique, samples, representatives) = numpy.unique(keys, return_index=True, return_inverse=True)
+
+  return (samples, representatives)
+
+
+def geometryCopy(polyData):
+  """Deep copy of the points and cells of a polydata, without its point
+  and cell data.  The copy is independent of the scene, so it can be
+  processed in a worker thread.
+  """
+  copy = vtk.vtkPolyData()
+  if polyData.GetPoints() is not None:
+    points = vtk.vtkPoints()
+    points.DeepCopy(polyData.GetPoints())
+    copy.SetPoints(points)
+  for name in ('Verts', 'Lines', 'Polys', 'Strips'):
+    cells = getattr(polyData, 'Get' + name)()
+    if cells is not None and cells.GetNumberOfCells() > 0:
+      cellsCopy = vtk.vtkCellArray()
+      cellsCopy.DeepCopy(cells)
+      getattr(copy, 'Set' + name)(cellsCopy)
+
+  return copy
+
+
+class SkinGeometry(object):
+  """Skin surface with normals, triangle centers and areas.
+
+  vtkPolyDataNormals is run once, with point and cell normals, and all the
+  per-point and per-triangle arrays are read from its output.  triangles,
+  centers and areas are None when the surface has non-triangular cells.
+  sourceDigest is the polyDataDigest of the input when the skin was made
+  by cachedSkinGeometry, and None otherwise.
+  """
+
+  # Arrays stored by toArrays(), from which fromArrays() rebuilds the skin
+  arrayNames = ('points', 'pointNormals', 'cellNormals', 'triangles', 'centers', 'areas')
+
+  def __init__(self, polyData):
+    polyDataNormals = vtk.vtkPolyDataNormals()
+    if vtk.VTK_MAJOR_VERSION <= 5:
+      polyDataNormals.SetInput(polyData)
+    else:
+      polyDataNormals.SetInputData(polyData)
+    polyDataNormals.ComputeCellNormalsOn()
+    polyDataNormals.Update()
+
+    self.polyData = polyDataNormals.GetOutput()
+    self.numberOfPoints = self.polyData.GetNumberOfPoints()
+
+    self.points = self.vectors(self.polyData.GetPoints().GetData() if self.numberOfPoints > 0 else None)
+    self.pointNormals = self.vectors(self.polyData.GetPointData().GetNormals())
+    self.cellNormals = self.vectors(self.polyData.GetCellData().GetNormals())
+
+    self.triangles = None
+    self.centers = None
+    self.areas = None
+    mesh = Accessibility.skinTriangles(self.polyData)
+    if mesh is not None:
+      self.triangles = mesh[1]
+      (self.centers, self.areas) = Accessibility.triangleCentersAndAreas(self.points, self.triangles)
+
+    self.clusterCache = {}
+    self.contentDigest = None
+    self.sourceDigest = None
+    self.lastCellCache = None
+    self.outwardNormalCache = None
+
+  def toArrays(self):
+    """The arrays of a triangulated skin, e.g. to store it on disk"""
+    return dict((name, getattr(self, name)) for name in self.arrayNames)
+
+  @classmethod
+  def fromArrays(cls, arrays):
+    """Rebuild a triangulated skin from the output of toArrays() without
+    running vtkPolyDataNormals; its polyData holds the points, the
+    triangles and the normals."""
+    skin = cls.__new__(cls)
+    for name in cls.arrayNames:
+      setattr(skin, name, arrays[name])
+    skin.numberOfPoints = len(skin.points)
+
+    skin.polyData = vtk.vtkPolyData()
+    points = vtk.vtkPoints()
+    points.SetData(numpy_support.numpy_to_vtk(skin.points, deep=1))
+    skin.polyData.SetPoints(points)
+    polys = vtk.vtkCellArray()
+    idType = numpy.int64 if vtk.vtkIdTypeArray().GetDataTypeSize() == 8 else numpy.int32
+    nTriangles = len(skin.triangles)
+    if vtk.VTK_MAJOR_VERSION >= 9:
+      offsets = numpy.arange(0, 3*nTriangles + 1, 3, dtype=idType)
+      ids = skin.triangles.astype(idType).ravel()
+      polys.SetData(numpy_support.numpy_to_vtkIdTypeArray(offsets, deep=1), numpy_support.numpy_to_vtkIdTypeArray(ids, deep=1))
+    else:
+      cells = numpy.empty((nTriangles, 4), dtype=idType)
+      cells[:,0] = 3
+      cells[:,1:] = skin.triangles
+      polys.SetCells(nTriangles, numpy_support.numpy_to_vtkIdTypeArray(cells.ravel(), deep=1))
+    skin.polyData.SetPolys(polys)
+    for (normals, data) in ((skin.pointNormals, skin.polyData.GetPointData()), (skin.cellNormals, skin.polyData.GetCellData())):
+      vtkNormals = numpy_support.numpy_to_vtk(normals, deep=1)
+      vtkNormals.SetName("Normals")
+      data.SetNormals(vtkNormals)
+
+    skin.clusterCache = {}
+    skin.contentDigest = None
+    skin.sourceDigest = None
+    skin.lastCellCache = None
+    skin.outwardNormalCache = None
+    return skin
+
+  def clusters(self, voxelSize):
+    """Voxel clusters of the vertices and of the triangle centers, used
+    to cast a coarse subset of the rays.  Returns (pointSamples,
+    pointRepresentatives, cellSamples, cellRepresentatives); the cell
+    entries are None for non-triangular skins.
+    """
+    if voxelSize not in self.clusterCache:
+      (pointSamples, pointRepresentatives) = voxelClusters(self.points, voxelSize)
+      (cellSamples, cellRepresentatives) = (None, None)
+      if self.centers is not None:
+        (cellSamples, cellRepresentatives) = voxelClusters(self.centers, voxelSize)
+      self.clusterCache[voxelSize] = (pointSamples, pointRepresentatives, cellSamples, cellRepresentatives)
+
+    return self.clusterCache[voxelSize]
+
+  def outwardPointNormals(self):
+    """Point normals oriented out of the skin.  vtkPolyDataNormals makes
+    them consistent but not necessarily outward; they are flipped when
+    the triangles enclose a negative volume."""
+    if self.outwardNormalCache is None:
+      normals = self.pointNormals
+      if self.triangles is not None and len(self.triangles) > 0:
+        p = self.points - self.points.mean(axis=0)
+        volume = (p[self.triangles[:,0]] * numpy.cross(p[self.triangles[:,1]], p[self.triangles[:,2]])).sum()
+        if volume < 0:
+          normals = -normals
+      self.outwardNormalCache = normals
+    return self.outwardNormalCache
+
+  def lastCells(self):
+    """Last triangle of every point, used to scatter the per-triangle color
+    values to the points (see Accessibility.pointValuesFromCells)"""
+    if self.lastCellCache is None and self.triangles is not None:
+      self.lastCellCache = Accessibility.lastCellOfPoints(self.triangles, self.numberOfPoints)
+    return self.lastCellCache
+
+  def digest(self):
+    """Content hash of the points and cells, computed once"""
+    if self.contentDigest is None:
+      cells = [self.triangles]
+      if self.triangles is None:
+        cells = cellConnectivity(self.polyData.GetPolys())
+      self.contentDigest = digest(self.points, *cells)
+    return self.contentDigest
+
+  def vectors(self, vtkArray):
+    if vtkArray is None:
+      return numpy.zeros([0,3])
+    return numpy_support.vtk_to_numpy(vtkArray).astype(numpy.float64)
+
+  def memorySize(self):
+    """Approximate size of the arrays and the normals output in bytes"""
+    size = 1024 * self.polyData.GetActualMemorySize()
+    for array in (self.points, self.pointNormals, self.cellNormals, self.triangles, self.centers, self.areas, self.lastCellCache):
+      if array is not None:
+        size += array.nbytes
+    return size
+
+
+def cachedSkinGeometry(polyData, diskCache=None):
+  """SkinGeometry of the polydata, read back from the DiskCache when the
+  same points and cells were seen before.  The entry is keyed by the
+  polyDataDigest of the polydata, so a hit does not run
+  vtkPolyDataNormals.  Only triangulated skins are stored.
+  """
+  sourceDigest = polyDataDigest(polyData)
+  key = digest('SkinGeometry', SKIN_GEOMETRY_VERSION, sourceDigest)
+
+  skin = None
+  if diskCache is not None:
+    arrays = diskCache.get(key)
+    if arrays is not None:
+      try:
+        skin = SkinGeometry.fromArrays(arrays)
+      except KeyError:
+        skin = None
+  if skin is None:
+    skin = SkinGeometry(polyData)
+    if diskCache is not None and skin.triangles is not None:
+      diskCache.put(key, skin.toArrays())
+  skin.sourceDigest = sourceDigest
+
+  return skin
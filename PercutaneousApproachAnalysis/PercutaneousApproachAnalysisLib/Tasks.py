@@ -0,0 +1,85 @@
+import threading
+import traceback
+
+try:
+  import Queue as queue
+except ImportError:
+  import queue
+
+#
+# Background execution of the analysis
+#
+# The worker thread never touches the MRML scene or the widgets.  It posts
+# messages to a queue that the main thread drains from a QTimer, and the
+# main thread applies the results to the scene.
+#
+
+class AnalysisCancelled(Exception):
+  """Raised in the worker thread once the task has been cancelled"""
+  pass
+
+
+class BackgroundTask(object):
+  """Run function(task) in a worker thread.
+
+  The function reports its progress with task.reportProgress(done, total)
+  and hands intermediate results to the main thread with task.post(kind,
+  value).  Both raise AnalysisCancelled after cancel(), which is how a
+  long computation stops at its next chunk.  poll() returns the pending
+  (kind, value) messages without blocking; the last one is ('finished',
+  None), after which result, error and cancelled are final.
+  """
+
+  def __init__(self, function):
+    self.function = function
+    self.messages = queue.Queue()
+    self.cancelEvent = threading.Event()
+    self.result = None
+    self.error = None
+    self.errorTraceback = None
+    self.cancelled = False
+    self.finished = False
+    self.thread = threading.Thread(target=self.run)
+    self.thread.daemon = True
+
+  def start(self):
+    self.thread.start()
+
+  def run(self):
+    try:
+      self.result = self.function(self)
+    except AnalysisCancelled:
+      self.cancelled = True
+    except Exception as e:
+      self.error = e
+      self.errorTraceback = traceback.format_exc()
+    self.messages.put(('finished', None))
+
+  def cancel(self):
+    self.cancelEvent.set()
+
+  def cancelRequested(self):
+    return self.cancelEvent.is_set()
+
+  def checkCancelled(self):
+    if self.cancelRequested():
+      raise AnalysisCancelled()
+
+  def reportProgress(self, done, total):
+    self.post('progress', (done, total))
+
+  def post(self, kind, value):
+    self.checkCancelled()
+    self.messages.put((kind, value))
+
+  def poll(self):
+    messages = []
+    while True:
+      try:
+        message = self.messages.get_nowait()
+      except queue.Empty:
+        break
+      if message[0] == 'finished':
+        self.finished = True
+      messages.append(message)
+    return messages
@@ -0,0 +1,312 @@
+import numpy
+
+from .RayCasting import ObstacleBVH, changedTriangles
+from .Paths import PathTable
+from . import Accessibility
+from .Cache import digest
+
+# Bump when the ray casting changes, so that results cached on disk by an
+# older version are not used
+VISIBILITY_VERSION = 2
+
+#
+# One visibility pass per skin, obstacle and target
+#
+
+def sameGeometry(a, b):
+  """Whether two SkinGeometry or ObstacleBVH objects hold the same
+  geometry: the same object, or equal content digests"""
+  return a is b or a.digest() == b.digest()
+
+
+class SkinVisibility(object):
+  """Which skin vertices and triangle centers see the target.
+
+  The vertices (used for the candidate paths) and the triangle centers
+  (used for the score and the color map) are cast in a single batch.
+  cellClear is None when the skin has non-triangular cells.
+
+  With a voxelSize, only one vertex and one triangle per voxel is cast and
+  the others take the result of their voxel.  This gives a coarse preview
+  at a fraction of the cost.
+
+  A CandidateFilter rejects vertices, i.e. path entry points, before they
+  are cast; removed holds the number of rays each of its tests saved.  The
+  triangle centers are always cast, so the score does not depend on it.
+  """
+
+  def __init__(self, skin, obstacle, target, segmentsClear, voxelSize=None, knownCells=None, candidateFilter=None):
+    """segmentsClear(obstacle, starts, end) runs the batch ray casting.
+    knownCells = (mask, clear) gives triangle results that are already
+    known, e.g. from a progressive pass, and are not cast again.
+    """
+    self.skin = skin
+    self.obstacle = obstacle
+    self.target = tuple(float(c) for c in target)
+    self.voxelSize = voxelSize
+    self.filterKey = candidateFilter.key() if candidateFilter is not None else None
+
+    points = skin.points
+    normals = skin.outwardPointNormals() if self.filterKey is not None else None
+    centers = skin.centers
+    if voxelSize != None:
+      (pointSamples, pointRepresentatives, cellSamples, cellRepresentatives) = skin.clusters(voxelSize)
+      points = points[pointSamples]
+      if normals is not None:
+        normals = normals[pointSamples]
+      if centers is not None:
+        centers = centers[cellSamples]
+
+    # Start points of the rays actually cast; the first numberOfVertexRays
+    # are skin vertices, the rest triangle centers
+    self.starts = points
+    if centers is not None:
+      self.starts = numpy.concatenate((points, centers))
+    self.numberOfVertexRays = len(points)
+
+    cast = numpy.ones(len(self.starts), dtype=bool)
+    self.clear = numpy.zeros(len(self.starts), dtype=bool)
+    self.removed = None
+    if self.filterKey is not None:
+      self.removed = candidateFilter.newCounts()
+      cast[:self.numberOfVertexRays] = candidateFilter.mask(points, normals, self.target, self.removed)
+    self.culled = ~cast
+    if knownCells is not None and voxelSize == None and centers is not None:
+      (knownMask, knownClear) = knownCells
+      cast[self.numberOfVertexRays:] = ~knownMask
+      self.clear[self.numberOfVertexRays:][knownMask] = knownClear[knownMask]
+    if cast.any():
+      self.clear[cast] = segmentsClear(obstacle, self.starts[cast], numpy.array(self.target))
+    self.expand()
+
+  def expand(self):
+    """Fill vertexClear and cellClear from the rays that were cast"""
+    self.vertexClear = self.clear[:self.numberOfVertexRays]
+    self.cellClear = None
+    if self.skin.centers is not None:
+      self.cellClear = self.clear[self.numberOfVertexRays:]
+
+    if self.voxelSize != None:
+      (pointSamples, pointRepresentatives, cellSamples, cellRepresentatives) = self.skin.clusters(self.voxelSize)
+      self.vertexClear = self.vertexClear[pointRepresentatives]
+      if self.cellClear is not None:
+        self.cellClear = self.cellClear[cellRepresentatives]
+
+  @classmethod
+  def fromClear(cls, skin, obstacle, target, clear, candidateFilter=None):
+    """Rebuild the full visibility pass from its clear array, e.g. as
+    stored in a DiskCache"""
+    visibility = cls.__new__(cls)
+    visibility.skin = skin
+    visibility.obstacle = obstacle
+    visibility.target = tuple(float(c) for c in target)
+    visibility.voxelSize = None
+    visibility.filterKey = candidateFilter.key() if candidateFilter is not None else None
+    visibility.starts = skin.points
+    if skin.centers is not None:
+      visibility.starts = numpy.concatenate((skin.points, skin.centers))
+    visibility.numberOfVertexRays = len(skin.points)
+    if len(clear) != len(visibility.starts):
+      raise ValueError("the clear array does not match the skin")
+    visibility.clear = numpy.asarray(clear, dtype=bool)
+
+    # The filter is cheap to run again for the culled rays and the counts
+    visibility.culled = numpy.zeros(len(visibility.starts), dtype=bool)
+    visibility.removed = None
+    if visibility.filterKey is not None:
+      visibility.removed = candidateFilter.newCounts()
+      visibility.culled[:visibility.numberOfVertexRays] = ~candidateFilter.mask(skin.points, skin.outwardPointNormals(), visibility.target, visibility.removed)
+
+    visibility.expand()
+    return visibility
+
+  def matches(self, skin, obstacle, target, voxelSize=None, candidateFilter=None):
+    """Whether this is the pass of these inputs.  The skin and the
+    obstacle are compared by content, so that a new SkinGeometry or
+    ObstacleBVH of an unchanged model still matches."""
+    filterKey = candidateFilter.key() if candidateFilter is not None else None
+    return (self.target == tuple(float(c) for c in target) and
+            self.voxelSize == voxelSize and self.filterKey == filterKey and
+            sameGeometry(self.skin, skin) and sameGeometry(self.obstacle, obstacle))
+
+  def updatedForObstacle(self, obstacle, segmentsClear, maximumChangedFraction=0.25):
+    """Return the visibility against a modified obstacle.
+
+    Triangles present in only one of the old and new obstacles are the
+    changed ones.  Only the rays crossing the bounding box of a changed
+    triangle are cast again; every other ray keeps its previous result.
+    Returns None when too much of the obstacle changed for this to pay off.
+    """
+    changed = changedTriangles(self.obstacle, obstacle)
+    total = max(self.obstacle.numberOfTriangles + obstacle.numberOfTriangles, 1)
+    if len(changed) > maximumChangedFraction * total:
+      return None
+
+    updated = SkinVisibility.__new__(SkinVisibility)
+    updated.__dict__.update(self.__dict__)
+    updated.obstacle = obstacle
+    updated.clear = self.clear.copy()
+
+    if len(changed) > 0:
+      changedBVH = ObstacleBVH(changed.reshape(-1, 3), numpy.arange(3*len(changed)).reshape(-1, 3), 1, obstacle.tolerance)
+      affected = ~changedBVH.segmentsClear(self.starts, numpy.array(self.target), boxesOnly=True) & ~self.culled
+      if affected.any():
+        updated.clear[affected] = segmentsClear(obstacle, self.starts[affected], numpy.array(self.target))
+
+    updated.expand()
+    return updated
+
+
+def visibilityKey(skin, obstacle, target, candidateFilter=None):
+  """DiskCache key of the full visibility pass of a skin, an obstacle and a
+  target.  It is made from the sourceDigest of the skin and the obstacle,
+  which is known without preprocessing the polydata again (see
+  cachedSkinGeometry and cachedObstacleBVH); None when either has none."""
+  if skin.sourceDigest is None or obstacle.sourceDigest is None:
+    return None
+  target = tuple(float(c) for c in target)
+  filterKey = candidateFilter.key() if candidateFilter is not None else None
+  return digest('SkinVisibility', VISIBILITY_VERSION, skin.sourceDigest, obstacle.sourceDigest, target, filterKey)
+
+
+class TargetSweep(object):
+  """Visibility of the skin vertices from many target points.
+
+  The rays of several targets are cast in one call to segmentsClear, with
+  about raysPerBatch rays per call, so a worker pool is kept busy even for
+  small skins.  paths is the PathTable of the approachable paths and
+  reachableCounts the number of targets each skin vertex sees.  A
+  CandidateFilter skips the rays it rejects, counted in removed.
+  """
+
+  def __init__(self, skin, obstacle, targets, segmentsClear, raysPerBatch=500000, pathStorage='indices', dtype=numpy.float64,
+               candidateFilter=None):
+    self.skin = skin
+    self.obstacle = obstacle
+    self.targets = numpy.array(targets, dtype=numpy.float64).reshape(-1, 3)
+    self.filterKey = candidateFilter.key() if candidateFilter is not None else None
+    self.paths = PathTable(self.targets, skin.points, pathStorage, dtype)
+    self.reachableCounts = numpy.zeros(skin.numberOfPoints, dtype=numpy.int64)
+
+    normals = None
+    self.removed = None
+    if self.filterKey is not None:
+      normals = skin.outwardPointNormals()
+      self.removed = candidateFilter.newCounts()
+    else:
+      candidateFilter = None
+
+    for (begin, clear) in targetBatches(skin.points, self.targets, obstacle, segmentsClear, raysPerBatch,
+                                        candidateFilter, normals, self.removed):
+      self.reachableCounts += clear.sum(axis=0)
+      for (index, row) in enumerate(clear):
+        self.paths.setTarget(begin + index, row)
+
+  def reachability(self):
+    """Fraction of the targets reachable from each skin vertex"""
+    return self.reachableCounts / float(max(len(self.targets), 1))
+
+  def matches(self, skin, obstacle, targets, candidateFilter=None):
+    targets = numpy.asarray(targets, dtype=numpy.float64).reshape(-1, 3)
+    filterKey = candidateFilter.key() if candidateFilter is not None else None
+    return (self.filterKey == filterKey and self.targets.shape == targets.shape and (self.targets == targets).all() and
+            sameGeometry(self.skin, skin) and sameGeometry(self.obstacle, obstacle))
+
+
+def targetBatches(starts, targets, obstacle, segmentsClear, raysPerBatch=500000, candidateFilter=None, normals=None, removed=None):
+  """Cast the segments from all the starts to consecutive batches of
+  targets.  Yields (first target index, clear) where clear[i, j] tells
+  whether starts[j] sees targets[first + i].  With a CandidateFilter (and
+  the normals of the starts), the rejected segments are not cast and are
+  not clear.
+  """
+  nStarts = len(starts)
+  targetsPerBatch = max(1, raysPerBatch // max(nStarts, 1))
+  for begin in range(0, len(targets), targetsPerBatch):
+    batch = targets[begin:begin + targetsPerBatch]
+    batchStarts = numpy.tile(starts, (len(batch), 1))
+    ends = numpy.repeat(batch, nStarts, axis=0)
+    if candidateFilter is None:
+      yield (begin, segmentsClear(obstacle, batchStarts, ends).reshape(len(batch), nStarts))
+      continue
+    cast = candidateFilter.mask(starts, normals, batch, removed).ravel()
+    clear = numpy.zeros(len(cast), dtype=bool)
+    if cast.any():
+      clear[cast] = segmentsClear(obstacle, batchStarts[cast], ends[cast])
+    yield (begin, clear.reshape(len(batch), nStarts))
+
+
+def targetScores(skin, obstacle, targets, segmentsClear, needleLength=130.0, raysPerBatch=500000):
+  """Accessible skin area score of every target point, equal to the score
+  of Accessibility.approachScore() for each of them.  skin must be
+  triangulated.
+  """
+  targets = numpy.asarray(targets, dtype=numpy.float64).reshape(-1, 3)
+  scores = numpy.zeros(len(targets))
+
+  for (begin, clear) in targetBatches(skin.centers, targets, obstacle, segmentsClear, raysPerBatch):
+    batch = targets[begin:begin + len(clear)]
+    distances = numpy.sqrt(numpy.array([Accessibility.squaredDistances(skin.centers, target[None,:]) for target in batch]))
+    reachable = clear & (distances < needleLength)
+    modifiedAreas = numpy.where(reachable, skin.areas[None,:] * (needleLength - distances) / needleLength, 0.0)
+    # Adding the zeros of the other triangles does not change the
+    # cumulative sums, so every score is bit-identical to approachScore()
+    if modifiedAreas.shape[1] > 0:
+      scores[begin:begin + len(clear)] = numpy.cumsum(modifiedAreas, axis=1)[:,-1]
+
+  return scores
+
+
+class ProgressiveCellVisibility(object):
+  """Coarse-to-fine visibility of the triangle centers.
+
+  Each level casts one triangle per voxel (see SkinGeometry.clusters) and
+  every triangle takes the result of its voxel.  Rays cast at a coarser
+  level are never cast again, and the exact result is obtained by casting
+  the triangles that remain unknown.
+  """
+
+  def __init__(self, skin, obstacle, target, segmentsClear):
+    self.skin = skin
+    self.obstacle = obstacle
+    self.target = numpy.array(target, dtype=numpy.float64)
+    self.segmentsClear = segmentsClear
+    self.known = numpy.zeros(len(skin.centers), dtype=bool)
+    self.clear = numpy.zeros(len(skin.centers), dtype=bool)
+
+  def level(self, voxelSize):
+    """Return the approximate cellClear for one voxel size"""
+    (pointSamples, pointRepresentatives, cellSamples, cellRepresentatives) = self.skin.clusters(voxelSize)
+    todo = cellSamples[~self.known[cellSamples]]
+    if len(todo) > 0:
+      self.clear[todo] = self.segmentsClear(self.obstacle, self.skin.centers[todo], self.target)
+      self.known[todo] = True
+    return self.clear[cellSamples][cellRepresentatives]
+
+  def knownCells(self):
+    return (self.known, self.clear)
+
+
+def progressiveVoxelSizes(skin, raysPerSecond, latencyBudget, largestVoxelSize=64.0, finestFraction=0.25):
+  """Voxel sizes of the coarse levels, from coarse to fine.
+
+  The first level is the finest one whose rays can be cast within
+  latencyBudget seconds; each next level halves the voxel size, until a
+  level would cast more than finestFraction of the triangles.
+  """
+  nCells = len(skin.centers)
+  candidates = []
+  voxelSize = largestVoxelSize
+  while voxelSize >= 1.0:
+    nSamples = len(skin.clusters(voxelSize)[2])
+    if nSamples > finestFraction * nCells:
+      break
+    candidates.append((voxelSize, nSamples))
+    voxelSize = voxelSize / 2.0
+
+  first = 0
+  for (index, (voxelSize, nSamples)) in enumerate(candidates):
+    if nSamples <= latencyBudget * raysPerSecond:
+      first = index
+
+  return [voxelSize for (voxelSize, nSamples) in candidates[first:]]
@@ -0,0 +1,9 @@
+from .RayCasting import ObstacleBVH, triangulatedArrays, cachedObstacleBVH
+from .SkinGeometry import SkinGeometry, voxelClusters, geometryCopy, cachedSkinGeometry
+from .Visibility import SkinVisibility, visibilityKey, TargetSweep, targetBatches, targetScores, ProgressiveCellVisibility, progressiveVoxelSizes
+from .Parallel import RayCastingPool, RayCastingThreads
+from .Cache import LRUCache, DiskCache, digest, geometryVersion, polyDataDigest
+from . import Accessibility
+from .Tasks import BackgroundTask, AnalysisCancelled
+from .Paths import PathTable, PathLookup, pathExtremes, pathInsertionAngles, insertionAngleMap, stratifiedSample, pathLinesPolyData, movePathLines
+from .Culling import CandidateFilter
@@ -0,0 +1,645 @@
+import math
+import os
+import sys
+
+import numpy
+import pytest
+import vtk
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from PercutaneousApproachAnalysisLib import (ObstacleBVH, SkinGeometry, SkinVisibility, TargetSweep, ProgressiveCellVisibility,
+                                             RayCastingPool, RayCastingThreads, PathTable, DiskCache, Accessibility, targetScores, progressiveVoxelSizes,
+                                             AnalysisCancelled)
+from PercutaneousApproachAnalysisLib import Headless
+
+#
+# Tests of the Slicer-independent part of the module; they only need
+# numpy, vtk and pytest:
+#
+#   python -m pytest PercutaneousApproachAnalysis/Testing/Python
+#
+
+
+def sphere(center, radius, resolution):
+  source = vtk.vtkSphereSource()
+  source.SetCenter(center[0], center[1], center[2])
+  source.SetRadius(radius)
+  source.SetPhiResolution(resolution)
+  source.SetThetaResolution(resolution)
+  source.Update()
+  return source.GetOutput()
+
+
+def obstacleSpheres(centers, radius=8.0):
+  append = vtk.vtkAppendPolyData()
+  for center in centers:
+    append.AddInputData(sphere(center, radius, 16))
+  append.Update()
+  return append.GetOutput()
+
+
+def randomCenters(count, seed=0):
+  return numpy.random.RandomState(seed).uniform(-50.0, 50.0, (count, 3))
+
+
+def bspClear(polyData, starts, end):
+  """Reference visibility from one vtkModifiedBSPTree query per segment"""
+  bspTree = vtk.vtkModifiedBSPTree()
+  bspTree.SetDataSet(polyData)
+  bspTree.BuildLocator()
+
+  t = vtk.mutable(0.0)
+  x = [0.0, 0.0, 0.0]
+  pcoords = [0.0, 0.0, 0.0]
+  subId = vtk.mutable(0)
+  end = [float(c) for c in end]
+  clear = numpy.zeros(len(starts), dtype=bool)
+  for (index, start) in enumerate(starts):
+    clear[index] = bspTree.IntersectWithLine([float(c) for c in start], end, 0.001, t, x, pcoords, subId) == 0
+  return clear
+
+
+def cellLoopScore(skinPolyData, clear, target, needleLength):
+  """Reference score of calcApproachScoreByCell, given the per-cell
+  visibility"""
+  ids = vtk.vtkIdList()
+  p0 = [0.0, 0.0, 0.0]
+  p1 = [0.0, 0.0, 0.0]
+  p2 = [0.0, 0.0, 0.0]
+  center = [0.0, 0.0, 0.0]
+  accessibleArea = 0.0
+  for index in range(skinPolyData.GetNumberOfCells()):
+    area = skinPolyData.GetCell(index).ComputeArea()
+    skinPolyData.GetCellPoints(index, ids)
+    skinPolyData.GetPoint(ids.GetId(0), p0)
+    skinPolyData.GetPoint(ids.GetId(1), p1)
+    skinPolyData.GetPoint(ids.GetId(2), p2)
+    vtk.vtkTriangle.TriangleCenter(p0, p1, p2, center)
+    if clear[index]:
+      d = math.sqrt(vtk.vtkMath.Distance2BetweenPoints(center, target))
+      if d < needleLength:
+        accessibleArea = accessibleArea + area * (needleLength - d) / needleLength
+  return accessibleArea
+
+
+@pytest.fixture(scope='module')
+def case():
+  obstaclePolyData = obstacleSpheres(randomCenters(12))
+  skinPolyData = sphere((0.0, 0.0, 0.0), 120.0, 60)
+  skin = SkinGeometry(skinPolyData)
+  obstacle = ObstacleBVH.fromPolyData(obstaclePolyData)
+  target = numpy.array([3.0, -2.0, 1.0])
+  return {'obstaclePolyData': obstaclePolyData, 'skinPolyData': skinPolyData, 'skin': skin, 'obstacle': obstacle, 'target': target}
+
+
+def serialClear(obstacle, starts, ends):
+  return obstacle.segmentsClear(starts, ends)
+
+
+def test_segmentsClearMatchesBSPTree(case):
+  starts = case['skin'].points
+  target = case['target']
+
+  reference = bspClear(case['obstaclePolyData'], starts, target)
+  clear = case['obstacle'].segmentsClear(starts, target)
+
+  assert 0 < clear.sum() < len(clear)
+  assert numpy.count_nonzero(clear != reference) == 0
+
+
+def test_approachScoreMatchesCellLoop(case):
+  skin = case['skin']
+  target = case['target']
+  clear = bspClear(case['obstaclePolyData'], skin.centers, target)
+
+  for needleLength in (80.0, 130.0, 200.0):
+    (score, minDistance, minDistancePoint, values) = Accessibility.approachScore(skin.centers, skin.areas, clear, target, needleLength)
+    assert score == cellLoopScore(skin.polyData, clear, target, needleLength)
+
+
+def test_targetScoresMatchApproachScore(case):
+  skin = case['skin']
+  obstacle = case['obstacle']
+  targets = numpy.array([[3.0, -2.0, 1.0], [-20.0, 10.0, 5.0], [0.0, 30.0, -15.0]])
+
+  scores = targetScores(skin, obstacle, targets, serialClear, 130.0, raysPerBatch=2*len(skin.centers))
+  for (target, score) in zip(targets, scores):
+    clear = obstacle.segmentsClear(skin.centers, target)
+    assert score == Accessibility.approachScore(skin.centers, skin.areas, clear, target, 130.0)[0]
+    assert score == cellLoopScore(skin.polyData, clear, target, 130.0)
+
+
+def test_updatedForObstacleMatchesFullCast(case):
+  skin = case['skin']
+  target = case['target']
+  centers = randomCenters(12)
+  visibility = SkinVisibility(skin, ObstacleBVH.fromPolyData(obstacleSpheres(centers)), target, serialClear)
+
+  centers[3] += [15.0, -10.0, 5.0]
+  moved = ObstacleBVH.fromPolyData(obstacleSpheres(centers))
+  updated = visibility.updatedForObstacle(moved, serialClear)
+  full = SkinVisibility(skin, moved, target, serialClear)
+
+  assert updated is not None
+  assert (updated.clear != visibility.clear).any()
+  assert (updated.clear == full.clear).all()
+
+
+def test_passesMatchEqualGeometry(case):
+  target = case['target']
+  visibility = SkinVisibility(case['skin'], case['obstacle'], target, serialClear)
+  sweep = TargetSweep(case['skin'], case['obstacle'], [target], serialClear)
+
+  # A new preprocessing of the same models, as after a cache miss
+  skin = SkinGeometry(case['skinPolyData'])
+  obstacle = ObstacleBVH.fromPolyData(case['obstaclePolyData'])
+  assert visibility.matches(skin, obstacle, target)
+  assert sweep.matches(skin, obstacle, [target])
+
+  moved = ObstacleBVH.fromPolyData(obstacleSpheres(randomCenters(12) + 1.0))
+  assert not visibility.matches(skin, moved, target)
+  assert not sweep.matches(skin, moved, [target])
+  assert not visibility.matches(skin, obstacle, target + 1.0)
+
+
+def test_progressiveLevelsMatchFullCast(case):
+  skin = case['skin']
+  obstacle = case['obstacle']
+  target = case['target']
+  full = SkinVisibility(skin, obstacle, target, serialClear)
+
+  progressive = ProgressiveCellVisibility(skin, obstacle, target, serialClear)
+  voxelSizes = progressiveVoxelSizes(skin, 1e9, 1.0)
+  assert len(voxelSizes) > 0
+  for voxelSize in voxelSizes:
+    cellClear = progressive.level(voxelSize)
+    cellSamples = skin.clusters(voxelSize)[2]
+    assert (cellClear[cellSamples] == full.cellClear[cellSamples]).all()
+
+  (known, clear) = progressive.knownCells()
+  final = SkinVisibility(skin, obstacle, target, serialClear, knownCells=(known, clear))
+  assert (final.clear == full.clear).all()
+
+
+def test_poolMatchesSerial(case):
+  skin = case['skin']
+  obstacle = case['obstacle']
+  starts = numpy.tile(skin.points, (3, 1))
+  ends = numpy.repeat(numpy.array([[3.0, -2.0, 1.0], [-20.0, 10.0, 5.0], [0.0, 30.0, -15.0]]), len(skin.points), axis=0)
+
+  pool = RayCastingPool(obstacle, 2)
+  try:
+    assert (pool.segmentsClear(starts, ends) == obstacle.segmentsClear(starts, ends)).all()
+    assert (pool.segmentsClear(skin.points, case['target']) == obstacle.segmentsClear(skin.points, case['target'])).all()
+  finally:
+    pool.close()
+
+
+def test_threadsMatchSerial(case):
+  skin = case['skin']
+  obstacle = case['obstacle']
+  starts = numpy.tile(skin.points, (3, 1))
+  ends = numpy.repeat(numpy.array([[3.0, -2.0, 1.0], [-20.0, 10.0, 5.0], [0.0, 30.0, -15.0]]), len(skin.points), axis=0)
+
+  threads = RayCastingThreads(3)
+  try:
+    done = []
+    clear = threads.segmentsClear(obstacle, starts, ends, progress=lambda count, total: done.append(count))
+    assert (clear == obstacle.segmentsClear(starts, ends)).all()
+    assert done[-1] == len(starts)
+    assert (threads.segmentsClear(obstacle, skin.points, case['target']) == obstacle.segmentsClear(skin.points, case['target'])).all()
+  finally:
+    threads.close()
+
+
+class CountingObstacle(object):
+  def __init__(self, obstacle):
+    self.obstacle = obstacle
+    self.calls = 0
+
+  def segmentsClear(self, starts, ends):
+    self.calls += 1
+    return self.obstacle.segmentsClear(starts, ends)
+
+
+def test_threadsStopAfterCancel(case):
+  skin = case['skin']
+  obstacle = CountingObstacle(case['obstacle'])
+
+  def cancelled(count, total):
+    raise AnalysisCancelled()
+
+  threads = RayCastingThreads(2)
+  try:
+    with pytest.raises(AnalysisCancelled):
+      threads.segmentsClear(obstacle, skin.points, case['target'], chunksPerWorker=8, progress=cancelled)
+  finally:
+    threads.close()
+  # The first chunk and the one running next to it, out of 16
+  assert obstacle.calls == 2
+
+
+def test_pathTableStoragesAgree():
+  random = numpy.random.RandomState(1)
+  targets = random.uniform(-10.0, 10.0, (4, 3))
+  skinPoints = random.uniform(-100.0, 100.0, (300, 3))
+  tables = [PathTable(targets, skinPoints, storage) for storage in ('indices', 'bitset')]
+  for targetIndex in (0, 1, 3):
+    clear = random.rand(len(skinPoints)) > 0.6
+    for table in tables:
+      table.setTarget(targetIndex, clear)
+
+  (indices, bitset) = tables
+  assert len(indices) == len(bitset) > 0
+  for (a, b) in zip(indices.indexArrays(), bitset.indexArrays()):
+    assert (a == b).all()
+  for (a, b) in zip(indices.indexArrays(17, 120), bitset.indexArrays(17, 120)):
+    assert (a == b).all()
+  for index in (0, 5, len(indices) - 1):
+    assert indices.pathIndices(index) == bitset.pathIndices(index)
+  assert (indices.interleavedPoints() == bitset.interleavedPoints()).all()
+
+  arrays = indices.toArrays()
+  restored = PathTable(arrays['targetPoints'], arrays['skinPoints'], 'bitset')
+  for targetIndex in range(len(targets)):
+    clear = numpy.zeros(len(skinPoints), dtype=bool)
+    clear[arrays['skinIndices'][arrays['targetIndices'] == targetIndex]] = True
+    restored.setTarget(targetIndex, clear)
+  assert (restored.interleavedPoints() == indices.interleavedPoints()).all()
+
+
+def test_diskCacheHitAndEviction(tmpdir):
+  cache = DiskCache(str(tmpdir), maximumSize=10**9)
+  assert cache.get('missing') is None
+  cache.put('first', {'clear': numpy.arange(10) % 2 == 0})
+  arrays = cache.get('first')
+  assert (arrays['clear'] == (numpy.arange(10) % 2 == 0)).all()
+  assert (cache.hits, cache.misses) == (1, 1)
+
+  # Room for about two entries: the least recently used one goes
+  entrySize = os.path.getsize(cache.fileName('first'))
+  cache.maximumSize = int(2.5 * entrySize)
+  cache.put('second', {'clear': numpy.arange(10) % 3 == 0})
+  os.utime(cache.fileName('first'), (1, 1))
+  cache.put('third', {'clear': numpy.arange(10) % 5 == 0})
+  assert cache.get('first') is None
+  assert cache.get('second') is not None
+  assert cache.get('third') is not None
+
+
+def test_diskCacheRemovesTemporaryFiles(tmpdir):
+  import glob
+
+  cache = DiskCache(str(tmpdir))
+  # A failed write leaves neither the entry nor its temporary file
+  with pytest.raises(Exception):
+    cache.put('unpicklable', {'clear': numpy.array([lambda: None], dtype=object)})
+  assert glob.glob(os.path.join(str(tmpdir), '*')) == []
+
+  # Files of killed writers go once they are old, recent ones may still
+  # be written by another process
+  stale = cache.fileName('stale') + '.tmp-1'
+  recent = cache.fileName('recent') + '.tmp-2'
+  for fileName in (stale, recent):
+    open(fileName, 'wb').close()
+  os.utime(stale, (1, 1))
+  cache.put('first', {'clear': numpy.ones(3, dtype=bool)})
+  assert not os.path.exists(stale)
+  assert os.path.exists(recent)
+
+
+def test_diskCacheSkipsPreprocessing(tmpdir, monkeypatch):
+  from PercutaneousApproachAnalysisLib import cachedSkinGeometry, cachedObstacleBVH, polyDataDigest, visibilityKey
+
+  cache = DiskCache(str(tmpdir))
+  skinPolyData = sphere((0.0, 0.0, 0.0), 120.0, 30)
+  obstaclePolyData = obstacleSpheres(randomCenters(3))
+  skin = cachedSkinGeometry(skinPolyData, cache)
+  obstacle = cachedObstacleBVH(obstaclePolyData, cache)
+  target = [3.0, -2.0, 1.0]
+
+  # A hit neither runs vtkPolyDataNormals nor builds the hierarchy
+  def rebuilt(*args, **keywords):
+    raise AssertionError("rebuilt from the polydata")
+  monkeypatch.setattr(SkinGeometry, '__init__', rebuilt)
+  monkeypatch.setattr(ObstacleBVH, '__init__', rebuilt)
+  skinAgain = cachedSkinGeometry(skinPolyData, cache)
+  obstacleAgain = cachedObstacleBVH(obstaclePolyData, cache)
+  assert cache.hits == 2
+
+  for name in SkinGeometry.arrayNames:
+    assert (getattr(skinAgain, name) == getattr(skin, name)).all()
+  assert skinAgain.polyData.GetNumberOfPolys() == len(skin.triangles)
+  assert obstacleAgain.digest() == obstacle.digest()
+  assert visibilityKey(skinAgain, obstacleAgain, target) == visibilityKey(skin, obstacle, target)
+  assert (obstacleAgain.segmentsClear(skinAgain.points, target) == obstacle.segmentsClear(skin.points, target)).all()
+
+  # The key follows the points, not the point data
+  digest = polyDataDigest(skinPolyData)
+  colors = vtk.vtkDoubleArray()
+  colors.SetName("Colors")
+  colors.SetNumberOfTuples(skinPolyData.GetNumberOfPoints())
+  colors.Fill(0.0)
+  skinPolyData.GetPointData().AddArray(colors)
+  assert polyDataDigest(skinPolyData) == digest
+  skinPolyData.GetPoints().SetPoint(0, 1.0, 2.0, 3.0)
+  assert polyDataDigest(skinPolyData) != digest
+
+
+def writePolyData(polyData, fileName):
+  writer = vtk.vtkPolyDataWriter()
+  writer.SetFileName(fileName)
+  writer.SetInputData(polyData)
+  writer.Write()
+
+
+def test_headlessCommandLine(tmpdir):
+  directory = str(tmpdir)
+  writePolyData(sphere((0.0, 0.0, 0.0), 120.0, 30), os.path.join(directory, 'skin.vtk'))
+  writePolyData(obstacleSpheres(randomCenters(6)), os.path.join(directory, 'obstacle.vtk'))
+  targetsFile = open(os.path.join(directory, 'targets.csv'), 'w')
+  targetsFile.write("x,y,z,label\n3,-2,1,first\n-20,10,5,second\n")
+  targetsFile.close()
+
+  output = os.path.join(directory, 'results')
+  arguments = ['--skin', os.path.join(directory, 'skin.vtk'), '--obstacle', os.path.join(directory, 'obstacle.vtk'),
+               '--targets', os.path.join(directory, 'targets.csv'), '--output', output, '--cache', os.path.join(directory, 'cache')]
+  assert Headless.main(arguments) == 0
+
+  rows = open(os.path.join(output, 'scores.csv')).read().splitlines()
+  assert len(rows) == 3
+  assert [row.split(',')[0] for row in rows[1:]] == ['first', 'second']
+  paths = numpy.load(os.path.join(output, 'paths.npz'))
+  assert len(paths['skinIndices']) == len(paths['insertionAngles']) > 0
+  assert os.path.isfile(os.path.join(output, 'colors.vtk'))
+
+  # The second run reads the visibility from the cache
+  assert Headless.main(arguments + ['--output', os.path.join(directory, 'again')]) == 0
+  assert open(os.path.join(directory, 'again', 'scores.csv')).read() == open(os.path.join(output, 'scores.csv')).read()
+
+
+def test_batchRemovesKilledRuns(tmpdir):
+  from PercutaneousApproachAnalysisLib import Batch
+
+  directory = str(tmpdir)
+  writePolyData(sphere((0.0, 0.0, 0.0), 120.0, 20), os.path.join(directory, 'skin.vtk'))
+  writePolyData(obstacleSpheres(randomCenters(3)), os.path.join(directory, 'obstacle.vtk'))
+  targetsFile = open(os.path.join(directory, 'targets.csv'), 'w')
+  targetsFile.write("x,y,z,label\n3,-2,1,first\n")
+  targetsFile.close()
+  case = {'name': 'case01', 'skin': os.path.join(directory, 'skin.vtk'), 'obstacles': [os.path.join(directory, 'obstacle.vtk')],
+          'targets': os.path.join(directory, 'targets.csv')}
+
+  # Temporary directory of a run killed in another process
+  output = os.path.join(directory, 'results')
+  os.makedirs(os.path.join(output, 'case01.tmp-1', 'partial'))
+  summaries = Batch.runBatch([case], output)
+  assert 'error' not in summaries[0]
+  assert sorted(os.listdir(output)) == ['case01']
+
+
+def test_geometryVersionIgnoresScalars():
+  from PercutaneousApproachAnalysisLib import LRUCache, geometryVersion
+  from vtk.util import numpy_support
+
+  polyData = sphere((0.0, 0.0, 0.0), 50.0, 20)
+  cache = LRUCache(10**9, lambda item: 1)
+  cache.put(('skin', 'vtkMRMLModelNode1') + geometryVersion(polyData), 'preprocessed')
+
+  # Color map writes, as done by the module after every analysis
+  colors = numpy_support.numpy_to_vtk(numpy.zeros(polyData.GetNumberOfPoints()), deep=1, array_type=vtk.VTK_DOUBLE)
+  colors.SetName("Colors")
+  polyData.GetPointData().AddArray(colors)
+  colors.Modified()
+  polyData.Modified()
+  assert cache.get(('skin', 'vtkMRMLModelNode1') + geometryVersion(polyData)) == 'preprocessed'
+
+  # A geometry edit does change the key
+  polyData.GetPoints().SetPoint(0, 1.0, 2.0, 3.0)
+  polyData.GetPoints().Modified()
+  assert cache.get(('skin', 'vtkMRMLModelNode1') + geometryVersion(polyData)) is None
+
+
+def test_geometryCopyIsStandalone():
+  from PercutaneousApproachAnalysisLib import geometryCopy
+
+  from vtk.util import numpy_support
+
+  polyData = sphere((0.0, 0.0, 0.0), 50.0, 20)
+  colors = numpy_support.numpy_to_vtk(numpy.zeros(polyData.GetNumberOfPoints()), deep=1, array_type=vtk.VTK_DOUBLE)
+  colors.SetName("Colors")
+  polyData.GetPointData().AddArray(colors)
+  copy = geometryCopy(polyData)
+  assert copy.GetPoints().GetData() is not polyData.GetPoints().GetData()
+  assert copy.GetPointData().GetNumberOfArrays() == 0
+  assert SkinGeometry(copy).digest() == SkinGeometry(polyData).digest()
+
+  # Editing the scene polydata leaves the copy alone
+  polyData.GetPoints().SetPoint(0, 1.0, 2.0, 3.0)
+  assert SkinGeometry(copy).digest() != SkinGeometry(polyData).digest()
+
+
+def test_pathLinesShareTheBuffers():
+  from PercutaneousApproachAnalysisLib import pathLinesPolyData
+  from PercutaneousApproachAnalysisLib.Cache import cellConnectivity
+
+  points = numpy.random.RandomState(2).uniform(-100.0, 100.0, (20, 3))
+  polyData = vtk.vtkPolyData()
+  (vtkPoints, p) = pathLinesPolyData(polyData, points)
+  assert polyData.GetPoints() is vtkPoints
+  assert polyData.GetNumberOfLines() == 10
+  assert polyData.GetNumberOfPolys() == 0
+  (offsets, ids) = cellConnectivity(polyData.GetLines())
+  assert (offsets == numpy.arange(0, 21, 2)).all()
+  assert (ids == numpy.arange(20)).all()
+
+  # The points are not copied: editing the array moves the lines
+  p[0] = [1.0, 2.0, 3.0]
+  assert polyData.GetPoint(0) == (1.0, 2.0, 3.0)
+
+  # Other dtypes are converted, and an empty path gives an empty model
+  (vtkPoints, p) = pathLinesPolyData(polyData, points.astype(numpy.int32))
+  assert p.dtype == numpy.float64
+  pathLinesPolyData(polyData, points[:0])
+  assert (polyData.GetNumberOfPoints(), polyData.GetNumberOfLines()) == (0, 0)
+
+
+def test_movePathLinesInPlace():
+  from PercutaneousApproachAnalysisLib import pathLinesPolyData, movePathLines
+
+  points = numpy.random.RandomState(3).uniform(-100.0, 100.0, (20, 3))
+  polyData = vtk.vtkPolyData()
+  (vtkPoints, p) = pathLinesPolyData(polyData, points.copy())
+  lines = polyData.GetLines()
+  modified = polyData.GetMTime()
+
+  # Same number of lines: the buffer and the cells are kept
+  moved = points + 5.0
+  assert movePathLines(polyData, moved)
+  assert polyData.GetPoints() is vtkPoints
+  assert polyData.GetLines() is lines
+  assert (p == moved).all()
+  assert polyData.GetMTime() > modified
+
+  # Another number of lines is left to pathLinesPolyData()
+  assert not movePathLines(polyData, points[:10])
+  assert (p == moved).all()
+  assert not movePathLines(vtk.vtkPolyData(), points)
+
+
+def test_targetSweepMatchesPerTargetCasts(case):
+  skin = case['skin']
+  obstacle = case['obstacle']
+  targets = numpy.array([[3.0, -2.0, 1.0], [-20.0, 10.0, 5.0], [0.0, 30.0, -15.0], [10.0, 10.0, 10.0]])
+
+  # Two targets per batch
+  sweep = TargetSweep(skin, obstacle, targets, serialClear, raysPerBatch=2*len(skin.points))
+  counts = numpy.zeros(len(skin.points), dtype=numpy.int64)
+  for (index, target) in enumerate(targets):
+    clear = obstacle.segmentsClear(skin.points, target)
+    assert (sweep.paths.targetSkinIndices(index) == numpy.nonzero(clear)[0]).all()
+    counts += clear
+  assert (sweep.reachableCounts == counts).all()
+  assert (sweep.reachability() == counts / 4.0).all()
+  # Some vertices see only some of the targets
+  assert ((counts > 0) & (counts < len(targets))).any()
+  assert len(sweep.paths) == counts.sum()
+
+
+def test_targetBatchesMatchPerTargetCasts(case):
+  from PercutaneousApproachAnalysisLib import targetBatches, CandidateFilter
+
+  skin = case['skin']
+  obstacle = case['obstacle']
+  targets = numpy.array([[3.0, -2.0, 1.0], [-20.0, 10.0, 5.0], [0.0, 30.0, -15.0]])
+  full = [obstacle.segmentsClear(skin.centers, target) for target in targets]
+
+  # One, two and all the targets per batch
+  for targetsPerBatch in (1, 2, 3):
+    first = []
+    for (begin, clear) in targetBatches(skin.centers, targets, obstacle, serialClear, targetsPerBatch*len(skin.centers)):
+      first.append(begin)
+      for (index, row) in enumerate(clear):
+        assert (row == full[begin + index]).all()
+    assert first == list(range(0, 3, targetsPerBatch))
+
+  # Rejected candidates are not cast and not clear
+  candidateFilter = CandidateFilter(maximumDistance=120.0)
+  normals = skin.cellNormals
+  removed = candidateFilter.newCounts()
+  for (begin, clear) in targetBatches(skin.centers, targets, obstacle, serialClear, candidateFilter=candidateFilter, normals=normals,
+                                      removed=removed):
+    keep = candidateFilter.mask(skin.centers, normals, targets)
+    assert (clear == keep & numpy.array(full)).all()
+  assert removed['reach'] == numpy.count_nonzero(~keep) > 0
+
+
+def test_candidateFilterMatchesPointLoop():
+  from PercutaneousApproachAnalysisLib import CandidateFilter
+
+  random = numpy.random.RandomState(4)
+  points = random.uniform(-100.0, 100.0, (200, 3))
+  normals = points / numpy.sqrt((points*points).sum(axis=1))[:,None] + random.normal(0.0, 0.5, (len(points), 3))
+  normals /= numpy.sqrt((normals*normals).sum(axis=1))[:,None]
+  normals[random.rand(len(points)) < 0.2] *= -1.0
+  targets = random.uniform(-10.0, 10.0, (3, 3))
+
+  candidateFilter = CandidateFilter(maximumDistance=120.0, backFacing=True, maximumAngle=40.0)
+  removed = candidateFilter.newCounts()
+  keep = candidateFilter.mask(points, normals, targets, removed)
+
+  # The tests run in order, and a candidate is counted by the first one
+  # that rejects it
+  expected = candidateFilter.newCounts()
+  for (i, target) in enumerate(targets):
+    for (j, (point, normal)) in enumerate(zip(points, normals)):
+      direction = point - target
+      length = math.sqrt((direction*direction).sum())
+      cosine = (direction*normal).sum() / length
+      passed = True
+      for (name, ok) in (('reach', length < 120.0), ('facing', cosine > 0.0), ('angle', cosine >= math.cos(math.radians(40.0)))):
+        if passed and not ok:
+          expected[name] += 1
+          passed = False
+      assert keep[i, j] == passed
+  assert removed == expected
+  assert min(removed.values()) > 0
+
+  assert (candidateFilter.mask(points, normals, targets[0]) == keep[0]).all()
+  assert CandidateFilter().key() is None
+  assert CandidateFilter().mask(points, normals, targets).all()
+
+
+def test_insertionAnglesMatchPathLoop():
+  from PercutaneousApproachAnalysisLib import pathInsertionAngles, insertionAngleMap
+
+  random = numpy.random.RandomState(5)
+  normals = random.normal(size=(300, 3))
+  normals /= numpy.sqrt((normals*normals).sum(axis=1))[:,None]
+  skinPoints = 100.0 * normals
+  targets = numpy.array([[0.0, 0.0, 0.0], [30.0, -20.0, 10.0]])
+  paths = PathTable(targets, skinPoints)
+  for index in range(len(targets)):
+    paths.setTarget(index, random.rand(len(skinPoints)) > 0.5)
+
+  angles = pathInsertionAngles(paths, normals)
+  (targetIndices, skinIndices) = paths.indexArrays()
+  for (index, (t, s)) in enumerate(zip(targetIndices, skinIndices)):
+    direction = skinPoints[s] - targets[t]
+    cosine = (direction*normals[s]).sum() / math.sqrt((direction*direction).sum())
+    assert abs(angles[index] - math.degrees(math.acos(max(-1.0, min(1.0, cosine))))) < 1e-9
+  # From the center of the sphere every path is perpendicular
+  assert angles[:paths.counts[0]].max() < 1e-5
+
+  values = insertionAngleMap(paths, angles)
+  for s in range(len(skinPoints)):
+    entering = angles[skinIndices == s]
+    assert values[s] == (entering.min() if len(entering) > 0 else -1.0)
+
+
+def test_pathLookupMatchesPathTable():
+  from PercutaneousApproachAnalysisLib import PathLookup
+
+  random = numpy.random.RandomState(6)
+  targets = random.uniform(-10.0, 10.0, (2, 3))
+  skinPoints = random.uniform(-100.0, 100.0, (200, 3))
+  paths = PathTable(targets, skinPoints)
+  for index in range(len(targets)):
+    paths.setTarget(index, random.rand(len(skinPoints)) > 0.5)
+
+  lookup = PathLookup(paths)
+  assert len(lookup) == len(paths)
+  for index in range(len(paths)):
+    target = paths.targetPoint(index)
+    entry = paths.entryPoint(index)
+    (ends, length) = lookup.path(index)
+    assert numpy.allclose(ends, [target, entry])
+    assert abs(length - math.sqrt(((entry - target)**2).sum())) < 1e-9
+    assert numpy.allclose(lookup.pointOnPath(index, 0), entry)
+    assert numpy.allclose(lookup.pointOnPath(index, -1000), target)
+    assert numpy.allclose(lookup.pointOnPath(index, 500), entry + 0.5*(entry - target))
+
+  point = numpy.array([1.0, 2.0, 3.0])
+  (ends, distance) = lookup.extension(3, point)
+  assert numpy.allclose(ends, [point, paths.entryPoint(3)])
+  assert abs(distance - math.sqrt(((paths.entryPoint(3) - point)**2).sum())) < 1e-9
+  assert numpy.allclose(lookup.interleavedPoints(numpy.arange(len(paths))), paths.interleavedPoints())
+
+
+def test_stratifiedSampleKeepsSparseRegions():
+  from PercutaneousApproachAnalysisLib import stratifiedSample
+
+  random = numpy.random.RandomState(7)
+  dense = random.normal(0.0, 1.0, (2000, 3)) + [100.0, 0.0, 0.0]
+  sparse = random.uniform(-100.0, -50.0, (20, 3))
+  paths = PathTable([[0.0, 0.0, 0.0]], numpy.vstack((dense, sparse)))
+  paths.setTarget(0, numpy.ones(len(dense) + len(sparse), dtype=bool))
+
+  assert (stratifiedSample(paths, 5000) == numpy.arange(len(paths))).all()
+
+  sample = stratifiedSample(paths, 100)
+  assert len(sample) == 100
+  assert (numpy.diff(sample) > 0).all()
+  # A uniform sample would keep about one of the sparse paths
+  assert numpy.count_nonzero(sample >= len(dense)) == len(sparse)